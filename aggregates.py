@@ -0,0 +1,660 @@
+import json
+import os
+import re
+import threading
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from canonical import add_canonical_columns
+from manifest import file_signature
+from metrics import span
+from sessions import (
+    EMPTY_SESSION_STATS,
+    compute_session_stats,
+    empty_events,
+    events_from_rows,
+    longest_streak,
+    merge_events,
+    merge_session_stats,
+)
+from topk import DEFAULT_TOP_K, TopKSketch
+
+WEEKDAY_NAMES = [
+    "Monday",
+    "Tuesday",
+    "Wednesday",
+    "Thursday",
+    "Friday",
+    "Saturday",
+    "Sunday",
+]
+
+
+def extract_video_id(video_link):
+    match = re.search(r"v=([^&]+)", video_link)
+    return match.group(1) if match else None
+
+
+# Upper bound for the enriched history held in memory at once. Bigger
+# histories are aggregated chunk by chunk.
+MEMORY_BUDGET_MB = float(os.environ.get("YOUTUBE_WRAPPED_MEMORY_BUDGET_MB", 512))
+
+# Read as text in every chunk, so a chunk of all numeric titles doesn't get
+# different keys than the whole file would
+TEXT_COLUMNS = {
+    column: str
+    for column in (
+        "video_name",
+        "video_link",
+        "channel_name",
+        "channel_link",
+        "category_name",
+        "video_id",
+        "channel_id",
+        "local_date",
+    )
+}
+
+SAMPLE_ROWS = 1000
+
+
+def load_wrapped_frame(data_dir) -> pd.DataFrame:
+    """
+    Loads the enriched watch history once, with local watch times and only
+    the rows that count towards the wrapped stats.
+    """
+    df = pd.read_csv(data_dir / "watch-history-enriched.csv", dtype=TEXT_COLUMNS)
+    return filter_wrapped_rows(df)
+
+
+def rows_within_budget(sample: pd.DataFrame, rows: float, memory_budget_mb=None) -> int | None:
+    """
+    Scales the loaded size of a sample frame up to `rows` rows. Returns None
+    when they all fit in the memory budget, otherwise the number of rows per
+    chunk that does.
+    """
+    memory_budget = (memory_budget_mb or MEMORY_BUDGET_MB) * 1024 * 1024
+    # Filtering, the derived columns and grouping roughly double a loaded frame
+    bytes_per_row = 2 * sample.memory_usage(deep=True).sum() / max(len(sample), 1)
+    if rows * bytes_per_row <= memory_budget:
+        return None
+    return max(SAMPLE_ROWS, int(memory_budget // bytes_per_row))
+
+
+def plan_chunksize(csv_path, memory_budget_mb=None) -> int | None:
+    """
+    Estimates the loaded size of a csv from a sample of its rows. Returns
+    None when the whole file fits in the memory budget, otherwise the
+    number of rows per chunk that does.
+    """
+    sample = pd.read_csv(csv_path, dtype=TEXT_COLUMNS, nrows=SAMPLE_ROWS)
+    if len(sample) < SAMPLE_ROWS:
+        return None
+
+    with open(csv_path, "rb") as f:
+        sample_bytes = sum(len(f.readline()) for _ in range(SAMPLE_ROWS + 1))
+    estimated_rows = os.path.getsize(csv_path) / (sample_bytes / (SAMPLE_ROWS + 1))
+    return rows_within_budget(sample, estimated_rows, memory_budget_mb)
+
+
+def iter_wrapped_chunks(data_dir, chunksize: int):
+    """Yields the wrapped rows of the enriched history chunksize rows at a time."""
+    with pd.read_csv(
+        data_dir / "watch-history-enriched.csv", dtype=TEXT_COLUMNS, chunksize=chunksize
+    ) as reader:
+        for chunk in reader:
+            yield filter_wrapped_rows(chunk)
+
+
+def filter_wrapped_rows(df: pd.DataFrame) -> pd.DataFrame:
+    """Keeps the enriched rows that count towards the wrapped stats."""
+    # Histories ingested before the canonical columns existed get them here
+    df = add_canonical_columns(df)
+
+    # remove errors
+    df = df[df["error"].isna()]
+
+    # remove things over 4 hours (usually infinite loop videos)
+    duration_seconds = pd.to_numeric(df["duration_seconds"], errors="coerce")
+    df = df[duration_seconds <= 4 * 3600]
+
+    return df
+
+
+def empty_partial() -> dict:
+    return {
+        "views": 0,
+        "seconds": 0.0,
+        "channels": TopKSketch(),
+        "videos": TopKSketch(),
+        "days": {},
+        "weekdays": {},
+        "categories": {},
+        "heatmap": [[0] * 24 for _ in WEEKDAY_NAMES],
+        "sessions": dict(EMPTY_SESSION_STATS),
+    }
+
+
+def _link(value):
+    return None if pd.isna(value) else str(value)
+
+
+def wrapped_tables_from_frame(df: pd.DataFrame) -> dict:
+    """
+    Computes the grouped tables behind the wrapped partials with pandas.
+
+    Every query backend returns these same tables (see query_backends.py).
+    `first_row` is the position of the first row of a group in the input and
+    fixes first-seen order; the links come from that row.
+    """
+    df = df.assign(
+        seconds=pd.to_numeric(df["duration_seconds"], errors="coerce").fillna(0),
+        row=np.arange(len(df)),
+    ).dropna(subset=["year"])
+    df["year"] = df["year"].astype(int)
+
+    def grouped(keys, **aggregations):
+        # observed only matters for Categorical keys, like those of EventStore.to_frame
+        return df.groupby(keys, observed=True).agg(**aggregations).reset_index()
+
+    def with_first_link(table, keys, link_column):
+        first_rows = df.drop_duplicates(subset=keys)[[*keys, "row", link_column]]
+        first_rows = first_rows.rename(columns={"row": "first_row"})
+        return table.merge(first_rows, on=keys, how="left")
+
+    return {
+        "totals": grouped(
+            "year", views=("row", "size"), seconds=("seconds", "sum"), first_row=("row", "min")
+        ),
+        "channels": with_first_link(
+            grouped(["year", "channel_name"], seconds=("seconds", "sum")),
+            ["year", "channel_name"],
+            "channel_link",
+        ),
+        "videos": with_first_link(
+            grouped(["year", "video_name"], views=("row", "size")),
+            ["year", "video_name"],
+            "video_link",
+        ),
+        "days": grouped(["year", "local_date"], seconds=("seconds", "sum")),
+        "weekdays": grouped(["year", "weekday"], views=("row", "size")),
+        "categories": grouped(["year", "category_name"], views=("row", "size")),
+        "heatmap": grouped(["year", "weekday", "hour"], views=("row", "size")),
+    }
+
+
+def partials_from_tables(tables: dict, events: dict) -> dict:
+    """Assembles per-year partials from the grouped wrapped tables."""
+    partials = {}
+    for row in tables["totals"].sort_values("first_row").itertuples(index=False):
+        partial = empty_partial()
+        partial["views"] = int(row.views)
+        partial["seconds"] = float(row.seconds)
+        partials[int(row.year)] = partial
+
+    # Sketches are filled in first-seen order, which breaks ties in the top lists
+    for kind, name_column, value_column, cast in (
+        ("channels", "channel_name", "seconds", float),
+        ("videos", "video_name", "views", int),
+    ):
+        link_column = kind[:-1] + "_link"
+        table = tables[kind].sort_values("first_row")
+        counts, links = {}, {}
+        for year, name, value, link in zip(
+            table["year"], table[name_column], table[value_column], table[link_column]
+        ):
+            counts.setdefault(int(year), {})[name] = cast(value)
+            links.setdefault(int(year), {})[name] = _link(link)
+        for year, partial in partials.items():
+            partial[kind] = TopKSketch.from_counts(counts.get(year, {}), links.get(year, {}))
+
+    for kind, key_column, value_column, cast, key_fn in (
+        ("days", "local_date", "seconds", float, str),
+        ("weekdays", "weekday", "views", int, lambda weekday: WEEKDAY_NAMES[int(weekday)]),
+        ("categories", "category_name", "views", int, str),
+    ):
+        table = tables[kind].dropna(subset=[key_column])
+        for year, key, value in zip(table["year"], table[key_column], table[value_column]):
+            if int(year) in partials:
+                partials[int(year)][kind][key_fn(key)] = cast(value)
+
+    heatmap = tables["heatmap"].dropna(subset=["weekday", "hour"])
+    for year, weekday, hour, views in zip(
+        heatmap["year"], heatmap["weekday"], heatmap["hour"], heatmap["views"]
+    ):
+        if int(year) in partials:
+            partials[int(year)]["heatmap"][int(weekday)][int(hour)] = int(views)
+
+    for year, partial in partials.items():
+        partial["sessions"] = compute_session_stats(events.get(year, empty_events()))
+    return partials
+
+
+def compute_year_partials(df: pd.DataFrame, events: dict | None = None) -> dict:
+    """
+    Computes the partial aggregates behind the wrapped stats for every year
+    in one grouped pass per statistic.
+
+    Partials only hold sums, counts and top-k sketches (which carry the
+    first-seen links), so they can be merged with merge_partials to get any
+    combination of years. Session stats are the exception: they need the
+    year's full event arrays, passed in as `events` (see events_from_rows).
+    """
+    if events is None:
+        events = events_from_rows(df)
+    return partials_from_tables(wrapped_tables_from_frame(df), events)
+
+
+def merge_partials(partials) -> dict:
+    """Merges partials in order; earlier partials win for first-seen links."""
+    merged = empty_partial()
+    for partial in partials:
+        merged["views"] += partial["views"]
+        merged["seconds"] += partial["seconds"]
+        for key in ("days", "weekdays", "categories"):
+            target = merged[key]
+            for name, value in partial[key].items():
+                target[name] = target.get(name, 0) + value
+        for key in ("channels", "videos"):
+            merged[key] = merged[key].merge(partial[key])
+        merged["heatmap"] = (
+            np.asarray(merged["heatmap"]) + np.asarray(partial["heatmap"])
+        ).tolist()
+        merged["sessions"] = merge_session_stats(
+            [merged["sessions"], partial["sessions"]]
+        )
+    return merged
+
+
+def compute_chunked_partials(frames) -> tuple[dict, dict]:
+    """
+    Computes the year partials and event arrays of filtered frames that
+    follow each other in the enriched file, one frame in memory at a time.
+    """
+    partials = {}
+    event_sets = {}
+    for frame in frames:
+        frame_events = events_from_rows(frame)
+        for year, partial in compute_year_partials(frame, frame_events).items():
+            if year in partials:
+                partials[year] = merge_partials([partials[year], partial])
+            else:
+                partials[year] = partial
+            event_sets.setdefault(year, []).append(frame_events[year])
+
+    events = {}
+    for year, partial in partials.items():
+        events[year] = merge_events(event_sets.pop(year))
+        # Sessions can span frames, so they come from the merged events
+        partial["sessions"] = compute_session_stats(events[year])
+    return partials, events
+
+
+def top_keys(counts: dict, n: int = 5, tie_break=None) -> list:
+    """
+    Returns the n keys with the largest values. Ties are ordered by
+    tie_break(key) when given, otherwise they keep their first-seen order.
+    """
+    if tie_break is None:
+        ordered = sorted(counts.items(), key=lambda kv: -kv[1])
+    else:
+        ordered = sorted(counts.items(), key=lambda kv: (-kv[1], tie_break(kv[0])))
+    return [key for key, _ in ordered[:n]]
+
+
+def video_thumbnail(video_link) -> str:
+    video_id = extract_video_id(video_link) if video_link else None
+    if video_id:
+        return f"https://i.ytimg.com/vi/{video_id}/mqdefault.jpg"
+    return "/api/placeholder/80/60"  # fallback if parsing failed
+
+
+def top_channel_items(partial: dict, k: int | None = None) -> list:
+    """Top channels by watch time, with their link and the sketch error bound."""
+    sketch = partial["channels"]
+    return [
+        {
+            "name": channel,
+            "minutes": round(seconds / 60, 1),
+            "link": sketch.links.get(channel),
+            "max_error_minutes": round(error / 60, 1),
+        }
+        for channel, seconds, error in sketch.top(k, tie_break=str)
+    ]
+
+
+def top_video_items(partial: dict, k: int | None = None) -> list:
+    """Top videos by views, with their link, thumbnail and error bound."""
+    sketch = partial["videos"]
+    items = []
+    for video, views, error in sketch.top(k):
+        link = sketch.links.get(video)
+        items.append(
+            {
+                "name": video,
+                "views": int(views),
+                "link": link,
+                "thumbnail": video_thumbnail(link),
+                "max_error_views": int(error),
+            }
+        )
+    return items
+
+
+def finalize_wrapped_stats(
+    year: int | str, partial: dict, category_counts: dict, k: int | None = None
+) -> dict:
+    """Turns a (merged) partial into the youtube-wrapped-{year}.json payload."""
+    k = k or DEFAULT_TOP_K
+    json_stats = {}
+    json_stats["year"] = year
+
+    json_stats["top_categories"] = top_keys(category_counts, k, tie_break=str)
+
+    channel_items = top_channel_items(partial, k)
+    json_stats["top_channels"] = [item["name"] for item in channel_items]
+    json_stats["top_channels_links"] = [item["link"] for item in channel_items]
+    json_stats["top_channel_items"] = channel_items
+
+    video_items = top_video_items(partial, k)
+    json_stats["top_videos_links"] = [item["link"] for item in video_items]
+    json_stats["top_videos_thumbs"] = [item["thumbnail"] for item in video_items]
+    json_stats["top_videos"] = [item["name"] for item in video_items]
+    json_stats["top_video_items"] = video_items
+
+    json_stats["total_views"] = partial["views"]
+
+    total_minutes = partial["seconds"] // 60
+    json_stats["total_hours"] = int(total_minutes // 60)
+    json_stats["total_minutes"] = int(total_minutes - int(total_minutes // 60))
+
+    top_weekdays = top_keys(partial["weekdays"], 1, tie_break=WEEKDAY_NAMES.index)
+    json_stats["top_day"] = top_weekdays[0] if top_weekdays else None
+
+    days_watched = len(partial["days"])
+    json_stats["total_days"] = days_watched
+
+    average_minutes_per_day = total_minutes / days_watched if days_watched > 0 else 0
+    json_stats["average_hours"] = int(average_minutes_per_day // 60)
+    json_stats["average_minutes"] = int(average_minutes_per_day % 60)
+
+    sessions = partial["sessions"]
+    json_stats["total_sessions"] = sessions["sessions"]
+    json_stats["sessions_per_day"] = (
+        round(sessions["sessions"] / days_watched, 1) if days_watched > 0 else 0
+    )
+    json_stats["longest_session"] = sessions["longest_session"]
+    json_stats["biggest_binge"] = sessions["biggest_binge"]
+    json_stats["longest_streak"] = longest_streak(partial["days"])
+    json_stats["watch_heatmap"] = partial["heatmap"]
+
+    if partial["days"]:
+        # Earliest date wins ties, like idxmax over the date-sorted groupby
+        top_day = max(sorted(partial["days"]), key=partial["days"].get)
+        top_day_dt = pd.Timestamp(top_day)
+        json_stats["top_day_date_year"] = top_day_dt.year
+        json_stats["top_day_date_month"] = top_day_dt.month
+        json_stats["top_day_date_day"] = top_day_dt.day
+        json_stats["top_day_date_day_name"] = top_day_dt.day_name()
+        json_stats["top_day_minutes"] = int(partial["days"][top_day] / 60)
+    else:
+        json_stats["top_day_date_year"] = None
+        json_stats["top_day_date_month"] = None
+        json_stats["top_day_date_day"] = None
+        json_stats["top_day_date_day_name"] = None
+        json_stats["top_day_minutes"] = 0
+
+    return json_stats
+
+
+def build_wrapped_stats(partials: dict) -> dict:
+    """Finalizes every year plus "all" from per-year partials."""
+    all_partial = merge_partials(partials.values())
+    # Top categories have always been computed over the whole history
+    category_counts = all_partial["categories"]
+
+    stats = {}
+    for year in sorted(partials):
+        if partials[year]["views"]:
+            stats[year] = finalize_wrapped_stats(year, partials[year], category_counts)
+    if all_partial["views"]:
+        stats["all"] = finalize_wrapped_stats("all", all_partial, category_counts)
+    return stats
+
+
+def write_wrapped_json(stats: dict, cache_dir):
+    for year, json_stats in stats.items():
+        with open(cache_dir / f"youtube-wrapped-{year}.json", "w", encoding="utf-8") as f:
+            f.write(json.dumps(json_stats))
+
+
+# Per-year partials are persisted so new enriched rows can be folded in
+# without re-reading the history
+AGGREGATES_DIR = "wrapped-aggregates"
+# Bump when the partial format changes so stored partials get rebuilt
+AGGREGATES_VERSION = 3
+
+_aggregates_lock = threading.RLock()
+
+
+def get_aggregates_dir(cache_dir) -> Path:
+    aggregates_dir = Path(cache_dir) / AGGREGATES_DIR
+    aggregates_dir.mkdir(parents=True, exist_ok=True)
+    return aggregates_dir
+
+
+def _write_json_atomic(path: Path, data):
+    tmp_path = path.with_suffix(".json.tmp")
+    with tmp_path.open("w", encoding="utf-8") as f:
+        json.dump(data, f)
+    os.replace(tmp_path, path)
+
+
+def load_aggregates_index(cache_dir) -> dict:
+    index_path = get_aggregates_dir(cache_dir) / "index.json"
+    if index_path.exists():
+        try:
+            with index_path.open("r", encoding="utf-8") as f:
+                return json.load(f)
+        except Exception as e:
+            print(f"Error loading wrapped aggregates index: {e}")
+    return {}
+
+
+def load_partial(cache_dir, key) -> dict | None:
+    partial_path = get_aggregates_dir(cache_dir) / f"{key}.json"
+    if partial_path.exists():
+        with partial_path.open("r", encoding="utf-8") as f:
+            partial = json.load(f)
+        for sketch_key in ("channels", "videos"):
+            partial[sketch_key] = TopKSketch.from_dict(partial[sketch_key])
+        return partial
+    return None
+
+
+def save_partial(cache_dir, key, partial: dict):
+    data = dict(partial)
+    for sketch_key in ("channels", "videos"):
+        data[sketch_key] = partial[sketch_key].to_dict()
+    _write_json_atomic(get_aggregates_dir(cache_dir) / f"{key}.json", data)
+
+
+def load_events(cache_dir, year) -> dict:
+    events_path = get_aggregates_dir(cache_dir) / f"{year}-events.npz"
+    if not events_path.exists():
+        return empty_events()
+    with np.load(events_path) as arrays:
+        return {name: arrays[name] for name in arrays.files}
+
+
+def save_events(cache_dir, year, events: dict):
+    aggregates_dir = get_aggregates_dir(cache_dir)
+    tmp_path = aggregates_dir / f"{year}-events.tmp.npz"
+    np.savez(tmp_path, **events)
+    os.replace(tmp_path, aggregates_dir / f"{year}-events.npz")
+
+
+def rebuild_wrapped_aggregates(data_dir, cache_dir) -> dict:
+    """Recomputes every partial from the enriched file and rewrites all json."""
+    with _aggregates_lock, span("aggregate_rebuild"):
+        enriched_data_path = data_dir / "watch-history-enriched.csv"
+        signature = file_signature(enriched_data_path)
+        from query_backends import get_query_backend
+
+        backend = get_query_backend()
+        if backend.name != "pandas" and backend.uncanonical_rows(enriched_data_path):
+            # Rows enriched before the canonical columns existed need pandas
+            print(f"Enriched history is missing canonical columns, not using {backend.name}")
+            backend = None
+
+        if backend is not None and backend.name != "pandas":
+            if plan_chunksize(enriched_data_path) is None:
+                year_sets = [None]
+            else:
+                # Over the memory budget only one year's rows are queried at a time
+                year_sets = [[year] for year in backend.years(enriched_data_path)]
+            partials, events = {}, {}
+            for years in year_sets:
+                tables = backend.wrapped_tables(enriched_data_path, years)
+                year_events = events_from_rows(tables.pop("events"))
+                partials.update(partials_from_tables(tables, year_events))
+                events.update(year_events)
+        else:
+            from event_store import iter_event_frames
+
+            # Grouped on the store's integer codes instead of re-parsing the
+            # csv, in slices that fit the memory budget
+            partials, events = compute_chunked_partials(iter_event_frames(data_dir, cache_dir))
+
+        aggregates_dir = get_aggregates_dir(cache_dir)
+        for stale_path in [*aggregates_dir.glob("*.json"), *aggregates_dir.glob("*.npz")]:
+            stale_path.unlink()
+        for year, partial in partials.items():
+            save_partial(cache_dir, year, partial)
+            save_events(cache_dir, year, events[year])
+        save_partial(cache_dir, "all", merge_partials(partials.values()))
+        _write_json_atomic(
+            aggregates_dir / "index.json",
+            {
+                "version": AGGREGATES_VERSION,
+                "enriched_signature": list(signature),
+                "years": list(partials),
+            },
+        )
+
+        stats = build_wrapped_stats(partials)
+        write_wrapped_json(stats, cache_dir)
+        return stats
+
+
+def update_wrapped_aggregates(data_dir, cache_dir, new_rows: pd.DataFrame, previous_signature):
+    """
+    Folds newly appended enriched rows into the persisted partials and
+    refreshes the wrapped json they affect.
+
+    `previous_signature` is the enriched file signature before the rows were
+    written. If the partials don't describe that state they are rebuilt.
+    """
+    with _aggregates_lock:
+        index = load_aggregates_index(cache_dir)
+        if (
+            previous_signature is None
+            or index.get("version") != AGGREGATES_VERSION
+            or index.get("enriched_signature") != list(previous_signature)
+        ):
+            rebuild_wrapped_aggregates(data_dir, cache_dir)
+            return
+
+        batch_rows = filter_wrapped_rows(new_rows)
+        batch_events = events_from_rows(batch_rows)
+        batch_partials = compute_year_partials(batch_rows, batch_events)
+
+        # New rows are written ahead of the existing ones, so they are merged
+        # first to keep first-seen links identical to a full rebuild
+        updated_partials = {}
+        for year, partial in batch_partials.items():
+            existing = load_partial(cache_dir, year) or empty_partial()
+            updated_partials[year] = merge_partials([partial, existing])
+
+            # Sessions can span batches, so they are recomputed from the
+            # year's merged events rather than merged
+            events = merge_events([load_events(cache_dir, year), batch_events[year]])
+            save_events(cache_dir, year, events)
+            updated_partials[year]["sessions"] = compute_session_stats(events)
+            save_partial(cache_dir, year, updated_partials[year])
+
+        years = list(batch_partials) + [
+            year for year in index.get("years", []) if year not in batch_partials
+        ]
+        all_partial = merge_partials(
+            [
+                merge_partials(batch_partials.values()),
+                load_partial(cache_dir, "all") or empty_partial(),
+            ]
+        )
+        all_partial["sessions"] = merge_session_stats(
+            (updated_partials.get(year) or load_partial(cache_dir, year))["sessions"]
+            for year in years
+        )
+        save_partial(cache_dir, "all", all_partial)
+
+        enriched_signature = file_signature(data_dir / "watch-history-enriched.csv")
+        _write_json_atomic(
+            get_aggregates_dir(cache_dir) / "index.json",
+            {
+                "version": AGGREGATES_VERSION,
+                "enriched_signature": list(enriched_signature),
+                "years": years,
+            },
+        )
+
+        category_counts = all_partial["categories"]
+        stats = {
+            year: finalize_wrapped_stats(year, partial, category_counts)
+            for year, partial in updated_partials.items()
+        }
+        if all_partial["views"]:
+            stats["all"] = finalize_wrapped_stats("all", all_partial, category_counts)
+        write_wrapped_json(stats, cache_dir)
+
+        # Untouched years only need the history-wide top categories refreshed
+        top_categories = top_keys(category_counts, DEFAULT_TOP_K, tie_break=str)
+        for year in years:
+            json_path = Path(cache_dir) / f"youtube-wrapped-{year}.json"
+            if year in stats or not json_path.exists():
+                continue
+            with json_path.open("r", encoding="utf-8") as f:
+                json_stats = json.load(f)
+            if json_stats.get("top_categories") != top_categories:
+                json_stats["top_categories"] = top_categories
+                write_wrapped_json({year: json_stats}, cache_dir)
+
+
+def ensure_wrapped_json(data_dir, cache_dir):
+    """
+    Makes sure every youtube-wrapped-{year}.json reflects the enriched file,
+    rebuilding only when the persisted partials are out of date.
+    """
+    with _aggregates_lock:
+        signature = file_signature(data_dir / "watch-history-enriched.csv")
+        if signature is None:
+            return
+        index = load_aggregates_index(cache_dir)
+        if index.get("version") == AGGREGATES_VERSION and index.get(
+            "enriched_signature"
+        ) == list(signature) and all(
+            (Path(cache_dir) / f"youtube-wrapped-{year}.json").exists()
+            for year in [*index.get("years", []), "all"]
+        ):
+            return
+        rebuild_wrapped_aggregates(data_dir, cache_dir)
+
+
+def generate_all_wrapped_json(data_dir, cache_dir) -> dict:
+    """
+    Loads the enriched history once and writes youtube-wrapped-{year}.json
+    for every year and for "all".
+    """
+    return rebuild_wrapped_aggregates(data_dir, cache_dir)
@@ -3,30 +3,73 @@ from __future__ import annotations
 import json
 import os
 import shutil
+import time
+from contextlib import asynccontextmanager
 from datetime import datetime
 from pathlib import Path
 
 import dateparser
-import jinja2
 import pandas as pd
 import requests
 from fastapi import BackgroundTasks, Request, UploadFile
-from fastapi.responses import HTMLResponse, JSONResponse, RedirectResponse
+from fastapi.responses import (
+    FileResponse,
+    HTMLResponse,
+    JSONResponse,
+    PlainTextResponse,
+    RedirectResponse,
+    StreamingResponse,
+)
 from fastapi.staticfiles import StaticFiles
 from fastsyftbox import FastSyftBox
 from loguru import logger
 
+from aggregates import ensure_wrapped_json
+from canonical import add_canonical_columns
+from cube import DIMENSIONS, get_cube
+from executors import run_blocking
+from history_index import get_history_index
+from manifest import file_signature, record_ingest, reset_enriched
 from metadata import process_rows
+from metrics import get_pipeline_metrics, latency_metrics, span
+from page_cache import PageCache, cached_html_response, make_etag
+from profiling import (
+    arm,
+    armed_targets,
+    configure_profiling,
+    disarm,
+    get_profile_path,
+    list_profiles,
+    profiled,
+)
+from progress_events import get_processing_events, get_processing_status
+from published_index import get_published_index
 from resources import add_dataset, ensure_syft_yaml
+from templating import enable_bytecode_cache, render_template, template_hash
+from thumbnails import prefetch_top_thumbnails
 from utils import YoutubeDataPipelineState
-from wrapped import generate_wrapped_json
 
 syftbox_domain = "https://syftbox.net"
 
+# Requests slower than this are logged with their route and timing
+SLOW_REQUEST_SECONDS = float(os.environ.get("YOUTUBE_WRAPPED_SLOW_REQUEST_SECONDS", 1.0))
+
 app_name = "youtube-wrapped"
 
+
+@asynccontextmanager
+async def lifespan(app):
+    # Loads the published index and starts its watcher and first refresh off
+    # the request path, before any page needs it
+    await run_blocking(
+        "home", get_published_index, app.syftbox_client.datasites, cache_dir, pool="io"
+    )
+    yield
+
+
 app = FastSyftBox(
     app_name=app_name,
+    lifespan=lifespan,
     syftbox_endpoint_tags=["syftbox"],
     include_syft_openapi=True,
 )
@@ -44,6 +87,9 @@ cache_dir.mkdir(parents=True, exist_ok=True)
 data_dir = app_data_dir / "data"
 data_dir.mkdir(parents=True, exist_ok=True)
 
+enable_bytecode_cache(cache_dir)
+configure_profiling(cache_dir)
+
 
 ensure_syft_yaml(app.syftbox_client)
 
@@ -56,64 +102,77 @@ app.mount(
 app.mount("/js", StaticFiles(directory=current_dir / "assets" / "js"), name="js")
 
 
+@app.middleware("http")
+async def time_requests(request: Request, call_next):
+    """Records the time to response start per route, logging slow requests."""
+    start = time.perf_counter()
+    status = 500
+    try:
+        with profiled(request.url.path):
+            response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        seconds = time.perf_counter() - start
+        # The route template, so /summarize?year=2024 and ?year=2023 share a series
+        route = request.scope.get("route")
+        route_path = getattr(route, "path", "unmatched")
+        latency_metrics.observe_request(request.method, route_path, status, seconds)
+        if seconds >= SLOW_REQUEST_SECONDS:
+            logger.warning(
+                f"Slow request: {request.method} {request.url.path} "
+                f"took {seconds:.3f}s (status {status})"
+            )
+
+
 def find_youtube_wrapped_html_files(base_path):
     """
-    Searches the given base path for all HTML files located in the
-    */public/youtube-wrapped/* directory structure.
-
-    Args:
-        base_path (Path): The base directory to start the search from.
+    Returns the published youtube-wrapped HTML files of every datasite under
+    base_path, as {email: [sorted urls]}.
 
-    Returns:
-        List[Path]: A list of Paths to the found HTML files.
+    Served from the in-memory published index, which a filesystem watcher
+    (or polling, where watching isn't possible) keeps up to date.
     """
-    youtube_wrapped_path = base_path.glob("*/public/youtube-wrapped/*.html")
-    html_files = list(youtube_wrapped_path)
-    print(html_files)
-    html_files = [
-        f"{syftbox_domain}/datasites/{str(file).split('/datasites/', 1)[1]}"
-        for file in html_files
-    ]
-    html_files_dict = {}
-    for file_url in html_files:
-        # Extract the email from the URL
-        email = file_url.split("/")[4]
-        if email not in html_files_dict:
-            html_files_dict[email] = []
-        html_files_dict[email].append(file_url)
-
-    # Sort the list of files for each email
-    for email in html_files_dict:
-        html_files_dict[email].sort()
-
-    return html_files_dict
+    return get_published_index(base_path, cache_dir).lookup(syftbox_domain)
 
 
-@app.get("/", response_class=HTMLResponse, include_in_schema=False)
-async def ui_home(request: Request):
-    try:
-        other_files = find_youtube_wrapped_html_files(app.syftbox_client.datasites)
-        print(other_files)
-    except Exception as e:
-        other_files = {}
-        logger.error(f"An error occurred while finding other files: {e}")
+def refresh_own_published_files():
+    """Re-lists our own datasite, so publishing shows up without waiting on the watcher."""
+    get_published_index(app.syftbox_client.datasites, cache_dir).refresh_datasite(
+        app.syftbox_client.email, force=True
+    )
+
+
+home_page_cache = PageCache()
 
-    pipeline_state = YoutubeDataPipelineState(app_data_dir)
-    template_path = current_dir / "assets" / "home.html"
 
-    with open(template_path, encoding="utf-8") as f:
-        template_content = f.read()
+def home_page_version(pipeline_state: YoutubeDataPipelineState, other_files) -> dict:
+    """Everything the home page is rendered from, as cheap file stats."""
+    return {
+        "data": pipeline_state.get_data_version(),
+        "wrapped_json": {
+            path.name: file_signature(path)
+            for path in cache_dir.glob("youtube-wrapped-*.json")
+        },
+        "published": {
+            path.name: file_signature(path) for path in wrapped_path.glob("*.html")
+        },
+        "other_files": other_files,
+        "template": template_hash("home.html"),
+    }
+
 
+def render_home_page(pipeline_state: YoutubeDataPipelineState, other_files) -> str:
     years = pipeline_state.get_years()
     year_stats = []
 
     try:
         if pipeline_state.enriched_data_exists():
+            # Enrichment keeps these current; this only rebuilds stale output
+            ensure_wrapped_json(data_dir, cache_dir)
+
             for year in years:
                 json_file_path = cache_dir / f"youtube-wrapped-{year}.json"
-                if not json_file_path.exists():
-                    generate_wrapped_json(year, data_dir, cache_dir)
-
                 if json_file_path.exists():
                     with open(json_file_path, "r", encoding="utf-8") as json_file:
                         stats = json.load(json_file)
@@ -132,8 +191,6 @@ async def ui_home(request: Request):
                         )
 
             json_file_path = cache_dir / "youtube-wrapped-all.json"
-            if not json_file_path.exists():
-                generate_wrapped_json("all", data_dir, cache_dir)
             if json_file_path.exists():
                 with open(json_file_path, "r", encoding="utf-8") as json_file:
                     stats = json.load(json_file)
@@ -151,8 +208,6 @@ async def ui_home(request: Request):
     except Exception as e:
         logger.error(f"An error occurred while generating wrapped cache json: {e}")
 
-    template = jinja2.Template(template_content)
-
     wrapped_url = (
         f"{syftbox_domain}/datasites/{app.syftbox_client.email}/public/youtube-wrapped/"
     )
@@ -180,28 +235,91 @@ async def ui_home(request: Request):
         "syftbox_domain": syftbox_domain,
     }
 
-    rendered_content = template.render(**render_context)
-
-    return HTMLResponse(rendered_content)
+    return render_template("home.html", **render_context)
 
 
-@app.get("/summarize", response_class=JSONResponse, include_in_schema=False)
-async def summarize(request: Request, year: int | str = datetime.now().year - 1):
+def get_home_page():
     try:
         other_files = find_youtube_wrapped_html_files(app.syftbox_client.datasites)
-        print(other_files)
-    except Exception:
+    except Exception as e:
         other_files = {}
+        logger.error(f"An error occurred while finding other files: {e}")
 
     pipeline_state = YoutubeDataPipelineState(app_data_dir)
 
-    from share_image import create_share_image
+    # Reloads and polling only pay for the version check while nothing changed
+    etag = make_etag(home_page_version(pipeline_state, other_files))
+    page = home_page_cache.get("home", etag)
+    if page is None:
+        rendered_content = render_home_page(pipeline_state, other_files)
+        # Rendering can refresh the wrapped json, so version it afterwards
+        etag = make_etag(home_page_version(pipeline_state, other_files))
+        page = home_page_cache.put("home", etag, rendered_content)
+    return page
+
+
+@app.get("/", response_class=HTMLResponse, include_in_schema=False)
+async def ui_home(request: Request):
+    page = await run_blocking("home", get_home_page)
+    return cached_html_response(request, page)
+
+
+def build_wrapped(year, other_files) -> str:
+    """Builds (or reuses) the wrapped page and share image for a year."""
+    from share_image import ensure_share_image
     from wrapped import create_wrapped_page
 
-    create_share_image(year, app_data_dir, cache_dir / f"youtube-wrapped-{year}.png")
+    # The page build refreshes the stats json the image is drawn from
     rendered_html = create_wrapped_page(
         year, app.syftbox_client, data_dir, cache_dir, other_files, syftbox_domain
     )
+    # Drawn from cached thumbnails (or the placeholder), see prefetch_year_thumbnails
+    ensure_share_image(year, app_data_dir, cache_dir / f"youtube-wrapped-{year}.png")
+    return rendered_html
+
+
+def prefetch_year_thumbnails(year):
+    """
+    Fetches or revalidates a year's top thumbnails after the response is
+    sent. Usually a no-op, enrichment keeps them warm. The share image is
+    redrawn with them on its next build.
+    """
+    try:
+        with span("thumbnail_prefetch"):
+            prefetch_top_thumbnails(cache_dir, [year])
+    except Exception as e:
+        logger.error(f"An error occurred while prefetching thumbnails: {e}")
+
+
+def prefetch_enriched_thumbnails():
+    """
+    Warms every year's top thumbnails once an enrichment run finishes, so
+    rendering share images never waits on i.ytimg.com.
+    """
+    try:
+        with span("thumbnail_prefetch"):
+            prefetch_top_thumbnails(cache_dir)
+    except Exception as e:
+        logger.error(f"An error occurred while prefetching thumbnails: {e}")
+
+
+@app.get("/summarize", response_class=JSONResponse, include_in_schema=False)
+async def summarize(
+    request: Request,
+    background_tasks: BackgroundTasks,
+    year: int | str = datetime.now().year - 1,
+):
+    try:
+        other_files = find_youtube_wrapped_html_files(app.syftbox_client.datasites)
+    except Exception:
+        other_files = {}
+
+    pipeline_state = YoutubeDataPipelineState(app_data_dir)
+
+    rendered_html = await run_blocking("wrapped", build_wrapped, year, other_files)
+    background_tasks.add_task(
+        run_blocking, "thumbnails", prefetch_year_thumbnails, year, pool="io"
+    )
 
     return HTMLResponse(rendered_html)
 
@@ -223,21 +341,17 @@ async def start_processing(request: Request, background_tasks: BackgroundTasks):
     # Run process_rows in the background
     def run_process():
         pipeline_state = YoutubeDataPipelineState(app_data_dir)
-        youtube_api_token = None
-        config_path = cache_dir / "config.json"
-        if config_path.exists():
-            with config_path.open("r", encoding="utf-8") as config_file:
-                config_data = json.load(config_file)
-                youtube_api_token = config_data.get("youtube-api-key", "")
+        youtube_api_token = pipeline_state.get_api_key()
 
         try:
-            process_rows(
-                client=app.syftbox_client,
-                youtube_api_key=youtube_api_token,
-                app_data_dir=app_data_dir,
-                watch_history_path=pipeline_state.get_watch_history_csv_path(),
-                enriched_data_path=pipeline_state.get_enriched_data_path(),
-            )
+            with span("enrich_run"):
+                process_rows(
+                    client=app.syftbox_client,
+                    youtube_api_key=youtube_api_token,
+                    app_data_dir=app_data_dir,
+                    watch_history_path=pipeline_state.get_watch_history_csv_path(),
+                    enriched_data_path=pipeline_state.get_enriched_data_path(),
+                )
         finally:
             # Check if processing is still marked as true
             if pipeline_state.is_keep_running():
@@ -246,6 +360,10 @@ async def start_processing(request: Request, background_tasks: BackgroundTasks):
             else:
                 # Mark processing as finished
                 pipeline_state.set_processing(False)
+                # Once per run rather than after every batch
+                background_tasks.add_task(
+                    run_blocking, "thumbnails", prefetch_enriched_thumbnails, pool="io"
+                )
 
     background_tasks.add_task(run_process)
 
@@ -269,46 +387,240 @@ async def stop_processing(request: Request, background_tasks: BackgroundTasks):
 
 @app.get("/processing-status", response_class=JSONResponse, include_in_schema=False)
 async def processing_status():
-    pipeline_state = YoutubeDataPipelineState(app_data_dir)
+    status = await run_blocking(
+        "status", get_processing_status, app_data_dir, pool="io"
+    )
+    return JSONResponse(status)
+
+
+@app.get("/processing-events", include_in_schema=False)
+async def processing_events():
+    """Server-sent events with the processing status, pushed as it changes."""
+    return StreamingResponse(
+        get_processing_events(app_data_dir).stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@app.get("/metrics", response_class=PlainTextResponse, include_in_schema=False)
+async def metrics():
+    """Enrichment pipeline, request and stage metrics in the Prometheus text format."""
+    return PlainTextResponse(
+        get_pipeline_metrics(app_data_dir).to_prometheus()
+        + latency_metrics.to_prometheus(),
+        media_type="text/plain; version=0.0.4",
+    )
 
-    # Check if processing is ongoing
-    is_processing = pipeline_state.is_processing()
 
-    # Get the current processing stats
+@app.get("/metrics/summary", response_class=JSONResponse, include_in_schema=False)
+async def metrics_summary():
+    """Request and stage latency percentiles as JSON."""
+    return JSONResponse(latency_metrics.summary())
 
-    total_rows = pipeline_state.get_total_rows()
-    processed_rows = pipeline_state.get_processed_rows()
-    enriched_rows = pipeline_state.get_enriched_rows()
-    missing_rows = pipeline_state.get_missing_rows()
+
+@app.get("/admin/profiling", response_class=JSONResponse, include_in_schema=False)
+async def profiling_status():
+    """Targets armed for profiling, with the captures left (null is unlimited)."""
+    return JSONResponse({"armed": armed_targets()})
+
+
+@app.post("/admin/profiling", response_class=JSONResponse, include_in_schema=False)
+async def start_profiling(targets: str, count: int | None = 1):
+    """
+    Profiles the next `count` runs of each target: comma separated request
+    paths (e.g. /summarize), span names (e.g. image_render) or "all".
+    Pass count=0 to profile every run until DELETE /admin/profiling.
+    """
+    target_list = [target.strip() for target in targets.split(",") if target.strip()]
+    if not target_list:
+        return JSONResponse({"error": "No targets given"}, status_code=400)
+    arm(target_list, count or None)
+    return JSONResponse({"armed": armed_targets()})
+
+
+@app.delete("/admin/profiling", response_class=JSONResponse, include_in_schema=False)
+async def stop_profiling():
+    disarm()
+    return JSONResponse({"armed": armed_targets()})
+
+
+@app.get("/admin/profiles", response_class=JSONResponse, include_in_schema=False)
+async def profiles():
+    """Saved profiles, newest first."""
+    return JSONResponse({"profiles": await run_blocking("status", list_profiles, pool="io")})
+
+
+@app.get("/admin/profiles/{name}", include_in_schema=False)
+async def profile_file(name: str, format: str = "json"):
+    """A saved profile as json, or as folded stacks with format=folded."""
+    suffix = {"json": ".json", "folded": ".folded"}.get(format)
+    if suffix is None:
+        return JSONResponse({"error": "format must be json or folded"}, status_code=400)
+    path = get_profile_path(name, suffix)
+    if path is None:
+        return JSONResponse({"error": "No such profile"}, status_code=404)
+    return FileResponse(path, media_type="text/plain" if format == "folded" else None)
+
+
+@app.get("/api/cube", response_class=JSONResponse, include_in_schema=False)
+async def query_cube(request: Request):
+    """
+    Ad-hoc rollups of minutes and views, e.g.
+    /api/cube?group_by=month,category&year=2024&order_by=minutes&limit=20
+
+    Any dimension name can be passed as a comma separated filter.
+    """
+    start = time.perf_counter()
+    params = request.query_params
+
+    cube = await run_blocking("cube", get_cube, data_dir, cache_dir)
+    if cube is None:
+        return JSONResponse({"error": "No enriched data yet"}, status_code=404)
+
+    filters = {
+        dimension: [value for value in params[dimension].split(",") if value]
+        for dimension in DIMENSIONS
+        if dimension in params
+    }
+    group_by = [name for name in params.get("group_by", "").split(",") if name]
+    try:
+        rows = await run_blocking(
+            "cube",
+            cube.query,
+            filters=filters,
+            group_by=group_by,
+            order_by=params.get("order_by", "minutes"),
+            limit=int(params.get("limit", 100)),
+        )
+    except ValueError as e:
+        return JSONResponse({"error": str(e)}, status_code=400)
 
     return JSONResponse(
         {
-            "is_processing": bool(is_processing),
-            "total_rows": int(total_rows),
-            "processed_rows": int(processed_rows),
-            "enriched_rows": int(enriched_rows),
-            "missing_rows": int(missing_rows),
-            "is_complete": bool(processed_rows == total_rows),
+            "group_by": group_by,
+            "filters": filters,
+            "rows": rows,
+            "took_ms": round((time.perf_counter() - start) * 1000, 2),
         }
     )
 
 
-@app.get("/download", response_class=HTMLResponse, include_in_schema=False)
-async def ui_download(request: Request):
-    pipeline_state = YoutubeDataPipelineState(app_data_dir)
-    template_path = current_dir / "assets" / "download.html"
-
-    with open(template_path, encoding="utf-8") as f:
-        template_content = f.read()
+@app.get("/api/history", response_class=JSONResponse, tags=["syftbox"])
+async def watch_history(
+    start_date: str | None = None,
+    end_date: str | None = None,
+    channel: str | None = None,
+    category: str | None = None,
+    min_duration: int | None = None,
+    sort: str = "watched_at",
+    order: str = "desc",
+    limit: int = 50,
+    cursor: str | None = None,
+):
+    """
+    Pages through the watches counted in the wrapped stats. Dates are local
+    YYYY-MM-DD and inclusive, min_duration is in seconds. Pass next_cursor
+    back as cursor, with the same sort and order, for the next page.
+    """
+    history_index = await run_blocking("history", get_history_index, data_dir, cache_dir)
+    if history_index is None:
+        return JSONResponse({"error": "No enriched data yet"}, status_code=404)
+
+    filters = {
+        "start_date": start_date,
+        "end_date": end_date,
+        "channel": channel,
+        "category": category,
+        "min_duration": min_duration,
+    }
+    try:
+        page = await run_blocking(
+            "history",
+            history_index.history,
+            filters,
+            sort=sort,
+            order=order,
+            limit=limit,
+            cursor=cursor,
+            pool="io",
+        )
+    except ValueError as e:
+        return JSONResponse({"error": str(e)}, status_code=400)
+    return JSONResponse(page)
+
+
+@app.get("/api/stats", response_class=JSONResponse, tags=["syftbox"])
+async def watch_stats(
+    start_date: str | None = None,
+    end_date: str | None = None,
+    channel: str | None = None,
+    category: str | None = None,
+    min_duration: int | None = None,
+    top: int = 5,
+):
+    """Totals, top channels and category counts for the same filters as /api/history."""
+    history_index = await run_blocking("history", get_history_index, data_dir, cache_dir)
+    if history_index is None:
+        return JSONResponse({"error": "No enriched data yet"}, status_code=404)
+
+    filters = {
+        "start_date": start_date,
+        "end_date": end_date,
+        "channel": channel,
+        "category": category,
+        "min_duration": min_duration,
+    }
+    try:
+        stats = await run_blocking(
+            "history", history_index.stats, filters, top=top, pool="io"
+        )
+    except ValueError as e:
+        return JSONResponse({"error": str(e)}, status_code=400)
+    return JSONResponse(stats)
+
+
+@app.get("/search", response_class=JSONResponse, tags=["syftbox"])
+async def search_history(
+    q: str,
+    start_date: str | None = None,
+    end_date: str | None = None,
+    channel: str | None = None,
+    category: str | None = None,
+    limit: int = 20,
+):
+    """
+    Finds watched videos by title or channel. Every word matches as a
+    prefix, so "lofi hip" finds "Lofi Hip Hop Radio". The filters work like
+    /api/history.
+    """
+    history_index = await run_blocking("history", get_history_index, data_dir, cache_dir)
+    if history_index is None:
+        return JSONResponse({"error": "No enriched data yet"}, status_code=404)
+
+    filters = {
+        "start_date": start_date,
+        "end_date": end_date,
+        "channel": channel,
+        "category": category,
+    }
+    try:
+        results = await run_blocking(
+            "history", history_index.search, q, filters, limit=limit, pool="io"
+        )
+    except ValueError as e:
+        return JSONResponse({"error": str(e)}, status_code=400)
+    return JSONResponse(results)
 
-    template = jinja2.Template(template_content)
 
-    rendered_content = template.render()
+@app.get("/download", response_class=HTMLResponse, include_in_schema=False)
+async def ui_download(request: Request):
+    rendered_content = render_template("download.html")
 
     return HTMLResponse(rendered_content)
 
 
-async def process_upload(upload_path):
+def process_upload(upload_path):
     syft_uri = (
         f"syft://{app.syftbox_client.email}/private/youtube-wrapped/watch-history.html"
     )
@@ -327,6 +639,8 @@ async def process_upload(upload_path):
 
     from tqdm import tqdm
 
+    parse_start = time.perf_counter()
+
     # Load the HTML file
     with open(upload_path, "r", encoding="utf-8") as f:
         html = f.read()
@@ -430,8 +744,15 @@ async def process_upload(upload_path):
     # Create DataFrame
     df = pd.DataFrame(data)
 
+    # Derive ids and local time columns once so later stages never re-parse
+    if not df.empty:
+        df = add_canonical_columns(df)
+    latency_metrics.observe_stage("ingest_parse", time.perf_counter() - parse_start)
+
     # Save to CSV
-    df.to_csv(data_dir / "watch-history.csv", index=False)
+    with span("ingest_write"):
+        df.to_csv(data_dir / "watch-history.csv", index=False)
+        record_ingest(data_dir, data_dir / "watch-history.csv", len(df))
 
     syft_uri = (
         f"syft://{app.syftbox_client.email}/private/youtube-wrapped/watch-history.csv"
@@ -449,6 +770,11 @@ async def process_upload(upload_path):
     print(f"Debug: Extracted {len(df)} entries and saved to watch-history.csv")
 
 
+def save_upload(upload_path, contents: bytes):
+    with open(upload_path, "wb") as f:
+        f.write(contents)
+
+
 @app.post("/upload", include_in_schema=False)
 async def upload_watch_history(request: Request):
     print("Debug: Starting upload_watch_history function.")
@@ -468,11 +794,10 @@ async def upload_watch_history(request: Request):
         return HTMLResponse("Uploaded file is empty.", status_code=400)
 
     upload_path = data_dir / "watch-history.html"
-    with open(upload_path, "wb", encoding="utf-8") as f:
-        f.write(contents)
+    await run_blocking("upload", save_upload, upload_path, contents, pool="io")
     print(f"Debug: File written to {upload_path}")
 
-    await process_upload(upload_path)
+    await run_blocking("upload", process_upload, upload_path)
 
     return RedirectResponse(url="/", status_code=303)
 
@@ -480,19 +805,11 @@ async def upload_watch_history(request: Request):
 @app.api_route("/api", methods=["GET", "POST"])
 async def api_setup(request: Request):
     """Endpoint to enrich watch history data."""
-    config_path = cache_dir / "config.json"
-
-    # Check if the config file exists and load the API key
-    youtube_api_token = None
-    if config_path.exists():
-        with config_path.open("r", encoding="utf-8") as config_file:
-            config_data = json.load(config_file)
-            youtube_api_token = config_data.get("youtube-api-key", "")
+    pipeline_state = YoutubeDataPipelineState(app_data_dir)
+    youtube_api_token = pipeline_state.get_api_key()
 
     # Render the HTML with Jinja2, injecting the API key if it exists
-    env = jinja2.Environment(loader=jinja2.FileSystemLoader(current_dir / "assets"))
-    template = env.get_template("api.html")
-    rendered_html = template.render(youtube_api_key=youtube_api_token or "")
+    rendered_html = render_template("api.html", youtube_api_key=youtube_api_token or "")
 
     if request.method == "GET":
         return HTMLResponse(content=rendered_html, media_type="text/html")
@@ -501,22 +818,20 @@ async def api_setup(request: Request):
         form_data = await request.form()
         youtube_api_token = form_data.get("youtube-api-key", "").strip()
 
-        config_path = cache_dir / "config.json"
-        existing_api_token = None
-
-        if config_path.exists():
-            with config_path.open("r", encoding="utf-8") as config_file:
-                config_data = json.load(config_file)
-                existing_api_token = config_data.get("youtube-api-key", "")
+        existing_api_token = pipeline_state.get_api_key()
 
         if youtube_api_token and youtube_api_token != existing_api_token:
-            response = requests.get(
+            response = await run_blocking(
+                "api_key",
+                requests.get,
                 "https://www.googleapis.com/youtube/v3/channels",
                 params={
                     "part": "id,snippet",
                     "forUsername": "GoogleDevelopers",  # OR use "id" param for channel ID
                     "key": youtube_api_token,
                 },
+                timeout=30,
+                pool="io",
             )
 
             if response.status_code != 200:
@@ -524,9 +839,7 @@ async def api_setup(request: Request):
                     content={"error": "Invalid YouTube API token"}, status_code=400
                 )
 
-            config_data = {"youtube-api-key": youtube_api_token}
-            with config_path.open("w", encoding="utf-8") as config_file:
-                json.dump(config_data, config_file)
+            pipeline_state.set_api_key(youtube_api_token)
 
         if not youtube_api_token:
             return JSONResponse(
@@ -540,40 +853,34 @@ async def api_setup(request: Request):
         return RedirectResponse(url="/", status_code=303)
 
 
-@app.get("/publish", include_in_schema=False)
-async def publish(year: int | str):
-    """Endpoint to publish a wrapped HTML file for a given year."""
-
-    try:
-        other_files = find_youtube_wrapped_html_files(app.syftbox_client.datasites)
-        print(other_files)
-    except Exception:
-        other_files = {}
-
+def copy_published(year):
     wrapped_path = app.syftbox_client.datasite_path / "public" / app_name
-
-    from share_image import create_share_image
-    from wrapped import create_wrapped_page
-
-    create_share_image(year, app_data_dir, cache_dir / f"youtube-wrapped-{year}.png")
-    create_wrapped_page(
-        year, app.syftbox_client, data_dir, cache_dir, other_files, syftbox_domain
-    )
-
     shutil.copy(
         cache_dir / f"youtube-wrapped-{year}.html",
         wrapped_path / f"youtube-wrapped-{year}.html",
     )
-    if not (cache_dir / f"youtube-wrapped-{year}.png").exists():
-        from share_image import create_share_image
-
-        create_share_image(
-            year, app_data_dir, cache_dir / f"youtube-wrapped-{year}.png"
-        )
     shutil.copy(
         cache_dir / f"youtube-wrapped-{year}.png",
         wrapped_path / f"youtube-wrapped-{year}.png",
     )
+    refresh_own_published_files()
+
+
+@app.get("/publish", include_in_schema=False)
+async def publish(year: int | str, background_tasks: BackgroundTasks):
+    """Endpoint to publish a wrapped HTML file for a given year."""
+
+    try:
+        other_files = find_youtube_wrapped_html_files(app.syftbox_client.datasites)
+    except Exception:
+        other_files = {}
+
+    # Both builds are skipped when their inputs haven't changed
+    await run_blocking("wrapped", build_wrapped, year, other_files)
+    await run_blocking("wrapped", copy_published, year, pool="io")
+    background_tasks.add_task(
+        run_blocking, "thumbnails", prefetch_year_thumbnails, year, pool="io"
+    )
     return RedirectResponse(url="/", status_code=303)
 
 
@@ -584,6 +891,7 @@ async def delete_enriched():
         enriched_file_path = data_dir / "watch-history-enriched.csv"
         if enriched_file_path.exists():
             os.remove(enriched_file_path)
+        reset_enriched(data_dir)
     except Exception as e:
         logger.error(f"An error occurred while deleting the enriched file: {e}")
     return RedirectResponse(url="/", status_code=303)
@@ -598,6 +906,7 @@ async def unpublish(year: int | str):
         os.remove(wrapped_path / f"youtube-wrapped-{year}.html")
     if (wrapped_path / f"youtube-wrapped-{year}.png").exists():
         os.remove(wrapped_path / f"youtube-wrapped-{year}.png")
+    refresh_own_published_files()
     return RedirectResponse(url="/", status_code=303)
 
 
@@ -624,7 +933,7 @@ async def launch_gmail_download_agent():
     try:
         watch_history_path = data_dir / "watch-history.html"
         if watch_history_path.exists():
-            await process_upload(watch_history_path)
+            await run_blocking("upload", process_upload, watch_history_path)
     except Exception as e:
         logger.error(f"An error occurred while launching the takeout agent: {e}")
     return RedirectResponse(url="/", status_code=303)
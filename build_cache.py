@@ -0,0 +1,83 @@
+import hashlib
+import json
+import os
+import threading
+from pathlib import Path
+
+from manifest import file_signature
+
+BUILD_MANIFEST_FILE = "build-manifest.json"
+
+_build_lock = threading.Lock()
+_file_hashes = {}
+
+
+def hash_file(path) -> str | None:
+    """Returns the sha256 of a file, memoized on its (size, mtime) signature."""
+    signature = file_signature(path)
+    if signature is None:
+        return None
+    key = str(path)
+    cached = _file_hashes.get(key)
+    if cached and cached[0] == signature:
+        return cached[1]
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    file_hash = digest.hexdigest()
+    _file_hashes[key] = (signature, file_hash)
+    return file_hash
+
+
+def hash_inputs(inputs: dict) -> str:
+    """Hashes a dict of JSON-serializable build inputs."""
+    encoded = json.dumps(inputs, sort_keys=True, default=str).encode("utf-8")
+    return hashlib.sha256(encoded).hexdigest()
+
+
+class BuildCache:
+    """
+    Remembers the input hash each artifact in the cache dir was built from,
+    so json, html and png files are only rebuilt when an input changed.
+    """
+
+    def __init__(self, cache_dir):
+        self.manifest_path = Path(cache_dir) / BUILD_MANIFEST_FILE
+
+    def _load(self) -> dict:
+        if self.manifest_path.exists():
+            try:
+                with self.manifest_path.open("r", encoding="utf-8") as f:
+                    return json.load(f)
+            except Exception as e:
+                print(f"Error loading build manifest: {e}")
+        return {}
+
+    def is_fresh(self, artifact_path, inputs_hash: str) -> bool:
+        artifact_path = Path(artifact_path)
+        if not artifact_path.exists():
+            return False
+        with _build_lock:
+            return self._load().get(artifact_path.name) == inputs_hash
+
+    def record(self, artifact_path, inputs_hash: str):
+        with _build_lock:
+            manifest = self._load()
+            manifest[Path(artifact_path).name] = inputs_hash
+            tmp_path = self.manifest_path.with_suffix(".json.tmp")
+            with tmp_path.open("w", encoding="utf-8") as f:
+                json.dump(manifest, f)
+            os.replace(tmp_path, self.manifest_path)
+
+    def build(self, artifact_path, inputs: dict, build_fn) -> bool:
+        """
+        Runs build_fn() unless artifact_path was already built from the same
+        inputs. Returns True if it was rebuilt.
+        """
+        inputs_hash = hash_inputs(inputs)
+        if self.is_fresh(artifact_path, inputs_hash):
+            return False
+        build_fn()
+        self.record(artifact_path, inputs_hash)
+        return True
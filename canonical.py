@@ -0,0 +1,57 @@
+import pandas as pd
+
+from timestamps import normalize_watch_times, to_epoch_ms
+
+# Typed columns derived once at ingest / enrichment so downstream stages can
+# group on plain integers instead of re-parsing links and timestamps
+CANONICAL_COLUMNS = [
+    "video_id",
+    "channel_id",
+    "watch_epoch_ms",
+    "local_date",
+    "year",
+    "weekday",
+    "hour",
+]
+
+VIDEO_ID_PATTERN = r"v=([^&]+)"
+CHANNEL_ID_PATTERN = r"/channel/([^/?&]+)"
+
+
+def add_canonical_columns(df: pd.DataFrame, local_timezone=None) -> pd.DataFrame:
+    """
+    Fills in the canonical columns for rows that don't have them yet.
+
+    Rows that already carry every canonical value are left untouched, so
+    calling this on an up-to-date frame costs a null check.
+    """
+    df = df.copy()
+    for column in CANONICAL_COLUMNS:
+        if column not in df.columns:
+            df[column] = pd.NA
+
+    missing = df[CANONICAL_COLUMNS].drop(columns=["channel_id"]).isna().any(axis=1)
+    missing |= df["channel_id"].isna() & df["channel_link"].notna()
+    if not missing.any():
+        return df
+
+    rows = df.loc[missing]
+    watch_times = normalize_watch_times(rows, local_timezone)
+
+    df.loc[missing, "watch_epoch_ms"] = to_epoch_ms(watch_times)
+    df.loc[missing, "local_date"] = watch_times.dt.strftime("%Y-%m-%d")
+    df.loc[missing, "year"] = watch_times.dt.year
+    df.loc[missing, "weekday"] = watch_times.dt.dayofweek
+    df.loc[missing, "hour"] = watch_times.dt.hour
+    df.loc[missing, "video_id"] = rows["video_id"].fillna(
+        rows["video_link"].astype("string").str.extract(VIDEO_ID_PATTERN, expand=False)
+    )
+    df.loc[missing, "channel_id"] = rows["channel_id"].fillna(
+        rows["channel_link"]
+        .astype("string")
+        .str.extract(CHANNEL_ID_PATTERN, expand=False)
+    )
+
+    for column in ("watch_epoch_ms", "year", "weekday", "hour"):
+        df[column] = pd.to_numeric(df[column], errors="coerce").astype("Int64")
+    return df
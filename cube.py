@@ -0,0 +1,261 @@
+import json
+import os
+import threading
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from aggregates import filter_wrapped_rows
+from event_store import EventStore, get_event_store
+from manifest import file_signature
+
+CUBE_DIR = "rollup-cube"
+
+# Dimensions in storage order. category and channel are dictionary encoded.
+DIMENSIONS = ("year", "month", "weekday", "hour", "category", "channel")
+ENCODED_DIMENSIONS = ("category", "channel")
+MEASURES = ("minutes", "views")
+
+DIMENSION_DTYPES = {
+    "year": np.int16,
+    "month": np.int8,
+    "weekday": np.int8,
+    "hour": np.int8,
+    "category": np.int32,
+    "channel": np.int32,
+}
+
+_cube_lock = threading.RLock()
+_loaded_cubes = {}
+
+
+class RollupCube:
+    """
+    Pre-aggregated minutes and views over year x month x weekday x hour x
+    category x channel, small enough to answer ad-hoc group-bys in memory.
+    """
+
+    def __init__(self, columns: dict, vocab: dict):
+        self.columns = columns
+        self.vocab = vocab
+
+    def __len__(self):
+        return len(self.columns["views"])
+
+    @classmethod
+    def from_rows(cls, df: pd.DataFrame) -> "RollupCube":
+        """Builds a cube from filtered enriched rows (see filter_wrapped_rows)."""
+        frame = pd.DataFrame(
+            {
+                "year": df["year"].astype("Int64"),
+                "month": pd.to_numeric(
+                    df["local_date"].astype("string").str[5:7], errors="coerce"
+                ).astype("Int64"),
+                "weekday": df["weekday"].astype("Int64"),
+                "hour": df["hour"].astype("Int64"),
+                "category": df["category_name"].astype("string").fillna(""),
+                "channel": df["channel_name"].astype("string").fillna(""),
+                "seconds": pd.to_numeric(df["duration_seconds"], errors="coerce").fillna(0),
+                "views": 1,
+            }
+        ).dropna(subset=["year", "month", "weekday", "hour"])
+        return cls._aggregate(frame)
+
+    @classmethod
+    def from_store(cls, store: EventStore) -> "RollupCube":
+        """Builds a cube from the event store, grouping on its integer codes."""
+        local_months = store.columns["local_day"].astype("datetime64[D]").astype(
+            "datetime64[M]"
+        )
+        frame = pd.DataFrame(
+            {
+                "year": store.columns["year"],
+                "month": local_months.astype(np.int64) % 12 + 1,
+                "weekday": store.columns["weekday"],
+                "hour": store.columns["hour"],
+                "category": store.decode("category", fill=""),
+                "channel": store.decode("channel", fill=""),
+                "seconds": store.columns["seconds"],
+                "views": 1,
+            }
+        )
+        return cls._aggregate(frame)
+
+    @classmethod
+    def _aggregate(cls, frame: pd.DataFrame) -> "RollupCube":
+        """Dictionary-encodes the label dimensions and sums cells."""
+        frame = frame.copy()
+        vocab = {}
+        for dimension in ENCODED_DIMENSIONS:
+            codes, uniques = pd.factorize(frame[dimension])
+            frame[dimension] = codes
+            vocab[dimension] = [str(value) for value in uniques]
+
+        grouped = (
+            frame.groupby(list(DIMENSIONS), sort=False)[["seconds", "views"]]
+            .sum()
+            .reset_index()
+        )
+        columns = {
+            dimension: grouped[dimension].to_numpy(dtype=DIMENSION_DTYPES[dimension])
+            for dimension in DIMENSIONS
+        }
+        columns["seconds"] = grouped["seconds"].to_numpy(dtype=np.int64)
+        columns["views"] = grouped["views"].to_numpy(dtype=np.int32)
+        return cls(columns, vocab)
+
+    def to_frame(self, decode: bool = False) -> pd.DataFrame:
+        frame = pd.DataFrame(self.columns)
+        if decode:
+            for dimension in ENCODED_DIMENSIONS:
+                labels = np.array(self.vocab[dimension], dtype=object)
+                frame[dimension] = labels[frame[dimension].to_numpy()]
+        return frame
+
+    def merge(self, other: "RollupCube") -> "RollupCube":
+        """Returns a cube with the cells of both cubes added together."""
+        combined = pd.concat(
+            [self.to_frame(decode=True), other.to_frame(decode=True)],
+            ignore_index=True,
+        )
+        return self._aggregate(combined)
+
+    def query(
+        self,
+        filters: dict | None = None,
+        group_by: list | None = None,
+        order_by: str = "minutes",
+        limit: int | None = 100,
+    ) -> list:
+        """
+        Filters cells by dimension values and sums minutes / views per group.
+
+        `filters` maps a dimension to a list of accepted values, using names
+        for category and channel and integers for everything else.
+        """
+        filters = filters or {}
+        group_by = list(group_by or [])
+        for dimension in [*filters, *group_by]:
+            if dimension not in DIMENSIONS:
+                raise ValueError(f"Unknown dimension: {dimension}")
+        if order_by not in (*MEASURES, *group_by):
+            raise ValueError(f"Can't order by: {order_by}")
+
+        mask = np.ones(len(self), dtype=bool)
+        for dimension, values in filters.items():
+            if dimension in ENCODED_DIMENSIONS:
+                lookup = {label: code for code, label in enumerate(self.vocab[dimension])}
+                codes = [lookup[value] for value in values if value in lookup]
+            else:
+                codes = [int(value) for value in values]
+            mask &= np.isin(self.columns[dimension], codes)
+
+        frame = pd.DataFrame(
+            {
+                name: column[mask]
+                for name, column in self.columns.items()
+                if name in group_by or name in ("seconds", "views")
+            }
+        )
+        if group_by:
+            frame = frame.groupby(group_by, sort=False)[["seconds", "views"]].sum()
+            frame = frame.reset_index()
+        else:
+            frame = pd.DataFrame(
+                {"seconds": [frame["seconds"].sum()], "views": [frame["views"].sum()]}
+            )
+        frame["minutes"] = (frame["seconds"] / 60).round(1)
+        frame = frame.drop(columns=["seconds"])
+
+        ascending = order_by in group_by
+        frame = frame.sort_values(order_by, ascending=ascending, kind="stable")
+        if limit:
+            frame = frame.head(limit)
+
+        rows = []
+        for record in frame.to_dict(orient="records"):
+            row = {}
+            for name, value in record.items():
+                if name in ENCODED_DIMENSIONS:
+                    row[name] = self.vocab[name][int(value)] or None
+                elif name == "minutes":
+                    row[name] = float(value)
+                else:
+                    row[name] = int(value)
+            rows.append(row)
+        return rows
+
+    def save(self, cube_dir: Path, signature):
+        cube_dir.mkdir(parents=True, exist_ok=True)
+        tmp_path = cube_dir / "cube.tmp.npz"
+        np.savez_compressed(tmp_path, **self.columns)
+        os.replace(tmp_path, cube_dir / "cube.npz")
+        meta_tmp_path = cube_dir / "meta.json.tmp"
+        with meta_tmp_path.open("w", encoding="utf-8") as f:
+            json.dump(
+                {"enriched_signature": list(signature), "vocab": self.vocab}, f
+            )
+        os.replace(meta_tmp_path, cube_dir / "meta.json")
+
+    @classmethod
+    def load(cls, cube_dir: Path) -> tuple["RollupCube", list] | None:
+        """Returns (cube, enriched_signature) or None if nothing is stored."""
+        try:
+            with (cube_dir / "meta.json").open("r", encoding="utf-8") as f:
+                meta = json.load(f)
+            with np.load(cube_dir / "cube.npz") as arrays:
+                columns = {name: arrays[name] for name in arrays.files}
+        except FileNotFoundError:
+            return None
+        return cls(columns, meta["vocab"]), meta["enriched_signature"]
+
+
+def get_cube_dir(cache_dir) -> Path:
+    return Path(cache_dir) / CUBE_DIR
+
+
+def rebuild_cube(data_dir, cache_dir) -> RollupCube:
+    with _cube_lock:
+        signature = file_signature(data_dir / "watch-history-enriched.csv")
+        cube = RollupCube.from_store(get_event_store(data_dir, cache_dir))
+        cube.save(get_cube_dir(cache_dir), signature)
+        _loaded_cubes[str(cache_dir)] = (list(signature), cube)
+        return cube
+
+
+def get_cube(data_dir, cache_dir) -> RollupCube | None:
+    """
+    Returns the cube for the current enriched file, from memory when possible,
+    then from disk, rebuilding it only if the file changed underneath.
+    """
+    signature = file_signature(data_dir / "watch-history-enriched.csv")
+    if signature is None:
+        return None
+    with _cube_lock:
+        loaded = _loaded_cubes.get(str(cache_dir))
+        if loaded is None:
+            loaded = RollupCube.load(get_cube_dir(cache_dir))
+            if loaded is not None:
+                loaded = (loaded[1], loaded[0])
+                _loaded_cubes[str(cache_dir)] = loaded
+        if loaded is not None and loaded[0] == list(signature):
+            return loaded[1]
+        return rebuild_cube(data_dir, cache_dir)
+
+
+def update_cube(data_dir, cache_dir, new_rows: pd.DataFrame, previous_signature):
+    """Merges newly enriched rows into the stored cube, like the wrapped partials."""
+    with _cube_lock:
+        loaded = RollupCube.load(get_cube_dir(cache_dir))
+        if (
+            loaded is None
+            or previous_signature is None
+            or loaded[1] != list(previous_signature)
+        ):
+            rebuild_cube(data_dir, cache_dir)
+            return
+        cube = loaded[0].merge(RollupCube.from_rows(filter_wrapped_rows(new_rows)))
+        signature = file_signature(data_dir / "watch-history-enriched.csv")
+        cube.save(get_cube_dir(cache_dir), signature)
+        _loaded_cubes[str(cache_dir)] = (list(signature), cube)
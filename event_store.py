@@ -0,0 +1,424 @@
+import json
+import os
+import shutil
+import threading
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from aggregates import (
+    SAMPLE_ROWS,
+    filter_wrapped_rows,
+    iter_wrapped_chunks,
+    load_wrapped_frame,
+    plan_chunksize,
+    rows_within_budget,
+)
+from manifest import file_signature
+
+EVENT_STORE_DIR = "event-store"
+EVENT_STORE_VERSION = 2
+
+# Each enrichment batch is stored as its own segment. Past this many the
+# store is compacted back into one, so loads stay a single memory map.
+MAX_SEGMENTS = int(os.environ.get("YOUTUBE_WRAPPED_EVENT_STORE_MAX_SEGMENTS", 32))
+
+# Rows remapped at a time while compacting segments on disk
+COMPACT_ROWS = 1 << 20
+
+# Row-aligned numpy columns, one .npy file each so they can be memory mapped
+COLUMN_DTYPES = {
+    "epoch_ms": np.int64,
+    "seconds": np.int32,
+    "local_day": np.int32,  # days since 1970-01-01 in local time
+    "year": np.int16,
+    "weekday": np.int8,
+    "hour": np.int8,
+    "video": np.int32,
+    "video_link": np.int32,
+    "channel": np.int32,
+    "channel_link": np.int32,
+    "category": np.int32,
+}
+
+# Dictionary encoded columns and the enriched csv column they come from.
+# Codes index into the vocab list, -1 means missing.
+ENCODED_COLUMNS = {
+    "video": "video_name",
+    "video_link": "video_link",
+    "channel": "channel_name",
+    "channel_link": "channel_link",
+    "category": "category_name",
+}
+
+_store_lock = threading.RLock()
+_loaded_stores = {}
+
+
+class EventStore:
+    """
+    The wrapped rows of the enriched history as numpy arrays, with every
+    repeated string interned once in a per-column vocab.
+    """
+
+    def __init__(self, columns: dict, vocab: dict):
+        self.columns = columns
+        self.vocab = vocab
+
+    def __len__(self):
+        return len(self.columns["epoch_ms"])
+
+    @classmethod
+    def from_rows(cls, df: pd.DataFrame) -> "EventStore":
+        """Encodes filtered enriched rows (see filter_wrapped_rows)."""
+        df = df.dropna(subset=["watch_epoch_ms", "local_date", "year"])
+        columns = {
+            "epoch_ms": df["watch_epoch_ms"].to_numpy(dtype=np.int64),
+            "seconds": pd.to_numeric(df["duration_seconds"], errors="coerce")
+            .fillna(0)
+            .to_numpy(dtype=np.int32),
+            "local_day": np.asarray(df["local_date"], dtype="datetime64[D]").astype(
+                np.int32
+            ),
+            "year": df["year"].to_numpy(dtype=np.int16),
+            "weekday": df["weekday"].to_numpy(dtype=np.int8),
+            "hour": df["hour"].to_numpy(dtype=np.int8),
+        }
+        vocab = {}
+        for name, source in ENCODED_COLUMNS.items():
+            codes, uniques = pd.factorize(df[source])
+            columns[name] = codes.astype(np.int32)
+            vocab[name] = [str(value) for value in uniques]
+        return cls(columns, vocab)
+
+    @classmethod
+    def concat(cls, stores) -> "EventStore":
+        """Appends stores in order, merging their vocabularies."""
+        stores = list(stores)
+        vocab, mappings = _merge_vocab(stores)
+        columns = {}
+        for name in COLUMN_DTYPES:
+            columns[name] = np.concatenate(
+                [
+                    mapping[name][store.columns[name]] if name in mapping else store.columns[name]
+                    for store, mapping in zip(stores, mappings)
+                ]
+            )
+        return cls(columns, vocab)
+
+    def slice(self, start: int, stop: int) -> "EventStore":
+        """Rows start:stop, with each vocab narrowed to the values they use."""
+        columns = {name: self.columns[name][start:stop] for name in COLUMN_DTYPES}
+        vocab = {}
+        for name in ENCODED_COLUMNS:
+            codes = np.asarray(columns[name])
+            used = np.unique(codes[codes >= 0])
+            columns[name] = np.where(codes >= 0, np.searchsorted(used, codes), -1).astype(
+                np.int32
+            )
+            vocab[name] = [self.vocab[name][code] for code in used]
+        return EventStore(columns, vocab)
+
+    def decode(self, name: str, fill=None) -> pd.Categorical:
+        """
+        Returns an encoded column as a Categorical over its vocab, so pandas
+        groups on the integer codes. Missing values become `fill` if given.
+        """
+        codes = self.columns[name]
+        categories = list(self.vocab[name])
+        if fill is not None:
+            codes = np.where(codes < 0, len(categories), codes)
+            categories.append(fill)
+        return pd.Categorical.from_codes(codes, categories=categories)
+
+    def to_frame(self) -> pd.DataFrame:
+        """
+        The store as filtered enriched rows (see filter_wrapped_rows), with
+        the string columns as Categoricals over the vocab.
+        """
+        days, day_codes = np.unique(np.asarray(self.columns["local_day"]), return_inverse=True)
+        frame = {
+            "watch_epoch_ms": np.asarray(self.columns["epoch_ms"]),
+            "duration_seconds": np.asarray(self.columns["seconds"]),
+            "local_date": pd.Categorical.from_codes(
+                day_codes.reshape(-1), categories=days.astype("datetime64[D]").astype(str)
+            ),
+            "year": np.asarray(self.columns["year"]),
+            "weekday": np.asarray(self.columns["weekday"]),
+            "hour": np.asarray(self.columns["hour"]),
+        }
+        for name, source in ENCODED_COLUMNS.items():
+            frame[source] = self.decode(name)
+        return pd.DataFrame(frame)
+
+    def plan_chunksize(self, memory_budget_mb=None) -> int | None:
+        """Rows per frame that keep to_frame within the memory budget, None for all."""
+        sample = self.slice(0, SAMPLE_ROWS).to_frame()
+        return rows_within_budget(sample, len(self), memory_budget_mb)
+
+    def iter_frames(self, chunksize: int | None = None):
+        """Yields the store as frames (see to_frame) of at most chunksize rows."""
+        if chunksize is None or chunksize >= len(self):
+            if len(self):
+                yield self.to_frame()
+            return
+        for start in range(0, len(self), chunksize):
+            yield self.slice(start, start + chunksize).to_frame()
+
+    def save_segment(self, store_dir: Path) -> str:
+        """Writes the store as a new segment under store_dir and returns its name."""
+        name, tmp_dir = _new_segment_dir(store_dir)
+        for column, dtype in COLUMN_DTYPES.items():
+            np.save(tmp_dir / f"{column}.npy", np.asarray(self.columns[column], dtype=dtype))
+        with (tmp_dir / "vocab.json").open("w", encoding="utf-8") as f:
+            json.dump(self.vocab, f)
+        tmp_dir.rename(Path(store_dir) / name)
+        return name
+
+    def save(self, store_dir: Path, signature):
+        """Replaces everything under store_dir with the store as one segment."""
+        segment = self.save_segment(store_dir)
+        write_meta(store_dir, [segment], signature, len(self))
+
+    @classmethod
+    def load_segment(cls, segment_dir: Path, mmap_mode: str | None = "r") -> "EventStore":
+        with (segment_dir / "vocab.json").open("r", encoding="utf-8") as f:
+            vocab = json.load(f)
+        columns = {
+            name: np.load(segment_dir / f"{name}.npy", mmap_mode=mmap_mode)
+            for name in COLUMN_DTYPES
+        }
+        return cls(columns, vocab)
+
+    @classmethod
+    def load(cls, store_dir: Path, mmap_mode: str | None = "r"):
+        """
+        Returns (store, enriched_signature), or None if nothing usable is
+        stored. A single segment stays memory mapped, several are combined
+        into one in-memory store.
+        """
+        store_dir = Path(store_dir)
+        meta = read_meta(store_dir)
+        if meta is None:
+            return None
+        try:
+            segments = [
+                cls.load_segment(store_dir / name, mmap_mode) for name in meta["segments"]
+            ]
+        except FileNotFoundError:
+            return None
+        store = segments[0] if len(segments) == 1 else cls.concat(segments)
+        return store, meta["enriched_signature"]
+
+
+def _merge_vocab(stores) -> tuple[dict, list]:
+    """
+    Merges the vocabularies of stores in order. Returns the merged vocab
+    and, per store, arrays mapping its codes to merged ones.
+    """
+    vocab = {}
+    mappings = [{} for _ in stores]
+    for name in ENCODED_COLUMNS:
+        lookup = {}
+        for store, mapping in zip(stores, mappings):
+            # -1 codes pick the trailing -1 entry
+            mapping[name] = np.array(
+                [lookup.setdefault(value, len(lookup)) for value in store.vocab[name]]
+                + [-1],
+                dtype=np.int32,
+            )
+        vocab[name] = list(lookup)
+    return vocab, mappings
+
+
+def _new_segment_dir(store_dir: Path) -> tuple[str, Path]:
+    store_dir = Path(store_dir)
+    store_dir.mkdir(parents=True, exist_ok=True)
+    numbers = [
+        int(path.name.split("-")[1].split(".")[0]) for path in store_dir.glob("segment-*")
+    ]
+    name = f"segment-{max(numbers, default=0) + 1:06d}"
+    tmp_dir = store_dir / f"{name}.tmp"
+    tmp_dir.mkdir()
+    return name, tmp_dir
+
+
+def compact_segments(store_dir: Path, segments: list, signature):
+    """
+    Replaces `segments` (in enriched file order) with one segment. Rows are
+    remapped to the merged vocab and copied straight into memory mapped
+    output files, so the segments are never loaded together.
+    """
+    store_dir = Path(store_dir)
+    stores = [EventStore.load_segment(store_dir / segment) for segment in segments]
+    vocab, mappings = _merge_vocab(stores)
+    rows = sum(len(store) for store in stores)
+    name, tmp_dir = _new_segment_dir(store_dir)
+    for column, dtype in COLUMN_DTYPES.items():
+        output = np.lib.format.open_memmap(
+            tmp_dir / f"{column}.npy", mode="w+", dtype=dtype, shape=(rows,)
+        )
+        position = 0
+        for store, mapping in zip(stores, mappings):
+            values = store.columns[column]
+            for start in range(0, len(values), COMPACT_ROWS):
+                block = values[start : start + COMPACT_ROWS]
+                if column in mapping:
+                    block = mapping[column][block]
+                output[position : position + len(block)] = block
+                position += len(block)
+        output.flush()
+        del output
+    with (tmp_dir / "vocab.json").open("w", encoding="utf-8") as f:
+        json.dump(vocab, f)
+    del stores
+    tmp_dir.rename(store_dir / name)
+    write_meta(store_dir, [name], signature, rows)
+
+
+def read_meta(store_dir: Path) -> dict | None:
+    try:
+        with (Path(store_dir) / "meta.json").open("r", encoding="utf-8") as f:
+            meta = json.load(f)
+    except FileNotFoundError:
+        return None
+    if meta.get("version") != EVENT_STORE_VERSION or not meta.get("segments"):
+        return None
+    return meta
+
+
+def write_meta(store_dir: Path, segments: list, signature, rows: int):
+    """
+    Points the store at `segments` (in enriched file order) and removes
+    every segment it no longer uses.
+    """
+    store_dir = Path(store_dir)
+    tmp_path = store_dir / "meta.json.tmp"
+    with tmp_path.open("w", encoding="utf-8") as f:
+        json.dump(
+            {
+                "version": EVENT_STORE_VERSION,
+                "enriched_signature": list(signature),
+                "segments": segments,
+                "rows": rows,
+            },
+            f,
+        )
+    os.replace(tmp_path, store_dir / "meta.json")
+
+    for path in store_dir.iterdir():
+        if path.name in segments or path.name == "meta.json":
+            continue
+        # Arrays still mapped by readers keep unlinked files alive on POSIX.
+        # Windows refuses to delete mapped files, those are retried next time.
+        if path.is_dir():
+            shutil.rmtree(path, ignore_errors=True)
+        else:
+            try:
+                path.unlink()
+            except OSError:
+                pass
+
+
+def get_event_store_dir(cache_dir) -> Path:
+    return Path(cache_dir) / EVENT_STORE_DIR
+
+
+def _remember(cache_dir, signature, store: EventStore | None = None) -> EventStore:
+    # Reload memory mapped so every request shares the same pages
+    loaded = EventStore.load(get_event_store_dir(cache_dir))
+    if loaded is not None:
+        store = loaded[0]
+    _loaded_stores[str(cache_dir)] = (list(signature), store)
+    return store
+
+
+def rebuild_event_store(data_dir, cache_dir) -> EventStore:
+    with _store_lock:
+        enriched_data_path = data_dir / "watch-history-enriched.csv"
+        signature = file_signature(enriched_data_path)
+        store_dir = get_event_store_dir(cache_dir)
+        chunksize = plan_chunksize(enriched_data_path)
+        if chunksize is None:
+            store = EventStore.from_rows(load_wrapped_frame(data_dir))
+            store.save(store_dir, signature)
+            return _remember(cache_dir, signature, store)
+
+        # One segment per chunk, then merged on disk
+        segments = [
+            EventStore.from_rows(chunk).save_segment(store_dir)
+            for chunk in iter_wrapped_chunks(data_dir, chunksize)
+        ]
+        compact_segments(store_dir, segments, signature)
+        return _remember(cache_dir, signature)
+
+
+def get_event_store(data_dir, cache_dir) -> EventStore | None:
+    """
+    Returns the memory mapped event store for the current enriched file,
+    loading it once per process and rebuilding it only when the file changed.
+    """
+    signature = file_signature(data_dir / "watch-history-enriched.csv")
+    if signature is None:
+        return None
+    with _store_lock:
+        loaded = _loaded_stores.get(str(cache_dir))
+        if loaded is None:
+            loaded = EventStore.load(get_event_store_dir(cache_dir))
+            if loaded is not None:
+                loaded = (loaded[1], loaded[0])
+                _loaded_stores[str(cache_dir)] = loaded
+        if loaded is not None and loaded[0] == list(signature):
+            return loaded[1]
+        return rebuild_event_store(data_dir, cache_dir)
+
+
+def update_event_store(data_dir, cache_dir, new_rows: pd.DataFrame, previous_signature):
+    """
+    Stores newly enriched rows as a new segment ahead of the existing ones,
+    matching their place in the enriched file. Only the new rows are
+    written, until there are enough segments to compact them.
+    """
+    with _store_lock:
+        store_dir = get_event_store_dir(cache_dir)
+        meta = read_meta(store_dir)
+        signature = file_signature(data_dir / "watch-history-enriched.csv")
+        if meta is not None and meta["enriched_signature"] == list(signature):
+            # Already rebuilt for the new file, e.g. by a wrapped rebuild
+            return
+        if (
+            meta is None
+            or previous_signature is None
+            or meta["enriched_signature"] != list(previous_signature)
+        ):
+            rebuild_event_store(data_dir, cache_dir)
+            return
+        batch = EventStore.from_rows(filter_wrapped_rows(new_rows))
+        segments = list(meta["segments"])
+        if len(batch):
+            segments.insert(0, batch.save_segment(store_dir))
+        write_meta(store_dir, segments, signature, meta["rows"] + len(batch))
+        # Loaded lazily by the next reader
+        _loaded_stores.pop(str(cache_dir), None)
+        if len(segments) > MAX_SEGMENTS:
+            compact_segments(store_dir, segments, signature)
+            _remember(cache_dir, signature)
+
+
+def iter_event_frames(data_dir, cache_dir, memory_budget_mb=None):
+    """
+    Yields the event store for the current enriched file as filtered
+    enriched rows, one segment slice at a time, each sized to fit the
+    memory budget. Segments are read memory mapped and never combined.
+    """
+    with _store_lock:
+        signature = file_signature(data_dir / "watch-history-enriched.csv")
+        store_dir = get_event_store_dir(cache_dir)
+        meta = read_meta(store_dir)
+        if meta is None or meta["enriched_signature"] != list(signature):
+            rebuild_event_store(data_dir, cache_dir)
+            meta = read_meta(store_dir)
+        segments = [EventStore.load_segment(store_dir / name) for name in meta["segments"]]
+    for segment in segments:
+        yield from segment.iter_frames(segment.plan_chunksize(memory_budget_mb))
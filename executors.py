@@ -0,0 +1,60 @@
+import asyncio
+import functools
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+
+def _env_int(name: str, default: int) -> int:
+    return int(os.environ.get(f"YOUTUBE_WRAPPED_{name}", default))
+
+
+# pandas, numpy and PIL release the GIL for most of their work, so threads
+# are enough here, and they can share the syftbox client and loaded caches.
+CPU_WORKERS = _env_int("CPU_WORKERS", min(4, os.cpu_count() or 1))
+IO_WORKERS = _env_int("IO_WORKERS", 8)
+
+# How many requests of each kind may run their blocking work at once.
+# Override one with e.g. YOUTUBE_WRAPPED_LIMIT_WRAPPED=1.
+ENDPOINT_LIMITS = {
+    "home": 4,
+    "status": 8,
+    "wrapped": 2,
+    "upload": 1,
+    "cube": 4,
+    "history": 8,
+    "api_key": 2,
+    "thumbnails": 1,
+}
+
+_pools = {}
+_limits = {}
+
+
+def get_pool(kind: str) -> ThreadPoolExecutor:
+    """Returns the shared "cpu" or "io" pool, creating it on first use."""
+    if kind not in _pools:
+        workers = {"cpu": CPU_WORKERS, "io": IO_WORKERS}[kind]
+        _pools[kind] = ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix=f"wrapped-{kind}"
+        )
+    return _pools[kind]
+
+
+def get_limit(endpoint: str) -> asyncio.Semaphore:
+    """Per-endpoint semaphore, so one kind of request can't fill the pools."""
+    if endpoint not in _limits:
+        default = ENDPOINT_LIMITS.get(endpoint, 4)
+        _limits[endpoint] = asyncio.Semaphore(_env_int(f"LIMIT_{endpoint.upper()}", default))
+    return _limits[endpoint]
+
+
+async def run_blocking(endpoint: str, fn, *args, pool: str = "cpu", **kwargs):
+    """
+    Runs fn(*args, **kwargs) in a worker pool without blocking the event
+    loop. At most the endpoint's limit of calls run at once, the rest wait.
+    """
+    async with get_limit(endpoint):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            get_pool(pool), functools.partial(fn, *args, **kwargs)
+        )
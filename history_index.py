@@ -0,0 +1,473 @@
+import base64
+import json
+import os
+import re
+import sqlite3
+import threading
+from contextlib import closing
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from aggregates import filter_wrapped_rows
+from event_store import EventStore, get_event_store
+from manifest import file_signature
+
+HISTORY_INDEX_FILE = "history-index.sqlite"
+HISTORY_INDEX_VERSION = 3
+
+MAX_PAGE_SIZE = 500
+MAX_SEARCH_HITS = 100
+MAX_TOP_CHANNELS = 100
+
+# Most recent watches returned with each search hit
+SEARCH_WATCHES_PER_HIT = 5
+
+SCHEMA = """
+CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT NOT NULL);
+CREATE TABLE watches (
+    id INTEGER PRIMARY KEY,
+    watch_epoch_ms INTEGER NOT NULL,
+    local_date TEXT NOT NULL,
+    duration_seconds INTEGER NOT NULL,
+    video_name TEXT,
+    video_link TEXT,
+    channel_name TEXT,
+    channel_link TEXT,
+    category_name TEXT
+);
+CREATE INDEX watches_by_time ON watches (watch_epoch_ms, id);
+CREATE INDEX watches_by_duration ON watches (duration_seconds, id);
+CREATE INDEX watches_by_date ON watches (local_date);
+CREATE INDEX watches_by_channel ON watches (channel_name, watch_epoch_ms, duration_seconds);
+CREATE INDEX watches_by_category ON watches (category_name, watch_epoch_ms);
+CREATE INDEX watches_by_video ON watches (video_link, watch_epoch_ms);
+CREATE TABLE videos (
+    id INTEGER PRIMARY KEY,
+    video_link TEXT NOT NULL UNIQUE,
+    video_name TEXT,
+    channel_name TEXT
+);
+"""
+
+# Full-text index over the distinct videos, kept in sync by a trigger.
+# Skipped where SQLite was built without FTS5, search then falls back to LIKE.
+SEARCH_SCHEMA = """
+CREATE VIRTUAL TABLE video_search USING fts5(
+    video_name,
+    channel_name,
+    content = 'videos',
+    content_rowid = 'id',
+    tokenize = 'unicode61 remove_diacritics 2',
+    prefix = '2 3'
+);
+CREATE TRIGGER videos_search_insert AFTER INSERT ON videos BEGIN
+    INSERT INTO video_search (rowid, video_name, channel_name)
+    VALUES (new.id, new.video_name, new.channel_name);
+END;
+"""
+
+ITEM_COLUMNS = (
+    "watch_epoch_ms",
+    "local_date",
+    "duration_seconds",
+    "video_name",
+    "video_link",
+    "channel_name",
+    "channel_link",
+    "category_name",
+)
+
+SORT_COLUMNS = {
+    "watched_at": "watch_epoch_ms",
+    "duration": "duration_seconds",
+}
+
+_index_lock = threading.RLock()
+_index_signatures = {}
+
+
+def _store_rows(store: EventStore):
+    """The rows of an event store as tuples in ITEM_COLUMNS order."""
+
+    def decoded(name):
+        vocab = np.array(store.vocab[name] + [None], dtype=object)
+        # -1 codes pick the trailing None
+        return vocab[np.asarray(store.columns[name])]
+
+    local_dates = (
+        np.asarray(store.columns["local_day"]).astype("datetime64[D]").astype(str)
+    )
+    return zip(
+        np.asarray(store.columns["epoch_ms"]).tolist(),
+        local_dates.tolist(),
+        np.asarray(store.columns["seconds"]).tolist(),
+        decoded("video"),
+        decoded("video_link"),
+        decoded("channel"),
+        decoded("channel_link"),
+        decoded("category"),
+    )
+
+
+def _insert_store(connection, store: EventStore):
+    (last_id,) = connection.execute("SELECT coalesce(max(id), 0) FROM watches").fetchone()
+    connection.executemany(
+        f"INSERT INTO watches ({', '.join(ITEM_COLUMNS)}) "
+        f"VALUES ({', '.join('?' for _ in ITEM_COLUMNS)})",
+        _store_rows(store),
+    )
+    # Videos keep the name and channel of their earliest watch. Batches are
+    # newer than what is indexed, so updates agree with a rebuild.
+    connection.execute(
+        """
+        INSERT OR IGNORE INTO videos (video_link, video_name, channel_name)
+        SELECT video_link, video_name, channel_name FROM watches
+        WHERE id > ? AND video_link IS NOT NULL ORDER BY watch_epoch_ms, id
+        """,
+        [last_id],
+    )
+
+
+def _create_search(connection):
+    try:
+        connection.executescript(SEARCH_SCHEMA)
+    except sqlite3.OperationalError as e:
+        print(f"Full-text search unavailable ({e}), search will use LIKE")
+
+
+def _set_signature(connection, signature):
+    connection.executemany(
+        "INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)",
+        [
+            ("version", str(HISTORY_INDEX_VERSION)),
+            ("enriched_signature", json.dumps(list(signature))),
+        ],
+    )
+
+
+def encode_cursor(sort: str, order: str, value, row_id) -> str:
+    raw = json.dumps([sort, order, value, row_id]).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii")
+
+
+def decode_cursor(cursor: str, sort: str, order: str) -> tuple:
+    """The (value, id) a cursor resumes after. It must be for the same sort and order."""
+    try:
+        cursor_sort, cursor_order, value, row_id = json.loads(
+            base64.urlsafe_b64decode(cursor.encode("ascii"))
+        )
+        value, row_id = int(value), int(row_id)
+    except Exception:
+        raise ValueError("Invalid cursor")
+    if (cursor_sort, cursor_order) != (sort, order):
+        raise ValueError(f"cursor is for sort={cursor_sort} and order={cursor_order}")
+    return value, row_id
+
+
+def filter_clauses(
+    start_date=None, end_date=None, channel=None, category=None, min_duration=None
+) -> tuple[list, list]:
+    """Returns the conditions on watches and their parameters for the history filters."""
+    clauses = []
+    params = []
+    for value, clause in ((start_date, "local_date >= ?"), (end_date, "local_date <= ?")):
+        if value is not None:
+            try:
+                params.append(pd.Timestamp(value).strftime("%Y-%m-%d"))
+            except ValueError:
+                raise ValueError(f"Invalid date: {value}")
+            clauses.append(clause)
+    if channel is not None:
+        clauses.append("channel_name = ?")
+        params.append(channel)
+    if category is not None:
+        clauses.append("category_name = ?")
+        params.append(category)
+    if min_duration is not None:
+        clauses.append("duration_seconds >= ?")
+        params.append(int(min_duration))
+    return clauses, params
+
+
+def build_filters(**filters) -> tuple[str, list]:
+    """Returns a WHERE clause and its parameters for the history filters."""
+    clauses, params = filter_clauses(**filters)
+    where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+    return where, params
+
+
+def search_query(text: str) -> tuple[str, list]:
+    """
+    Turns free text into an FTS5 query matching every word as a prefix,
+    plus the words themselves for the LIKE fallback.
+    """
+    words = re.findall(r"\w+", text.lower())
+    if not words:
+        raise ValueError("q must contain at least one word")
+    return " ".join(f'"{word}"*' for word in words), words
+
+
+class HistoryIndex:
+    """
+    The wrapped rows of the enriched history in an indexed SQLite table, so
+    filtered and paginated reads don't have to load the csv.
+    """
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+
+    def connect(self) -> sqlite3.Connection:
+        # Read-only and per call, so requests in different threads don't share one
+        connection = sqlite3.connect(f"file:{self.path}?mode=ro", uri=True)
+        connection.row_factory = sqlite3.Row
+        return connection
+
+    def history(
+        self, filters: dict, sort="watched_at", order="desc", limit=50, cursor=None
+    ) -> dict:
+        """
+        One page of matching watches plus the cursor for the next one.
+        Pages are keyed on (sort value, id), so they stay stable while rows
+        are added.
+        """
+        if sort not in SORT_COLUMNS:
+            raise ValueError(f"sort must be one of {', '.join(SORT_COLUMNS)}")
+        if order not in ("asc", "desc"):
+            raise ValueError("order must be asc or desc")
+        if not 1 <= limit <= MAX_PAGE_SIZE:
+            raise ValueError(f"limit must be between 1 and {MAX_PAGE_SIZE}")
+        column = SORT_COLUMNS[sort]
+        where, params = build_filters(**filters)
+        if cursor is not None:
+            comparison = "<" if order == "desc" else ">"
+            where += " AND " if where else "WHERE "
+            where += f"({column}, id) {comparison} (?, ?)"
+            params.extend(decode_cursor(cursor, sort, order))
+
+        with closing(self.connect()) as connection:
+            rows = connection.execute(
+                f"SELECT id, {', '.join(ITEM_COLUMNS)} FROM watches {where} "
+                f"ORDER BY {column} {order}, id {order} LIMIT ?",
+                [*params, limit + 1],
+            ).fetchall()
+
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = encode_cursor(sort, order, rows[-1][column], rows[-1]["id"])
+        return {
+            "items": [{name: row[name] for name in ITEM_COLUMNS} for row in rows],
+            "next_cursor": next_cursor,
+        }
+
+    def stats(self, filters: dict, top: int = 5) -> dict:
+        """Totals, top channels and category counts over the matching watches."""
+        if not 1 <= top <= MAX_TOP_CHANNELS:
+            raise ValueError(f"top must be between 1 and {MAX_TOP_CHANNELS}")
+        where, params = build_filters(**filters)
+        with closing(self.connect()) as connection:
+            totals = connection.execute(
+                f"""
+                SELECT count(*) AS views,
+                    coalesce(sum(duration_seconds), 0) AS seconds,
+                    count(DISTINCT local_date) AS days,
+                    count(DISTINCT channel_name) AS channels,
+                    min(watch_epoch_ms) AS first_watch_epoch_ms,
+                    max(watch_epoch_ms) AS last_watch_epoch_ms
+                FROM watches {where}
+                """,
+                params,
+            ).fetchone()
+            not_null = "AND" if where else "WHERE"
+            top_channels = connection.execute(
+                f"""
+                SELECT channel_name, count(*) AS views,
+                    sum(duration_seconds) / 60 AS minutes
+                FROM watches {where} {not_null} channel_name IS NOT NULL
+                GROUP BY channel_name
+                ORDER BY sum(duration_seconds) DESC, channel_name LIMIT ?
+                """,
+                [*params, top],
+            ).fetchall()
+            categories = connection.execute(
+                f"""
+                SELECT category_name, count(*) AS views
+                FROM watches {where} {not_null} category_name IS NOT NULL
+                GROUP BY category_name ORDER BY views DESC, category_name
+                """,
+                params,
+            ).fetchall()
+
+        stats = dict(totals)
+        stats["minutes"] = stats.pop("seconds") // 60
+        stats["top_channels"] = [dict(row) for row in top_channels]
+        stats["categories"] = {row["category_name"]: row["views"] for row in categories}
+        return stats
+
+    def search(self, text: str, filters: dict, limit: int = 20) -> dict:
+        """
+        Videos whose title or channel match every word of text (as
+        prefixes), best match first, with their most recent watches. Only
+        watches matching filters count.
+        """
+        if not 1 <= limit <= MAX_SEARCH_HITS:
+            raise ValueError(f"limit must be between 1 and {MAX_SEARCH_HITS}")
+        match, words = search_query(text)
+        clauses, filter_params = filter_clauses(**filters)
+        watch_filter = "".join(f" AND {clause}" for clause in clauses)
+        in_filters = (
+            f"AND EXISTS (SELECT 1 FROM watches WHERE video_link = videos.video_link"
+            f"{watch_filter})"
+            if clauses
+            else ""
+        )
+
+        with closing(self.connect()) as connection:
+            has_fts = connection.execute(
+                "SELECT 1 FROM sqlite_master WHERE name = 'video_search'"
+            ).fetchone()
+            if has_fts:
+                videos = connection.execute(
+                    f"""
+                    SELECT videos.video_link, videos.video_name, videos.channel_name,
+                        bm25(video_search, 2.0, 1.0) AS score
+                    FROM video_search JOIN videos ON videos.id = video_search.rowid
+                    WHERE video_search MATCH ? {in_filters}
+                    ORDER BY score, videos.video_link LIMIT ?
+                    """,
+                    [match, *filter_params, limit],
+                ).fetchall()
+            else:
+                # SQLite's lower() only folds ASCII, so fold case in Python
+                connection.create_function(
+                    "casefold",
+                    1,
+                    lambda value: value and value.casefold(),
+                    deterministic=True,
+                )
+                like = " AND ".join(
+                    "(casefold(video_name) LIKE ? OR casefold(channel_name) LIKE ?)"
+                    for _ in words
+                )
+                like_params = [
+                    pattern for word in words for pattern in (f"%{word.casefold()}%",) * 2
+                ]
+                videos = connection.execute(
+                    f"""
+                    SELECT video_link, video_name, channel_name, NULL AS score
+                    FROM videos WHERE {like} {in_filters}
+                    ORDER BY video_link LIMIT ?
+                    """,
+                    [*like_params, *filter_params, limit],
+                ).fetchall()
+
+            hits = []
+            for video in videos:
+                params = [video["video_link"], *filter_params]
+                (views,) = connection.execute(
+                    f"SELECT count(*) FROM watches WHERE video_link = ?{watch_filter}",
+                    params,
+                ).fetchone()
+                watches = connection.execute(
+                    f"""
+                    SELECT watch_epoch_ms, local_date FROM watches
+                    WHERE video_link = ?{watch_filter}
+                    ORDER BY watch_epoch_ms DESC LIMIT ?
+                    """,
+                    [*params, SEARCH_WATCHES_PER_HIT],
+                ).fetchall()
+                hits.append(
+                    {
+                        "video_name": video["video_name"],
+                        "video_link": video["video_link"],
+                        "channel_name": video["channel_name"],
+                        "score": video["score"],
+                        "views": views,
+                        "watches": [dict(watch) for watch in watches],
+                    }
+                )
+        return {"query": text, "hits": hits}
+
+
+def get_history_index_path(cache_dir) -> Path:
+    return Path(cache_dir) / HISTORY_INDEX_FILE
+
+
+def _read_signature(path: Path):
+    try:
+        connection = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+    except sqlite3.OperationalError:
+        return None
+    try:
+        meta = dict(connection.execute("SELECT key, value FROM meta").fetchall())
+    except sqlite3.DatabaseError:
+        return None
+    finally:
+        connection.close()
+    if meta.get("version") != str(HISTORY_INDEX_VERSION):
+        return None
+    return json.loads(meta["enriched_signature"])
+
+
+def rebuild_history_index(data_dir, cache_dir) -> HistoryIndex:
+    """Builds a fresh index from the event store and swaps it in."""
+    with _index_lock:
+        path = get_history_index_path(cache_dir)
+        signature = file_signature(data_dir / "watch-history-enriched.csv")
+        store = get_event_store(data_dir, cache_dir)
+
+        tmp_path = path.with_suffix(".sqlite.tmp")
+        if tmp_path.exists():
+            tmp_path.unlink()
+        connection = sqlite3.connect(tmp_path)
+        try:
+            connection.execute("PRAGMA journal_mode = OFF")
+            connection.executescript(SCHEMA)
+            _create_search(connection)
+            with connection:
+                _insert_store(connection, store)
+                _set_signature(connection, signature)
+        finally:
+            connection.close()
+        # Open readers keep the old file until they're done with it
+        os.replace(tmp_path, path)
+        _index_signatures[str(cache_dir)] = list(signature)
+        return HistoryIndex(path)
+
+
+def get_history_index(data_dir, cache_dir) -> HistoryIndex | None:
+    """
+    Returns the index for the current enriched file, rebuilding it only if
+    the file changed since the index was written.
+    """
+    signature = file_signature(data_dir / "watch-history-enriched.csv")
+    if signature is None:
+        return None
+    with _index_lock:
+        path = get_history_index_path(cache_dir)
+        key = str(cache_dir)
+        if key not in _index_signatures:
+            _index_signatures[key] = _read_signature(path)
+        if _index_signatures[key] == list(signature):
+            return HistoryIndex(path)
+        return rebuild_history_index(data_dir, cache_dir)
+
+
+def update_history_index(data_dir, cache_dir, new_rows: pd.DataFrame, previous_signature):
+    """Inserts newly enriched rows into the stored index."""
+    with _index_lock:
+        path = get_history_index_path(cache_dir)
+        if previous_signature is None or _read_signature(path) != list(previous_signature):
+            rebuild_history_index(data_dir, cache_dir)
+            return
+        signature = file_signature(data_dir / "watch-history-enriched.csv")
+        connection = sqlite3.connect(path)
+        try:
+            with connection:
+                _insert_store(connection, EventStore.from_rows(filter_wrapped_rows(new_rows)))
+                _set_signature(connection, signature)
+        finally:
+            connection.close()
+        _index_signatures[str(cache_dir)] = list(signature)
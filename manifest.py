@@ -0,0 +1,168 @@
+import json
+import os
+import threading
+import warnings
+from pathlib import Path
+
+import pandas as pd
+
+MANIFEST_FILE = "watch-history-manifest.json"
+
+_manifest_lock = threading.Lock()
+
+EMPTY_ENRICHED_SUMMARY = {
+    "processed_rows": 0,
+    "enriched_rows": 0,
+    "missing_rows": 0,
+    "year_counts": {},
+    "min_watch_time": None,
+    "max_watch_time": None,
+}
+
+
+def file_signature(path) -> tuple | None:
+    """Returns a cheap (size, mtime) signature for a file, or None if missing."""
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return (stat.st_size, stat.st_mtime_ns)
+
+
+def get_manifest_path(data_dir) -> Path:
+    return Path(data_dir) / MANIFEST_FILE
+
+
+def summarize_enriched_rows(df: pd.DataFrame) -> dict:
+    """
+    Computes the manifest counters for a block of enriched rows.
+
+    The result can be merged with merge_enriched_summaries, so appending a
+    batch only needs a summary of the new rows.
+    """
+    summary = dict(EMPTY_ENRICHED_SUMMARY)
+    summary["year_counts"] = {}
+    summary["processed_rows"] = len(df)
+
+    if "duration_seconds" in df.columns:
+        summary["enriched_rows"] = int(df["duration_seconds"].notna().sum())
+    if "error" in df.columns:
+        summary["missing_rows"] = int(
+            df["error"].astype(str).str.contains("not found", case=False, na=False).sum()
+        )
+    if "watch_time_dt" in df.columns:
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore", category=FutureWarning)
+            warnings.simplefilter("ignore", category=UserWarning)
+            watch_time_dt = pd.to_datetime(
+                df["watch_time_dt"], errors="coerce", utc=True
+            ).dropna()
+        if not watch_time_dt.empty:
+            summary["year_counts"] = {
+                str(year): int(count)
+                for year, count in watch_time_dt.dt.year.value_counts().items()
+            }
+            summary["min_watch_time"] = watch_time_dt.min().isoformat()
+            summary["max_watch_time"] = watch_time_dt.max().isoformat()
+    return summary
+
+
+def merge_enriched_summaries(a: dict, b: dict) -> dict:
+    merged = {
+        key: a.get(key, 0) + b.get(key, 0)
+        for key in ("processed_rows", "enriched_rows", "missing_rows")
+    }
+    year_counts = dict(a.get("year_counts", {}))
+    for year, count in b.get("year_counts", {}).items():
+        year_counts[year] = year_counts.get(year, 0) + count
+    merged["year_counts"] = year_counts
+
+    # ISO strings in UTC compare correctly as plain strings
+    min_times = [t for t in (a.get("min_watch_time"), b.get("min_watch_time")) if t]
+    max_times = [t for t in (a.get("max_watch_time"), b.get("max_watch_time")) if t]
+    merged["min_watch_time"] = min(min_times) if min_times else None
+    merged["max_watch_time"] = max(max_times) if max_times else None
+    return merged
+
+
+def load_manifest(data_dir) -> dict:
+    manifest_path = get_manifest_path(data_dir)
+    if manifest_path.exists():
+        try:
+            with manifest_path.open("r", encoding="utf-8") as f:
+                return json.load(f)
+        except Exception as e:
+            print(f"Error loading manifest: {e}")
+    return {}
+
+
+def write_manifest(data_dir, manifest: dict):
+    """Writes the manifest with write-and-rename so readers never see half a file."""
+    manifest_path = get_manifest_path(data_dir)
+    tmp_path = manifest_path.with_suffix(".json.tmp")
+    with tmp_path.open("w", encoding="utf-8") as f:
+        json.dump(manifest, f)
+    os.replace(tmp_path, manifest_path)
+
+
+def record_ingest(data_dir, watch_history_csv_path, total_rows: int):
+    """Stores the source row count after watch-history.csv was (re)written."""
+    with _manifest_lock:
+        manifest = load_manifest(data_dir)
+        source_signature = file_signature(watch_history_csv_path)
+        manifest["total_rows"] = int(total_rows)
+        manifest["source_signature"] = (
+            list(source_signature) if source_signature else None
+        )
+        manifest["version"] = manifest.get("version", 0) + 1
+        write_manifest(data_dir, manifest)
+
+
+def summarize_enriched_file(enriched_data_path) -> dict:
+    """Summarizes a whole enriched file, reading only the columns needed."""
+    df = pd.read_csv(
+        enriched_data_path,
+        usecols=lambda c: c in {"duration_seconds", "error", "watch_time_dt"},
+    )
+    return summarize_enriched_rows(df)
+
+
+def record_enriched(
+    data_dir, enriched_data_path, new_rows_summary: dict, previous_signature
+):
+    """
+    Folds the summary of newly written rows into the manifest.
+
+    `previous_signature` is the enriched file signature before the write. When
+    the manifest described exactly that state only the new rows are merged in,
+    otherwise the file is summarized once from scratch.
+    """
+    with _manifest_lock:
+        manifest = load_manifest(data_dir)
+        enriched = manifest.get("enriched")
+        if previous_signature is None:
+            # The file did not exist before, so it holds only the new rows
+            summary = new_rows_summary
+        elif enriched is not None and manifest.get("enriched_signature") == list(
+            previous_signature
+        ):
+            summary = merge_enriched_summaries(enriched, new_rows_summary)
+        else:
+            summary = summarize_enriched_file(enriched_data_path)
+        enriched_signature = file_signature(enriched_data_path)
+        manifest["enriched"] = summary
+        manifest["enriched_signature"] = (
+            list(enriched_signature) if enriched_signature else None
+        )
+        manifest["version"] = manifest.get("version", 0) + 1
+        write_manifest(data_dir, manifest)
+
+
+def reset_enriched(data_dir):
+    """Clears the enriched counters, e.g. after the enriched file was deleted."""
+    with _manifest_lock:
+        manifest = load_manifest(data_dir)
+        manifest.pop("enriched", None)
+        manifest.pop("enriched_signature", None)
+        manifest["version"] = manifest.get("version", 0) + 1
+        write_manifest(data_dir, manifest)
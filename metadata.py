@@ -1,17 +1,27 @@
 import json
 import os
 import re
-import warnings
+import time
 
 import isodate
 import pandas as pd
 import requests
-import tzlocal
 from tqdm import tqdm
 
+from aggregates import update_wrapped_aggregates
+from canonical import add_canonical_columns
+from cube import update_cube
+from event_store import update_event_store
+from history_index import update_history_index
+from manifest import file_signature, record_enriched, summarize_enriched_rows
+from metrics import get_pipeline_metrics, latency_metrics, span
 from resources import add_dataset
+from timestamps import normalize_watch_times
 from utils import YoutubeDataPipelineState
 
+# HTTP statuses from the YouTube Data API worth retrying
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+
 
 def load_metadata_cache(app_data_dir):
     METADATA_FILE = app_data_dir / "cache" / "youtube_metadata.json"
@@ -27,7 +37,34 @@ def save_metadata_cache(cache, app_data_dir):
         json.dump(cache, f, indent=2, ensure_ascii=False)
 
 
-def fetch_video_metadata(video_ids, api_key, cache):
+def get_with_retries(url, params, metrics=None, max_retries: int = 2, quota_units: int = 1):
+    """GET a YouTube Data API url, retrying transient failures with backoff."""
+    for attempt in range(max_retries + 1):
+        start = time.perf_counter()
+        try:
+            response = requests.get(url, params=params, timeout=30)
+        except (requests.ConnectionError, requests.Timeout):
+            if metrics:
+                metrics.record_api_request(
+                    time.perf_counter() - start, ok=False, quota_units=quota_units
+                )
+            if attempt == max_retries:
+                raise
+        else:
+            ok = response.status_code == 200
+            if metrics:
+                metrics.record_api_request(
+                    time.perf_counter() - start, ok=ok, quota_units=quota_units
+                )
+            if response.status_code not in RETRYABLE_STATUS_CODES or attempt == max_retries:
+                response.raise_for_status()
+                return response
+        if metrics:
+            metrics.record_retry()
+        time.sleep(2**attempt)
+
+
+def fetch_video_metadata(video_ids, api_key, cache, metrics=None):
     results = {}
 
     # Retrieve cached metadata
@@ -35,8 +72,15 @@ def fetch_video_metadata(video_ids, api_key, cache):
         if video_id is not None:
             if video_id in cache and cache[video_id] is not None:
                 results[video_id] = cache[video_id]
+                if metrics:
+                    # Strings are cached "not found" answers
+                    metrics.record_cache_lookup(
+                        hit=True, negative=isinstance(cache[video_id], str)
+                    )
             else:
                 results[video_id] = None  # Store None for uncached video_id
+                if metrics:
+                    metrics.record_cache_lookup(hit=False)
 
     uncached_video_ids = [
         video_id for video_id, metadata in results.items() if metadata is None
@@ -53,8 +97,7 @@ def fetch_video_metadata(video_ids, api_key, cache):
         }
 
         try:
-            response = requests.get(url, params=params)
-            response.raise_for_status()
+            response = get_with_retries(url, params, metrics=metrics)
             data = response.json()
 
             for item in data.get("items", []):
@@ -70,6 +113,8 @@ def fetch_video_metadata(video_ids, api_key, cache):
                 warning_message = (
                     f"Warning: Video ID {video_id} not found or inaccessible."
                 )
+                # Cache the miss so deleted videos don't cost quota on every run
+                cache[video_id] = warning_message
                 results[video_id] = warning_message
 
         except Exception as e:
@@ -107,7 +152,7 @@ def get_duration_seconds_from_metadata(metadata):
 
 
 def fetch_and_save_youtube_category_mapping(
-    api_key: str, region_cache, region_code: str = "US"
+    api_key: str, region_cache, region_code: str = "US", metrics=None
 ) -> dict:
     """
     Fetch YouTube video categories, save to a file, and return a mapping of category ID to category Title.
@@ -131,8 +176,7 @@ def fetch_and_save_youtube_category_mapping(
     url = "https://www.googleapis.com/youtube/v3/videoCategories"
     params = {"part": "snippet", "regionCode": region_code, "key": api_key}
 
-    response = requests.get(url, params=params)
-    response.raise_for_status()
+    response = get_with_retries(url, params, metrics=metrics)
     data = response.json()
 
     category_mapping = {
@@ -160,32 +204,16 @@ def process_rows(
     if not pipeline_state.is_keep_running():
         return
 
+    metrics = get_pipeline_metrics(app_data_dir)
+    run_start = time.perf_counter()
+
     # Load your existing watch history
+    load_start = time.perf_counter()
     df = pd.read_csv(watch_history_path)
+    total_rows = len(df)
 
-    # Step 1: Parse datetime normally, ignoring warnings
-    with warnings.catch_warnings():
-        warnings.simplefilter("ignore", category=FutureWarning)
-        warnings.simplefilter("ignore", category=UserWarning)
-        df["watch_time_dt"] = pd.to_datetime(
-            df["watch_time"], errors="coerce", utc=True
-        )
-
-    # Step 2: Detect system timezone
-    local_timezone = tzlocal.get_localzone()
-
-    # Step 3: Fix timezone correctly for each row
-    def fix_timezone(dt):
-        if pd.isna(dt):
-            return dt
-        if dt.tzinfo is None:
-            # Naive datetime, localize it
-            return dt.tz_localize(local_timezone)
-        else:
-            # Already timezone-aware, just convert
-            return dt.tz_convert(local_timezone)
-
-    df["watch_time_dt"] = df["watch_time_dt"].apply(fix_timezone)
+    df["watch_time_dt"] = normalize_watch_times(df)
+    df = add_canonical_columns(df)
 
     # Assuming your parsed datetime is in 'watch_time_dt'
     if year_filter:
@@ -207,6 +235,7 @@ def process_rows(
     errors = []
     channel_names = []
     channel_links = []
+    channel_ids = []
     video_names = []
 
     if "duration_seconds" not in df.columns:
@@ -219,8 +248,10 @@ def process_rows(
         df["error"] = None
 
     # Load the processed rows if they exist
+    already_processed = 0
     if os.path.exists(enriched_data_path):
         processed_df = pd.read_csv(enriched_data_path)
+        already_processed = len(processed_df)
 
         # Remove processed rows from the main DataFrame
         df = df[
@@ -230,13 +261,17 @@ def process_rows(
         ]
 
     links_to_process = df.head(n)
+    latency_metrics.observe_stage("enrich_load", time.perf_counter() - load_start)
 
     if len(links_to_process) == 0:
+        metrics.set_progress(total_rows, total_rows)
+        metrics.save()
         pipeline_state.set_processing(False)
         pipeline_state.set_keep_running(False)
         return
 
     previous_cache_len = len(cache)
+    unique_video_ids = set()
 
     batch_size = 50
     for start_idx in tqdm(
@@ -247,9 +282,16 @@ def process_rows(
 
         video_ids = [extract_video_id(link) for link in batch_links["video_link"]]
         valid_video_ids = [vid for vid in video_ids if vid]
+        unique_video_ids.update(valid_video_ids)
 
         # Fetch metadata for the batch of video IDs
-        batch_metadata = fetch_video_metadata(valid_video_ids, youtube_api_key, cache)
+        with span("enrich_fetch"):
+            batch_metadata = fetch_video_metadata(
+                valid_video_ids, youtube_api_key, cache, metrics=metrics
+            )
+        # Publish after every batch so /metrics and the status stream move live
+        metrics.set_progress(already_processed + end_idx, total_rows)
+        metrics.save()
 
         for idx, video_id, metadata in zip(
             batch_links.index, video_ids, batch_metadata
@@ -260,6 +302,7 @@ def process_rows(
                 errors.append((idx, metadata))
                 channel_names.append((idx, None))
                 channel_links.append((idx, None))
+                channel_ids.append((idx, None))
                 video_names.append((idx, None))
                 continue
 
@@ -267,6 +310,7 @@ def process_rows(
                 errors.append((idx, metadata))
                 channel_names.append((idx, None))
                 channel_links.append((idx, None))
+                channel_ids.append((idx, None))
                 video_names.append((idx, None))
             else:
                 errors.append((idx, None))
@@ -285,9 +329,11 @@ def process_rows(
                 # Extract channel name and link
                 channel_name = None
                 channel_link = None
+                channel_id = None
                 if metadata and "snippet" in metadata:
                     channel_name = metadata["snippet"].get("channelTitle")
-                    channel_link = f"https://www.youtube.com/channel/{metadata['snippet'].get('channelId')}"
+                    channel_id = metadata["snippet"].get("channelId")
+                    channel_link = f"https://www.youtube.com/channel/{channel_id}"
 
                 # Extract video name
                 video_name = None
@@ -298,6 +344,7 @@ def process_rows(
                 categories.append((idx, category_id))
                 channel_names.append((idx, channel_name))
                 channel_links.append((idx, channel_link))
+                channel_ids.append((idx, channel_id))
                 video_names.append((idx, video_name))
 
     if len(cache) > previous_cache_len:
@@ -305,7 +352,9 @@ def process_rows(
         previous_cache_len = len(cache)
 
     region_cache = app_data_dir / "cache" / "youtube_category_region.json"
-    mapping = fetch_and_save_youtube_category_mapping(youtube_api_key, region_cache)
+    mapping = fetch_and_save_youtube_category_mapping(
+        youtube_api_key, region_cache, metrics=metrics
+    )
 
     # Create or reset the columns
     links_to_process.loc[:, "duration_seconds"] = None
@@ -327,6 +376,9 @@ def process_rows(
     for idx, channel_link in channel_links:
         links_to_process.at[idx, "channel_link"] = channel_link
 
+    for idx, channel_id in channel_ids:
+        links_to_process.at[idx, "channel_id"] = channel_id
+
     for idx, video_name in video_names:
         links_to_process.at[idx, "video_name"] = video_name
 
@@ -336,6 +388,9 @@ def process_rows(
 
     # Load the enriched data
     proccessed_rows = len(links_to_process)
+    new_rows = links_to_process
+    new_rows_summary = summarize_enriched_rows(new_rows)
+    previous_signature = file_signature(enriched_data_path)
     if os.path.exists(enriched_data_path):
         enriched_df = pd.read_csv(enriched_data_path)
         print("current length of enriched_df", len(enriched_df))
@@ -356,6 +411,44 @@ def process_rows(
         client, "watch-history-enriched-csv", syft_uri, private_path, schema_name
     )
 
-    links_to_process.to_csv(enriched_data_path, index=False)
+    with span("enrich_write"):
+        links_to_process.to_csv(enriched_data_path, index=False)
+        record_enriched(
+            app_data_dir / "data", enriched_data_path, new_rows_summary, previous_signature
+        )
+    try:
+        with span("aggregate_update"):
+            update_wrapped_aggregates(
+                app_data_dir / "data", app_data_dir / "cache", new_rows, previous_signature
+            )
+    except Exception as e:
+        print(f"Error updating wrapped aggregates: {e}")
+    try:
+        with span("event_store_update"):
+            update_event_store(
+                app_data_dir / "data", app_data_dir / "cache", new_rows, previous_signature
+            )
+    except Exception as e:
+        print(f"Error updating event store: {e}")
+    try:
+        with span("cube_update"):
+            update_cube(
+                app_data_dir / "data", app_data_dir / "cache", new_rows, previous_signature
+            )
+    except Exception as e:
+        print(f"Error updating rollup cube: {e}")
+    try:
+        with span("history_index_update"):
+            update_history_index(
+                app_data_dir / "data", app_data_dir / "cache", new_rows, previous_signature
+            )
+    except Exception as e:
+        print(f"Error updating history index: {e}")
+
+    metrics.record_run(
+        proccessed_rows, len(unique_video_ids), time.perf_counter() - run_start
+    )
+    metrics.set_progress(len(links_to_process), total_rows)
+    metrics.save()
 
     print(f"✅ Enriched {proccessed_rows} rows. Updated file {enriched_data_path}")
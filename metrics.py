@@ -0,0 +1,404 @@
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+from profiling import profiled
+
+# Upper bounds (seconds) for the API request latency histogram
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# Upper bounds (seconds) for request and pipeline stage timings
+TIMING_BUCKETS = (
+    0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 120.0
+)
+
+
+class Histogram:
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        else:
+            self.counts[-1] += 1
+        self.sum += value
+        self.count += 1
+
+    def to_dict(self) -> dict:
+        return {
+            "buckets": list(self.buckets),
+            "counts": list(self.counts),
+            "sum": self.sum,
+            "count": self.count,
+        }
+
+    def quantile(self, q: float) -> float | None:
+        """
+        Upper bound of the bucket holding the q-th quantile, None if there
+        are no observations or it is past the last bucket.
+        """
+        if not self.count:
+            return None
+        rank = q * self.count
+        cumulative = 0
+        for bound, count in zip(self.buckets, self.counts):
+            cumulative += count
+            if cumulative >= rank:
+                return bound
+        return None
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "Histogram":
+        histogram = cls(data.get("buckets", LATENCY_BUCKETS))
+        counts = data.get("counts", [])
+        if len(counts) == len(histogram.counts):
+            histogram.counts = [int(c) for c in counts]
+        histogram.sum = float(data.get("sum", 0.0))
+        histogram.count = int(data.get("count", 0))
+        return histogram
+
+
+class PipelineMetrics:
+    """
+    Live counters for the enrichment pipeline.
+
+    Kept in memory for the lifetime of the process and snapshotted to
+    cache/pipeline-metrics.json so the numbers survive restarts.
+    """
+
+    COUNTERS = (
+        "rows_processed",
+        "unique_ids_processed",
+        "api_requests",
+        "api_errors",
+        "api_retries",
+        "quota_units",
+        "cache_hits",
+        "cache_misses",
+        "cache_negative_hits",
+    )
+
+    def __init__(self, snapshot_path: Path):
+        self.snapshot_path = Path(snapshot_path)
+        self._lock = threading.Lock()
+        # Serializes snapshot writes from the background job and requests
+        self._save_lock = threading.Lock()
+        self.counters = {name: 0 for name in self.COUNTERS}
+        self.enrich_seconds = 0.0
+        self.api_latency = Histogram()
+        self.last_run = {}
+        self.total_rows = 0
+        self.processed_rows = 0
+        self._listeners = []
+        self.load()
+
+    def load(self):
+        """Restores counters from the last snapshot, if there is one."""
+        if not self.snapshot_path.exists():
+            return
+        try:
+            with self.snapshot_path.open("r", encoding="utf-8") as f:
+                data = json.load(f)
+        except Exception as e:
+            print(f"Error loading pipeline metrics: {e}")
+            return
+        for name in self.COUNTERS:
+            self.counters[name] = int(data.get("counters", {}).get(name, 0))
+        self.enrich_seconds = float(data.get("enrich_seconds", 0.0))
+        self.api_latency = Histogram.from_dict(data.get("api_latency", {}))
+        self.last_run = data.get("last_run", {})
+        self.total_rows = int(data.get("total_rows", 0))
+        self.processed_rows = int(data.get("processed_rows", 0))
+
+    def save(self):
+        """Writes a snapshot atomically next to the other cache files."""
+        with self._save_lock:
+            snapshot = self.snapshot()
+            tmp_path = self.snapshot_path.with_suffix(".json.tmp")
+            with tmp_path.open("w", encoding="utf-8") as f:
+                json.dump(snapshot, f)
+            os.replace(tmp_path, self.snapshot_path)
+
+        with self._lock:
+            listeners = list(self._listeners)
+        for listener in listeners:
+            try:
+                listener(snapshot)
+            except Exception as e:
+                print(f"Error in metrics listener: {e}")
+
+    def subscribe(self, listener):
+        """
+        Registers listener(snapshot) to be called after each save.
+        Returns a function that removes the listener again.
+        """
+        with self._lock:
+            self._listeners.append(listener)
+
+        def unsubscribe():
+            with self._lock:
+                if listener in self._listeners:
+                    self._listeners.remove(listener)
+
+        return unsubscribe
+
+    def record_cache_lookup(self, hit: bool, negative: bool = False):
+        with self._lock:
+            if negative:
+                self.counters["cache_negative_hits"] += 1
+            elif hit:
+                self.counters["cache_hits"] += 1
+            else:
+                self.counters["cache_misses"] += 1
+
+    def record_api_request(self, seconds: float, ok: bool = True, quota_units: int = 1):
+        with self._lock:
+            self.counters["api_requests"] += 1
+            self.counters["quota_units"] += quota_units
+            if not ok:
+                self.counters["api_errors"] += 1
+            self.api_latency.observe(seconds)
+
+    def record_retry(self):
+        with self._lock:
+            self.counters["api_retries"] += 1
+
+    def record_run(self, rows: int, unique_ids: int, seconds: float):
+        """Records one process_rows run over `rows` rows."""
+        with self._lock:
+            self.counters["rows_processed"] += rows
+            self.counters["unique_ids_processed"] += unique_ids
+            self.enrich_seconds += seconds
+            self.last_run = {
+                "rows": rows,
+                "unique_ids": unique_ids,
+                "seconds": round(seconds, 3),
+                "finished_at": time.time(),
+            }
+
+    def set_progress(self, processed_rows: int, total_rows: int):
+        with self._lock:
+            self.processed_rows = int(processed_rows)
+            self.total_rows = int(total_rows)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            counters = dict(self.counters)
+            enrich_seconds = self.enrich_seconds
+            last_run = dict(self.last_run)
+            api_latency = self.api_latency.to_dict()
+            processed_rows = self.processed_rows
+            total_rows = self.total_rows
+
+        def ratio(n, d):
+            return round(n / d, 4) if d else 0.0
+
+        lookups = (
+            counters["cache_hits"]
+            + counters["cache_misses"]
+            + counters["cache_negative_hits"]
+        )
+        rows_per_second = ratio(counters["rows_processed"], enrich_seconds)
+        last_rows_per_second = ratio(last_run.get("rows", 0), last_run.get("seconds", 0))
+        remaining_rows = max(total_rows - processed_rows, 0)
+        eta_rate = last_rows_per_second or rows_per_second
+        eta_seconds = round(remaining_rows / eta_rate, 1) if eta_rate else None
+
+        return {
+            "counters": counters,
+            "enrich_seconds": round(enrich_seconds, 3),
+            "rows_per_second": rows_per_second,
+            "unique_ids_per_second": ratio(
+                counters["unique_ids_processed"], enrich_seconds
+            ),
+            "last_run": last_run,
+            "last_run_rows_per_second": last_rows_per_second,
+            "cache_hit_ratio": ratio(counters["cache_hits"], lookups),
+            "cache_miss_ratio": ratio(counters["cache_misses"], lookups),
+            "cache_negative_hit_ratio": ratio(counters["cache_negative_hits"], lookups),
+            "api_latency": api_latency,
+            "api_latency_avg_seconds": ratio(api_latency["sum"], api_latency["count"]),
+            "total_rows": total_rows,
+            "processed_rows": processed_rows,
+            "remaining_rows": remaining_rows,
+            "eta_seconds": eta_seconds,
+        }
+
+    def to_prometheus(self) -> str:
+        """Renders the current metrics in the Prometheus text exposition format."""
+        snapshot = self.snapshot()
+        prefix = "youtube_wrapped_enrichment"
+        lines = []
+
+        for name, value in snapshot["counters"].items():
+            lines.append(f"# TYPE {prefix}_{name}_total counter")
+            lines.append(f"{prefix}_{name}_total {value}")
+
+        gauges = {
+            "seconds": snapshot["enrich_seconds"],
+            "rows_per_second": snapshot["rows_per_second"],
+            "unique_ids_per_second": snapshot["unique_ids_per_second"],
+            "cache_hit_ratio": snapshot["cache_hit_ratio"],
+            "cache_negative_hit_ratio": snapshot["cache_negative_hit_ratio"],
+            "total_rows": snapshot["total_rows"],
+            "processed_rows": snapshot["processed_rows"],
+            "remaining_rows": snapshot["remaining_rows"],
+        }
+        if snapshot["eta_seconds"] is not None:
+            gauges["eta_seconds"] = snapshot["eta_seconds"]
+        for name, value in gauges.items():
+            lines.append(f"# TYPE {prefix}_{name} gauge")
+            lines.append(f"{prefix}_{name} {value}")
+
+        lines.extend(
+            histogram_lines(f"{prefix}_api_request_seconds", snapshot["api_latency"])
+        )
+        return "\n".join(lines) + "\n"
+
+
+def histogram_lines(
+    name: str, histogram: dict, labels: str = "", include_type: bool = True
+) -> list:
+    """
+    Formats a Histogram.to_dict() payload as Prometheus histogram lines.
+    Pass include_type=False for every label set after the first of a metric.
+    """
+    lines = [f"# TYPE {name} histogram"] if include_type else []
+    label_prefix = f"{labels}," if labels else ""
+    cumulative = 0
+    for bound, count in zip(histogram["buckets"], histogram["counts"]):
+        cumulative += count
+        lines.append(f'{name}_bucket{{{label_prefix}le="{bound}"}} {cumulative}')
+    cumulative += histogram["counts"][-1]
+    lines.append(f'{name}_bucket{{{label_prefix}le="+Inf"}} {cumulative}')
+    label_block = f"{{{labels}}}" if labels else ""
+    lines.append(f"{name}_sum{label_block} {histogram['sum']}")
+    lines.append(f"{name}_count{label_block} {histogram['count']}")
+    return lines
+
+
+class LatencyMetrics:
+    """
+    In-process timings of HTTP requests (per method and route) and of
+    pipeline stages (per span name). Not persisted, they describe this run.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = {}
+        self.statuses = {}
+        self.stages = {}
+
+    def observe_request(self, method: str, route: str, status: int, seconds: float):
+        key = (method, route)
+        with self._lock:
+            if key not in self.requests:
+                self.requests[key] = Histogram(TIMING_BUCKETS)
+            self.requests[key].observe(seconds)
+            status_key = (method, route, str(status))
+            self.statuses[status_key] = self.statuses.get(status_key, 0) + 1
+
+    def observe_stage(self, stage: str, seconds: float):
+        with self._lock:
+            if stage not in self.stages:
+                self.stages[stage] = Histogram(TIMING_BUCKETS)
+            self.stages[stage].observe(seconds)
+
+    def summary(self) -> dict:
+        """Count, mean and approximate p50/p95/p99 seconds per route and stage."""
+
+        def describe(histogram: Histogram) -> dict:
+            return {
+                "count": histogram.count,
+                "avg_seconds": round(histogram.sum / histogram.count, 6)
+                if histogram.count
+                else 0.0,
+                "p50_seconds": histogram.quantile(0.5),
+                "p95_seconds": histogram.quantile(0.95),
+                "p99_seconds": histogram.quantile(0.99),
+            }
+
+        with self._lock:
+            return {
+                "requests": {
+                    f"{method} {route}": describe(histogram)
+                    for (method, route), histogram in sorted(self.requests.items())
+                },
+                "stages": {
+                    stage: describe(histogram)
+                    for stage, histogram in sorted(self.stages.items())
+                },
+            }
+
+    def to_prometheus(self) -> str:
+        prefix = "youtube_wrapped"
+        with self._lock:
+            requests = {key: h.to_dict() for key, h in sorted(self.requests.items())}
+            statuses = dict(sorted(self.statuses.items()))
+            stages = {key: h.to_dict() for key, h in sorted(self.stages.items())}
+
+        lines = [f"# TYPE {prefix}_http_requests_total counter"]
+        for (method, route, status), count in statuses.items():
+            lines.append(
+                f'{prefix}_http_requests_total{{method="{method}",route="{route}",'
+                f'status="{status}"}} {count}'
+            )
+        for i, ((method, route), histogram) in enumerate(requests.items()):
+            lines.extend(
+                histogram_lines(
+                    f"{prefix}_http_request_seconds",
+                    histogram,
+                    f'method="{method}",route="{route}"',
+                    include_type=i == 0,
+                )
+            )
+        for i, (stage, histogram) in enumerate(stages.items()):
+            lines.extend(
+                histogram_lines(
+                    f"{prefix}_stage_seconds",
+                    histogram,
+                    f'stage="{stage}"',
+                    include_type=i == 0,
+                )
+            )
+        return "\n".join(lines) + "\n"
+
+
+latency_metrics = LatencyMetrics()
+
+
+@contextmanager
+def span(stage: str):
+    """
+    Times the enclosed block into the stage histogram, even if it raises,
+    and profiles it when the stage is armed for profiling.
+    """
+    start = time.perf_counter()
+    try:
+        with profiled(stage):
+            yield
+    finally:
+        latency_metrics.observe_stage(stage, time.perf_counter() - start)
+
+
+_metrics_instances = {}
+_metrics_lock = threading.Lock()
+
+
+def get_pipeline_metrics(app_data_dir) -> PipelineMetrics:
+    """Returns the process-wide metrics instance for an app data dir."""
+    snapshot_path = Path(app_data_dir) / "cache" / "pipeline-metrics.json"
+    key = str(snapshot_path.resolve())
+    with _metrics_lock:
+        if key not in _metrics_instances:
+            _metrics_instances[key] = PipelineMetrics(snapshot_path)
+        return _metrics_instances[key]
@@ -0,0 +1,74 @@
+import hashlib
+import json
+import threading
+import time
+from email.utils import formatdate, parsedate_to_datetime
+
+from fastapi import Request
+from fastapi.responses import HTMLResponse, Response
+
+
+class RenderedPage:
+    def __init__(self, html: str, etag: str, last_modified: float):
+        self.html = html
+        self.etag = etag
+        self.last_modified = last_modified
+
+
+def make_etag(version: dict) -> str:
+    """A strong ETag for everything a page was rendered from."""
+    encoded = json.dumps(version, sort_keys=True, default=str).encode("utf-8")
+    return '"' + hashlib.sha256(encoded).hexdigest()[:32] + '"'
+
+
+class PageCache:
+    """
+    Keeps the last rendered HTML of each page with the ETag of the data
+    version it was rendered from.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pages = {}
+
+    def get(self, name: str, etag: str) -> RenderedPage | None:
+        with self._lock:
+            page = self._pages.get(name)
+        if page is not None and page.etag == etag:
+            return page
+        return None
+
+    def put(self, name: str, etag: str, html: str) -> RenderedPage:
+        page = RenderedPage(html, etag, time.time())
+        with self._lock:
+            self._pages[name] = page
+        return page
+
+
+def is_not_modified(request: Request, page: RenderedPage) -> bool:
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        etags = [etag.strip().removeprefix("W/") for etag in if_none_match.split(",")]
+        return page.etag in etags or "*" in etags
+
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since is not None:
+        try:
+            since = parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            return False
+        # HTTP dates have whole second precision
+        return int(page.last_modified) <= since
+    return False
+
+
+def cached_html_response(request: Request, page: RenderedPage) -> Response:
+    """Returns the page, or an empty 304 if the client already has it."""
+    headers = {
+        "ETag": page.etag,
+        "Last-Modified": formatdate(page.last_modified, usegmt=True),
+        "Cache-Control": "no-cache",
+    }
+    if is_not_modified(request, page):
+        return Response(status_code=304, headers=headers)
+    return HTMLResponse(page.html, headers=headers)
@@ -0,0 +1,280 @@
+import json
+import os
+import re
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from contextlib import contextmanager
+from pathlib import Path
+
+# Comma separated request paths (e.g. /summarize) and span names (e.g.
+# aggregate_rebuild) to profile every time they run, or "all"
+PROFILE_TARGETS = os.environ.get("YOUTUBE_WRAPPED_PROFILE", "")
+
+SAMPLE_INTERVAL_SECONDS = (
+    float(os.environ.get("YOUTUBE_WRAPPED_PROFILE_INTERVAL_MS", 5)) / 1000
+)
+
+PROFILES_DIR = "profiles"
+TOP_ENTRIES = 30
+
+# Leaf frames of threads that are waiting for work, not doing any
+IDLE_FRAMES = {
+    ("threading.py", "wait"),
+    ("queue.py", "get"),
+    ("selectors.py", "select"),
+    ("thread.py", "_worker"),
+}
+
+_lock = threading.Lock()
+# target -> captures left, None for unlimited
+_armed = {}
+_active = False
+_profiles_dir = None
+
+
+def _frame_name(frame) -> str:
+    code = frame.f_code
+    return f"{os.path.basename(code.co_filename)}:{code.co_name}"
+
+
+class SamplingProfiler:
+    """
+    Samples the Python stacks of every thread at a fixed interval and
+    counts them as folded stacks (flamegraph.pl / speedscope format).
+    Work offloaded to the executor pools is caught too, and so is anything
+    else running at the same time.
+    """
+
+    def __init__(self, interval: float = SAMPLE_INTERVAL_SECONDS):
+        self.interval = interval
+        self.stacks = Counter()
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="profiler", daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        own_id = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                code = frame.f_code
+                if (os.path.basename(code.co_filename), code.co_name) in IDLE_FRAMES:
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append(_frame_name(frame))
+                    frame = frame.f_back
+                stack.append(names.get(thread_id, str(thread_id)))
+                self.stacks[";".join(reversed(stack))] += 1
+            self.samples += 1
+
+    def top_functions(self) -> dict:
+        """Functions by samples spent in them (self) and under them (total)."""
+        own = Counter()
+        total = Counter()
+        for stack, count in self.stacks.items():
+            frames = stack.split(";")[1:]
+            own[frames[-1]] += count
+            for name in set(frames):
+                total[name] += count
+        samples = sum(self.stacks.values()) or 1
+
+        def rows(counter):
+            return [
+                {"function": name, "samples": count, "percent": round(100 * count / samples, 1)}
+                for name, count in counter.most_common(TOP_ENTRIES)
+            ]
+
+        return {"self": rows(own), "total": rows(total)}
+
+    def folded(self) -> str:
+        return "".join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+
+class MemoryProfiler:
+    """Peak traced memory and the lines that allocated most while running."""
+
+    def start(self):
+        self._started_tracing = not tracemalloc.is_tracing()
+        if self._started_tracing:
+            tracemalloc.start(10)
+        tracemalloc.reset_peak()
+        self._before = tracemalloc.take_snapshot()
+
+    def stop(self) -> dict:
+        after = tracemalloc.take_snapshot()
+        current, peak = tracemalloc.get_traced_memory()
+        if self._started_tracing:
+            tracemalloc.stop()
+        ignored = [
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, __file__),
+        ]
+        differences = after.filter_traces(ignored).compare_to(
+            self._before.filter_traces(ignored), "lineno"
+        )
+        return {
+            "current_bytes": current,
+            "peak_bytes": peak,
+            "top_allocations": [
+                {
+                    "location": f"{diff.traceback[0].filename}:{diff.traceback[0].lineno}",
+                    "size_diff_bytes": diff.size_diff,
+                    "count_diff": diff.count_diff,
+                }
+                for diff in differences[:TOP_ENTRIES]
+            ],
+        }
+
+
+def configure_profiling(cache_dir):
+    """Stores profiles under cache_dir and arms the targets from the env var."""
+    global _profiles_dir
+    _profiles_dir = Path(cache_dir) / PROFILES_DIR
+    _profiles_dir.mkdir(parents=True, exist_ok=True)
+    targets = [target.strip() for target in PROFILE_TARGETS.split(",") if target.strip()]
+    if targets:
+        arm(targets)
+
+
+def arm(targets, count: int | None = None):
+    """Profiles the next `count` runs of each target (every run if None)."""
+    with _lock:
+        for target in targets:
+            _armed[target] = count
+
+
+def disarm():
+    with _lock:
+        _armed.clear()
+
+
+def armed_targets() -> dict:
+    with _lock:
+        return dict(_armed)
+
+
+def _claim(target: str) -> bool:
+    global _active
+    # Unlocked fast path, so nothing is paid while profiling is off
+    if not _armed:
+        return False
+    with _lock:
+        key = target if target in _armed else "all" if "all" in _armed else None
+        # One capture at a time, it samples every thread anyway
+        if key is None or _active:
+            return False
+        remaining = _armed[key]
+        if remaining is not None:
+            if remaining <= 1:
+                del _armed[key]
+            else:
+                _armed[key] = remaining - 1
+        _active = True
+        return True
+
+
+def _release():
+    global _active
+    with _lock:
+        _active = False
+
+
+def _save_profile(target: str, profile: dict, folded: str) -> str | None:
+    if _profiles_dir is None:
+        print(f"Profiling not configured, dropping profile of {target}")
+        return None
+    slug = re.sub(r"[^A-Za-z0-9_.-]+", "_", target).strip("_") or "root"
+    name = f"{time.strftime('%Y%m%d-%H%M%S')}-{int(time.time() * 1000) % 1000:03d}-{slug}"
+    with (_profiles_dir / f"{name}.folded").open("w", encoding="utf-8") as f:
+        f.write(folded)
+    tmp_path = _profiles_dir / f"{name}.json.tmp"
+    with tmp_path.open("w", encoding="utf-8") as f:
+        json.dump(profile, f, indent=2)
+    os.replace(tmp_path, _profiles_dir / f"{name}.json")
+    return name
+
+
+@contextmanager
+def profiled(target: str):
+    """
+    Captures a CPU and memory profile of the enclosed block if `target` is
+    armed. Otherwise it only costs a dict check.
+    """
+    if not _claim(target):
+        yield
+        return
+
+    cpu = SamplingProfiler()
+    memory = MemoryProfiler()
+    started_at = time.time()
+    start = time.perf_counter()
+    memory.start()
+    cpu.start()
+    try:
+        yield
+    finally:
+        cpu.stop()
+        seconds = time.perf_counter() - start
+        try:
+            profile = {
+                "target": target,
+                "started_at": started_at,
+                "seconds": round(seconds, 4),
+                "interval_seconds": cpu.interval,
+                "samples": cpu.samples,
+                "cpu": cpu.top_functions(),
+                "memory": memory.stop(),
+            }
+            name = _save_profile(target, profile, cpu.folded())
+            if name is not None:
+                print(f"Saved profile {name} of {target} ({seconds:.3f}s)")
+        except Exception as e:
+            print(f"Error saving profile of {target}: {e}")
+        finally:
+            _release()
+
+
+def list_profiles() -> list:
+    """Saved profiles, newest first."""
+    if _profiles_dir is None or not _profiles_dir.exists():
+        return []
+    profiles = []
+    for path in sorted(_profiles_dir.glob("*.json"), reverse=True):
+        try:
+            with path.open("r", encoding="utf-8") as f:
+                profile = json.load(f)
+        except Exception as e:
+            print(f"Error reading profile {path.name}: {e}")
+            continue
+        profiles.append(
+            {
+                "name": path.stem,
+                "target": profile["target"],
+                "started_at": profile["started_at"],
+                "seconds": profile["seconds"],
+                "samples": profile["samples"],
+                "peak_bytes": profile["memory"]["peak_bytes"],
+            }
+        )
+    return profiles
+
+
+def get_profile_path(name: str, suffix: str = ".json") -> Path | None:
+    """Path of a saved profile file, None if there is no such profile."""
+    if _profiles_dir is None or not re.fullmatch(r"[A-Za-z0-9_.-]+", name):
+        return None
+    path = _profiles_dir / f"{name}{suffix}"
+    return path if path.exists() else None
@@ -0,0 +1,141 @@
+import asyncio
+import json
+import os
+import threading
+from pathlib import Path
+
+from executors import get_pool, run_blocking
+from metrics import get_pipeline_metrics
+from state_store import get_state_store
+from utils import YoutubeDataPipelineState
+
+# Idle streams send a comment this often so proxies don't drop them
+HEARTBEAT_SECONDS = float(os.environ.get("YOUTUBE_WRAPPED_SSE_HEARTBEAT_SECONDS", 15))
+
+_events_lock = threading.Lock()
+_events = {}
+
+
+def get_processing_status(app_data_dir) -> dict:
+    """The enrichment progress shown on the home page."""
+    pipeline_state = YoutubeDataPipelineState(app_data_dir)
+
+    total_rows = pipeline_state.get_total_rows()
+    processed_rows = pipeline_state.get_processed_rows()
+
+    return {
+        "is_processing": bool(pipeline_state.is_processing()),
+        "total_rows": int(total_rows),
+        "processed_rows": int(processed_rows),
+        "enriched_rows": int(pipeline_state.get_enriched_rows()),
+        "missing_rows": int(pipeline_state.get_missing_rows()),
+        "is_complete": bool(processed_rows == total_rows),
+        "metrics": get_pipeline_metrics(app_data_dir).snapshot(),
+    }
+
+
+class _Subscriber:
+    """One open stream. Only the latest status is kept, so bursts coalesce."""
+
+    def __init__(self, loop):
+        self.loop = loop
+        self.ready = asyncio.Event()
+        self.status = None
+
+    def _set(self, status):
+        self.status = status
+        self.ready.set()
+
+    def push(self, status):
+        # Called from whichever thread changed the state
+        try:
+            self.loop.call_soon_threadsafe(self._set, status)
+        except RuntimeError:
+            # The loop has shut down
+            pass
+
+
+class ProcessingEvents:
+    """
+    Pushes processing status to open event streams whenever the pipeline
+    state or metrics change. Nothing is computed while no one is listening.
+    """
+
+    def __init__(self, app_data_dir):
+        self.app_data_dir = Path(app_data_dir)
+        self._lock = threading.Lock()
+        self._subscribers = set()
+        self._last_status = None
+        self._dirty = False
+        self._publishing = False
+        get_state_store(self.app_data_dir).subscribe(self._on_change)
+        get_pipeline_metrics(self.app_data_dir).subscribe(self._on_change)
+
+    def _on_change(self, *args):
+        # Called from whichever thread changed the state, which can be the
+        # event loop, so the status is computed on the io pool. Changes made
+        # while it runs are coalesced into one more pass.
+        with self._lock:
+            if not self._subscribers:
+                return
+            self._dirty = True
+            if self._publishing:
+                return
+            self._publishing = True
+        try:
+            get_pool("io").submit(self._publish)
+        except RuntimeError:
+            # The pool has shut down
+            with self._lock:
+                self._publishing = False
+
+    def _publish(self):
+        while True:
+            with self._lock:
+                if not self._dirty or not self._subscribers:
+                    self._publishing = False
+                    return
+                self._dirty = False
+            try:
+                status = get_processing_status(self.app_data_dir)
+            except Exception as e:
+                print(f"Error computing processing status: {e}")
+                continue
+            with self._lock:
+                if status == self._last_status:
+                    continue
+                self._last_status = status
+                subscribers = list(self._subscribers)
+            for subscriber in subscribers:
+                subscriber.push(status)
+
+    async def stream(self):
+        """Yields server-sent event chunks until the client disconnects."""
+        subscriber = _Subscriber(asyncio.get_running_loop())
+        with self._lock:
+            self._subscribers.add(subscriber)
+        try:
+            status = await run_blocking(
+                "status", get_processing_status, self.app_data_dir, pool="io"
+            )
+            yield f"data: {json.dumps(status)}\n\n"
+            while True:
+                try:
+                    await asyncio.wait_for(subscriber.ready.wait(), HEARTBEAT_SECONDS)
+                except asyncio.TimeoutError:
+                    yield ": keep-alive\n\n"
+                    continue
+                subscriber.ready.clear()
+                yield f"data: {json.dumps(subscriber.status)}\n\n"
+        finally:
+            with self._lock:
+                self._subscribers.discard(subscriber)
+
+
+def get_processing_events(app_data_dir) -> ProcessingEvents:
+    """Returns the process-wide broadcaster for an app data dir."""
+    key = str(Path(app_data_dir).resolve())
+    with _events_lock:
+        if key not in _events:
+            _events[key] = ProcessingEvents(app_data_dir)
+        return _events[key]
@@ -0,0 +1,251 @@
+import json
+import os
+import threading
+import time
+from pathlib import Path
+
+PUBLISHED_INDEX_FILE = "published-index.json"
+PUBLISHED_SUBDIR = Path("public") / "youtube-wrapped"
+
+# How often datasites are re-checked, to find newly published directories
+# and as the fallback when there's no watcher
+POLL_INTERVAL_SECONDS = float(os.environ.get("YOUTUBE_WRAPPED_INDEX_POLL_SECONDS", 30))
+
+# Each published directory takes one inotify watch. Past this many the
+# watcher is dropped in favour of polling, so the system limit isn't hit.
+MAX_WATCHES = int(os.environ.get("YOUTUBE_WRAPPED_INDEX_MAX_WATCHES", 1000))
+
+_index_lock = threading.Lock()
+_indexes = {}
+
+
+def _dir_signature(path: Path):
+    try:
+        return path.stat().st_mtime_ns
+    except FileNotFoundError:
+        return None
+
+
+class PublishedIndex:
+    """
+    In-memory index of the youtube-wrapped html pages every synced datasite
+    publishes, persisted per datasite in the cache dir.
+
+    A datasite is only re-listed when the mtime of its youtube-wrapped
+    directory changes (a file was added, removed or renamed), either when a
+    filesystem watcher reports it or when polling notices. Only the
+    datasites root and each published directory are watched, not the
+    whole tree.
+    """
+
+    def __init__(self, datasites_path, cache_dir):
+        self.datasites_path = Path(datasites_path)
+        self.index_path = Path(cache_dir) / PUBLISHED_INDEX_FILE
+        self._lock = threading.Lock()
+        self._datasites = self._load()
+        self.version = 0
+        self._observer = None
+        self._handler = None
+        self._watches = {}
+        self._watch_lock = threading.Lock()
+        self._watches_stale = threading.Event()
+        self._poller = None
+
+    def _load(self) -> dict:
+        if self.index_path.exists():
+            try:
+                with self.index_path.open("r", encoding="utf-8") as f:
+                    return json.load(f).get("datasites", {})
+            except Exception as e:
+                print(f"Error loading published index: {e}")
+        return {}
+
+    def _save(self):
+        tmp_path = self.index_path.with_suffix(".json.tmp")
+        with tmp_path.open("w", encoding="utf-8") as f:
+            json.dump({"datasites": self._datasites}, f)
+        os.replace(tmp_path, self.index_path)
+
+    def _list_datasite(self, email: str) -> dict:
+        published_dir = self.datasites_path / email / PUBLISHED_SUBDIR
+        signature = _dir_signature(published_dir)
+        files = []
+        if signature is not None:
+            files = sorted(
+                entry.name
+                for entry in os.scandir(published_dir)
+                if entry.name.endswith(".html") and entry.is_file()
+            )
+        return {"signature": signature, "files": files}
+
+    def refresh_datasite(self, email: str, force: bool = False) -> bool:
+        """
+        Re-lists one datasite if it changed, or unconditionally with force.
+        Returns True if its pages changed.
+        """
+        published_dir = self.datasites_path / email / PUBLISHED_SUBDIR
+        entry = self._datasites.get(email)
+        if (
+            not force
+            and entry is not None
+            and entry["signature"] == _dir_signature(published_dir)
+        ):
+            return False
+        listed = self._list_datasite(email)
+        with self._lock:
+            if self._datasites.get(email) == listed:
+                return False
+            self._datasites[email] = listed
+            self.version += 1
+            self._save()
+        return True
+
+    def refresh(self) -> bool:
+        """Checks every datasite for changes and drops ones that went away."""
+        changed = False
+        try:
+            emails = [entry.name for entry in os.scandir(self.datasites_path) if entry.is_dir()]
+        except FileNotFoundError:
+            emails = []
+        for email in emails:
+            changed |= self.refresh_datasite(email)
+        with self._lock:
+            removed = set(self._datasites) - set(emails)
+            for email in removed:
+                del self._datasites[email]
+            if removed:
+                self.version += 1
+                self._save()
+        self._sync_watches()
+        return changed or bool(removed)
+
+    def lookup(self, syftbox_domain: str) -> dict:
+        """Published page URLs by datasite email, like the old glob returned."""
+        with self._lock:
+            return {
+                email: [
+                    f"{syftbox_domain}/datasites/{email}/{PUBLISHED_SUBDIR.as_posix()}/{name}"
+                    for name in entry["files"]
+                ]
+                for email, entry in sorted(self._datasites.items())
+                if entry["files"]
+            }
+
+    def start(self):
+        """
+        Starts watching the datasites with an inotify watcher if possible,
+        plus polling to pick up newly published directories.
+        """
+        try:
+            self._start_watcher()
+        except Exception as e:
+            print(f"Filesystem watcher unavailable ({e}), polling published pages")
+        self._poller = threading.Thread(target=self._poll, daemon=True)
+        self._poller.start()
+
+    def _start_watcher(self):
+        from watchdog.events import FileSystemEventHandler
+        from watchdog.observers import Observer
+
+        index = self
+
+        class PublishedPageHandler(FileSystemEventHandler):
+            def on_any_event(self, event):
+                if event.event_type in ("opened", "closed", "closed_no_write"):
+                    return
+                for path in (event.src_path, getattr(event, "dest_path", "")):
+                    email = index._email_for(path)
+                    if email is not None and index.refresh_datasite(email):
+                        # Watches are changed from the poller thread, since
+                        # the observer holds its lock while this runs
+                        index._watches_stale.set()
+
+        observer = Observer()
+        observer.daemon = True
+        self._handler = PublishedPageHandler()
+        # Only direct children, so new and removed datasites are noticed
+        observer.schedule(self._handler, str(self.datasites_path), recursive=False)
+        observer.start()
+        self._observer = observer
+        self._sync_watches()
+
+    def _sync_watches(self):
+        """Watches every published directory, and stops watching gone ones."""
+        with self._watch_lock:
+            if self._observer is None:
+                return
+            with self._lock:
+                emails = [
+                    email
+                    for email, entry in self._datasites.items()
+                    if entry["signature"] is not None
+                ]
+            if len(emails) > MAX_WATCHES:
+                print(
+                    f"{len(emails)} datasites publish youtube-wrapped, more than "
+                    f"{MAX_WATCHES} watches, polling published pages instead"
+                )
+                self._observer.unschedule_all()
+                self._observer.stop()
+                self._observer = None
+                self._watches = {}
+                return
+            for email in set(self._watches) - set(emails):
+                try:
+                    self._observer.unschedule(self._watches.pop(email))
+                except Exception:
+                    # Its directory is already gone
+                    pass
+            for email in set(emails) - set(self._watches):
+                published_dir = self.datasites_path / email / PUBLISHED_SUBDIR
+                try:
+                    self._watches[email] = self._observer.schedule(
+                        self._handler, str(published_dir), recursive=False
+                    )
+                except OSError as e:
+                    print(f"Error watching {published_dir}: {e}")
+
+    def _email_for(self, path) -> str | None:
+        """The datasite a changed path belongs to, if it's under a published dir."""
+        if not path:
+            return None
+        try:
+            parts = Path(os.fsdecode(path)).relative_to(self.datasites_path).parts
+        except ValueError:
+            return None
+        if len(parts) == 1 or (len(parts) >= 3 and Path(*parts[1:3]) == PUBLISHED_SUBDIR):
+            return parts[0]
+        return None
+
+    def _poll(self):
+        # Refreshes straight away, to catch up on changes since the index was
+        # persisted, then every POLL_INTERVAL_SECONDS however often the
+        # watches need syncing in between
+        next_refresh = time.monotonic()
+        while True:
+            if self._watches_stale.wait(max(0.0, next_refresh - time.monotonic())):
+                self._watches_stale.clear()
+                self._sync_watches()
+                if time.monotonic() < next_refresh:
+                    continue
+            try:
+                self.refresh()
+            except Exception as e:
+                print(f"Error refreshing published index: {e}")
+            next_refresh = time.monotonic() + POLL_INTERVAL_SECONDS
+
+
+def get_published_index(datasites_path, cache_dir) -> PublishedIndex:
+    """
+    Returns the process-wide index for datasites_path, starting its watcher
+    the first time it's requested. Until the poller's first refresh catches
+    up, lookups are served from the persisted index.
+    """
+    key = str(datasites_path)
+    with _index_lock:
+        index = _indexes.get(key)
+        if index is None:
+            index = PublishedIndex(datasites_path, cache_dir)
+            index.start()
+            _indexes[key] = index
+        return index
@@ -0,0 +1,320 @@
+import os
+
+import pandas as pd
+
+from aggregates import TEXT_COLUMNS, filter_wrapped_rows, wrapped_tables_from_frame
+
+# pandas, duckdb or polars. duckdb and polars are optional installs.
+#
+# Every backend returns the tables of aggregates.wrapped_tables_from_frame
+# plus an "events" table (year, watch_epoch_ms, duration_seconds,
+# channel_name in file order) for the session stats, and lists the years
+# with wrapped rows in file order so histories over the memory budget can
+# be queried one year at a time.
+QUERY_BACKEND = os.environ.get("YOUTUBE_WRAPPED_QUERY_BACKEND", "pandas")
+
+MAX_DURATION_SECONDS = 4 * 3600
+
+
+class PandasBackend:
+    """Loads the whole csv into a DataFrame, like the default wrapped path."""
+
+    name = "pandas"
+
+    def _load(self, csv_path, years=None) -> pd.DataFrame:
+        df = filter_wrapped_rows(pd.read_csv(csv_path, dtype=TEXT_COLUMNS))
+        if years is not None:
+            df = df[df["year"].isin(list(years))]
+        return df
+
+    def uncanonical_rows(self, csv_path) -> int:
+        # Missing canonical values are derived while loading
+        return 0
+
+    def years(self, csv_path) -> list:
+        return [int(year) for year in pd.unique(self._load(csv_path)["year"])]
+
+    def wrapped_tables(self, csv_path, years=None) -> dict:
+        df = self._load(csv_path, years)
+        tables = wrapped_tables_from_frame(df)
+        tables["events"] = df[["year", "watch_epoch_ms", "duration_seconds", "channel_name"]]
+        return tables
+
+
+class DuckDBBackend:
+    """
+    Runs the wrapped queries in DuckDB straight over the csv, using all
+    cores for the scan and filtering on year while it is read.
+    """
+
+    name = "duckdb"
+
+    def __init__(self):
+        import duckdb
+
+        self.duckdb = duckdb
+
+    @staticmethod
+    def _wrapped_sql(years=None) -> str:
+        year_filter = ""
+        if years is not None:
+            year_filter = "AND CAST(CAST(year AS DOUBLE) AS INTEGER) IN ({})".format(
+                ", ".join(str(int(year)) for year in years)
+            )
+        return f"""
+            SELECT
+                row,
+                CAST(CAST(year AS DOUBLE) AS INTEGER) AS year,
+                TRY_CAST(duration_seconds AS DOUBLE) AS seconds,
+                CAST(CAST(watch_epoch_ms AS DOUBLE) AS BIGINT) AS watch_epoch_ms,
+                CAST(CAST(weekday AS DOUBLE) AS INTEGER) AS weekday,
+                CAST(CAST(hour AS DOUBLE) AS INTEGER) AS hour,
+                local_date,
+                video_name,
+                video_link,
+                channel_name,
+                channel_link,
+                category_name
+            FROM (
+                SELECT row_number() OVER () - 1 AS row, *
+                FROM read_csv(?, header = true, all_varchar = true)
+            )
+            WHERE error IS NULL
+                AND TRY_CAST(duration_seconds AS DOUBLE) <= {MAX_DURATION_SECONDS}
+                AND year IS NOT NULL
+                {year_filter}
+        """
+
+    def _connect(self, csv_path, years=None):
+        connection = self.duckdb.connect()
+        # row numbers below must follow the file order, which parallel scans
+        # only keep with this on (it is the default, but don't rely on it)
+        connection.execute("SET preserve_insertion_order = true")
+        connection.execute(
+            f"CREATE TEMP TABLE wrapped AS {self._wrapped_sql(years)}", [str(csv_path)]
+        )
+        return connection
+
+    def uncanonical_rows(self, csv_path) -> int:
+        return self.duckdb.execute(
+            """
+            SELECT count(*) FROM read_csv(?, header = true, all_varchar = true)
+            WHERE error IS NULL AND year IS NULL AND watch_time IS NOT NULL
+            """,
+            [str(csv_path)],
+        ).fetchone()[0]
+
+    def years(self, csv_path) -> list:
+        connection = self.duckdb.connect()
+        try:
+            connection.execute("SET preserve_insertion_order = true")
+            rows = connection.execute(
+                f"""
+                SELECT year FROM ({self._wrapped_sql()})
+                GROUP BY year ORDER BY min(row)
+                """,
+                [str(csv_path)],
+            ).fetchall()
+        finally:
+            connection.close()
+        return [int(year) for (year,) in rows]
+
+    def wrapped_tables(self, csv_path, years=None) -> dict:
+        queries = {
+            "totals": """
+                SELECT year, count(*) AS views, sum(seconds) AS seconds,
+                    min(row) AS first_row
+                FROM wrapped GROUP BY year
+            """,
+            "channels": """
+                SELECT year, channel_name, sum(seconds) AS seconds,
+                    min(row) AS first_row,
+                    arg_min_null(channel_link, row) AS channel_link
+                FROM wrapped WHERE channel_name IS NOT NULL
+                GROUP BY year, channel_name
+            """,
+            "videos": """
+                SELECT year, video_name, count(*) AS views,
+                    min(row) AS first_row,
+                    arg_min_null(video_link, row) AS video_link
+                FROM wrapped WHERE video_name IS NOT NULL
+                GROUP BY year, video_name
+            """,
+            "days": """
+                SELECT year, local_date, sum(seconds) AS seconds
+                FROM wrapped WHERE local_date IS NOT NULL
+                GROUP BY year, local_date
+            """,
+            "weekdays": """
+                SELECT year, weekday, count(*) AS views
+                FROM wrapped WHERE weekday IS NOT NULL
+                GROUP BY year, weekday
+            """,
+            "categories": """
+                SELECT year, category_name, count(*) AS views
+                FROM wrapped WHERE category_name IS NOT NULL
+                GROUP BY year, category_name
+            """,
+            "heatmap": """
+                SELECT year, weekday, hour, count(*) AS views
+                FROM wrapped WHERE weekday IS NOT NULL AND hour IS NOT NULL
+                GROUP BY year, weekday, hour
+            """,
+            "events": """
+                SELECT year, watch_epoch_ms, seconds AS duration_seconds, channel_name
+                FROM wrapped WHERE watch_epoch_ms IS NOT NULL ORDER BY row
+            """,
+        }
+        connection = self._connect(csv_path, years)
+        try:
+            return {name: connection.execute(sql).df() for name, sql in queries.items()}
+        finally:
+            connection.close()
+
+
+class PolarsBackend:
+    """Runs the wrapped queries as Polars lazy scans over the csv."""
+
+    name = "polars"
+
+    def __init__(self):
+        import polars
+
+        self.pl = polars
+
+    def _scan(self, csv_path):
+        return self.pl.scan_csv(csv_path, infer_schema=False).with_row_index("row")
+
+    def _wrapped(self, csv_path, years=None):
+        return self._wrapped_lazy(csv_path, years).collect()
+
+    def _wrapped_lazy(self, csv_path, years=None):
+        pl = self.pl
+
+        def integer(column):
+            return pl.col(column).cast(pl.Float64, strict=False).cast(pl.Int64)
+
+        seconds = pl.col("duration_seconds").cast(pl.Float64, strict=False)
+        frame = (
+            self._scan(csv_path)
+            .filter(
+                pl.col("error").is_null()
+                & (seconds <= MAX_DURATION_SECONDS)
+                & pl.col("year").is_not_null()
+            )
+            .select(
+                pl.col("row"),
+                integer("year").alias("year"),
+                seconds.alias("seconds"),
+                integer("watch_epoch_ms").alias("watch_epoch_ms"),
+                integer("weekday").alias("weekday"),
+                integer("hour").alias("hour"),
+                "local_date",
+                "video_name",
+                "video_link",
+                "channel_name",
+                "channel_link",
+                "category_name",
+            )
+        )
+        if years is not None:
+            frame = frame.filter(pl.col("year").is_in([int(year) for year in years]))
+        return frame
+
+    @staticmethod
+    def _to_pandas(frame) -> pd.DataFrame:
+        # Column by column, so pyarrow isn't needed
+        return pd.DataFrame({name: frame[name].to_numpy() for name in frame.columns})
+
+    def uncanonical_rows(self, csv_path) -> int:
+        pl = self.pl
+        return (
+            self._scan(csv_path)
+            .filter(
+                pl.col("error").is_null()
+                & pl.col("year").is_null()
+                & pl.col("watch_time").is_not_null()
+            )
+            .select(pl.len())
+            .collect()
+            .item()
+        )
+
+    def years(self, csv_path) -> list:
+        pl = self.pl
+        years = (
+            self._wrapped_lazy(csv_path)
+            .group_by("year")
+            .agg(pl.col("row").min())
+            .sort("row")
+            .collect()
+        )
+        return [int(year) for year in years["year"]]
+
+    def wrapped_tables(self, csv_path, years=None) -> dict:
+        pl = self.pl
+        wrapped = self._wrapped(csv_path, years)
+        views = pl.len().alias("views")
+        first_row = pl.col("row").min().alias("first_row")
+
+        def first_link(column):
+            return pl.col(column).sort_by("row").first().alias(column)
+
+        tables = {
+            "totals": wrapped.group_by("year").agg(
+                views, pl.col("seconds").sum(), first_row
+            ),
+            "channels": wrapped.filter(pl.col("channel_name").is_not_null())
+            .group_by("year", "channel_name")
+            .agg(pl.col("seconds").sum(), first_row, first_link("channel_link")),
+            "videos": wrapped.filter(pl.col("video_name").is_not_null())
+            .group_by("year", "video_name")
+            .agg(views, first_row, first_link("video_link")),
+            "days": wrapped.filter(pl.col("local_date").is_not_null())
+            .group_by("year", "local_date")
+            .agg(pl.col("seconds").sum()),
+            "weekdays": wrapped.filter(pl.col("weekday").is_not_null())
+            .group_by("year", "weekday")
+            .agg(views),
+            "categories": wrapped.filter(pl.col("category_name").is_not_null())
+            .group_by("year", "category_name")
+            .agg(views),
+            "heatmap": wrapped.filter(
+                pl.col("weekday").is_not_null() & pl.col("hour").is_not_null()
+            )
+            .group_by("year", "weekday", "hour")
+            .agg(views),
+            "events": wrapped.filter(pl.col("watch_epoch_ms").is_not_null())
+            .sort("row")
+            .select(
+                "year",
+                "watch_epoch_ms",
+                pl.col("seconds").alias("duration_seconds"),
+                "channel_name",
+            ),
+        }
+        return {name: self._to_pandas(table) for name, table in tables.items()}
+
+
+QUERY_BACKENDS = {
+    "pandas": PandasBackend,
+    "duckdb": DuckDBBackend,
+    "polars": PolarsBackend,
+}
+
+
+def get_query_backend(name: str | None = None):
+    """
+    Returns the configured backend, falling back to pandas when the name is
+    unknown or its package isn't installed.
+    """
+    name = (name or QUERY_BACKEND).lower()
+    backend_class = QUERY_BACKENDS.get(name)
+    if backend_class is None:
+        print(f"Unknown query backend {name}, using pandas")
+        return PandasBackend()
+    try:
+        return backend_class()
+    except ImportError as e:
+        print(f"Query backend {name} is not available ({e}), using pandas")
+        return PandasBackend()
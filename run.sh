@@ -5,6 +5,7 @@ rm -rf .venv
 uv venv -p 3.12
 uv pip install -r requirements.txt
 # uv pip install -r requirements-dev.txt
+# uv pip install -r requirements-query.txt
 uv run playwright install chromium
 
 # Set default port if not provided
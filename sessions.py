@@ -0,0 +1,189 @@
+import numpy as np
+import pandas as pd
+import tzlocal
+
+# A new session starts when nothing was playing for this long
+SESSION_GAP_MS = 30 * 60 * 1000
+
+EMPTY_SESSION_STATS = {
+    "sessions": 0,
+    "longest_session": None,
+    "biggest_binge": None,
+}
+
+
+def empty_events() -> dict:
+    return {
+        "epoch_ms": np.zeros(0, dtype=np.int64),
+        "seconds": np.zeros(0, dtype=np.float64),
+        "channel": np.zeros(0, dtype=np.int32),
+        "channel_names": np.zeros(0, dtype=str),
+    }
+
+
+def events_from_rows(df: pd.DataFrame) -> dict:
+    """
+    Splits filtered enriched rows into per-year event arrays sorted by watch
+    time, with channel names dictionary encoded (-1 for unknown).
+    """
+    df = df.dropna(subset=["year", "watch_epoch_ms"])
+    years = df["year"].to_numpy(dtype=np.int64)
+    epoch_ms = df["watch_epoch_ms"].to_numpy(dtype=np.int64)
+    seconds = pd.to_numeric(df["duration_seconds"], errors="coerce").fillna(0)
+    seconds = seconds.to_numpy(dtype=np.float64)
+    codes, names = pd.factorize(df["channel_name"])
+    codes = codes.astype(np.int32)
+    names = np.asarray(names, dtype=str)
+
+    events = {}
+    for year in pd.unique(years):
+        in_year = years == year
+        events[int(year)] = sort_events(
+            {
+                "epoch_ms": epoch_ms[in_year],
+                "seconds": seconds[in_year],
+                "channel": codes[in_year],
+                "channel_names": names,
+            }
+        )
+    return events
+
+
+def sort_events(events: dict) -> dict:
+    order = np.argsort(events["epoch_ms"], kind="stable")
+    return {
+        "epoch_ms": events["epoch_ms"][order],
+        "seconds": events["seconds"][order],
+        "channel": events["channel"][order],
+        "channel_names": events["channel_names"],
+    }
+
+
+def merge_events(event_sets) -> dict:
+    """Concatenates event sets, re-encoding channels into one vocabulary."""
+    event_sets = list(event_sets)
+    names, inverse = np.unique(
+        np.concatenate([events["channel_names"] for events in event_sets]),
+        return_inverse=True,
+    )
+    channels = []
+    offset = 0
+    for events in event_sets:
+        mapping = inverse[offset : offset + len(events["channel_names"])]
+        offset += len(events["channel_names"])
+        codes = events["channel"]
+        remapped = np.full(len(codes), -1, dtype=np.int32)
+        known = codes >= 0
+        remapped[known] = mapping[codes[known]]
+        channels.append(remapped)
+    return sort_events(
+        {
+            "epoch_ms": np.concatenate([events["epoch_ms"] for events in event_sets]),
+            "seconds": np.concatenate([events["seconds"] for events in event_sets]),
+            "channel": np.concatenate(channels),
+            "channel_names": names,
+        }
+    )
+
+
+def _local_date(epoch_ms, local_timezone) -> str:
+    return (
+        pd.Timestamp(int(epoch_ms), unit="ms", tz="UTC")
+        .tz_convert(local_timezone)
+        .strftime("%Y-%m-%d")
+    )
+
+
+def compute_session_stats(events: dict, local_timezone=None) -> dict:
+    """
+    Groups time sorted events into viewing sessions and finds the longest
+    session and the longest run of one channel inside a session.
+    """
+    epoch_ms = events["epoch_ms"]
+    if len(epoch_ms) == 0:
+        return dict(EMPTY_SESSION_STATS)
+    if local_timezone is None:
+        local_timezone = tzlocal.get_localzone()
+
+    ends = np.maximum.accumulate(epoch_ms + (events["seconds"] * 1000).astype(np.int64))
+    new_session = np.empty(len(epoch_ms), dtype=bool)
+    new_session[0] = True
+    new_session[1:] = epoch_ms[1:] - ends[:-1] > SESSION_GAP_MS
+    session_starts = np.flatnonzero(new_session)
+    session_ends = np.append(session_starts[1:], len(epoch_ms)) - 1
+
+    durations_ms = ends[session_ends] - epoch_ms[session_starts]
+    longest = int(np.argmax(durations_ms))
+    stats = {
+        "sessions": int(len(session_starts)),
+        "longest_session": {
+            "date": _local_date(epoch_ms[session_starts[longest]], local_timezone),
+            "minutes": int(durations_ms[longest] // 60000),
+            "videos": int(session_ends[longest] - session_starts[longest] + 1),
+        },
+        "biggest_binge": None,
+    }
+
+    # A binge is a run of the same channel without leaving the session
+    channel = events["channel"]
+    new_run = new_session.copy()
+    new_run[1:] |= channel[1:] != channel[:-1]
+    run_ids = np.cumsum(new_run) - 1
+    run_lengths = np.bincount(run_ids)
+    run_starts = np.flatnonzero(new_run)
+    run_lengths[channel[run_starts] < 0] = 0
+    if len(run_lengths) and run_lengths.max() > 1:
+        run = int(np.argmax(run_lengths))
+        start = run_starts[run]
+        in_run = run_ids == run
+        stats["biggest_binge"] = {
+            "channel": str(events["channel_names"][channel[start]]),
+            "videos": int(run_lengths[run]),
+            "minutes": int(events["seconds"][in_run].sum() // 60),
+            "date": _local_date(epoch_ms[start], local_timezone),
+        }
+    return stats
+
+
+def merge_session_stats(stats_list) -> dict:
+    """
+    Combines per-year session stats. Sessions running over midnight on new
+    year's eve count once per year.
+    """
+    merged = dict(EMPTY_SESSION_STATS)
+    for stats in stats_list:
+        merged["sessions"] += stats["sessions"]
+        for key, measure in (("longest_session", "minutes"), ("biggest_binge", "videos")):
+            candidate = stats[key]
+            if candidate is None:
+                continue
+            current = merged[key]
+            # Earlier dates win ties so the result doesn't depend on order
+            if (
+                current is None
+                or candidate[measure] > current[measure]
+                or (
+                    candidate[measure] == current[measure]
+                    and candidate["date"] < current["date"]
+                )
+            ):
+                merged[key] = candidate
+    return merged
+
+
+def longest_streak(dates) -> dict | None:
+    """Longest run of consecutive "YYYY-MM-DD" dates with any viewing."""
+    if not dates:
+        return None
+    days = np.unique(np.array(list(dates), dtype="datetime64[D]"))
+    new_run = np.empty(len(days), dtype=bool)
+    new_run[0] = True
+    new_run[1:] = np.diff(days).astype(np.int64) != 1
+    run_lengths = np.bincount(np.cumsum(new_run) - 1)
+    run = int(np.argmax(run_lengths))
+    start = np.flatnonzero(new_run)[run]
+    return {
+        "days": int(run_lengths[run]),
+        "start": str(days[start]),
+        "end": str(days[start + run_lengths[run] - 1]),
+    }
@@ -1,10 +1,52 @@
 import json
 import platform
-from io import BytesIO
 
-import requests
 from PIL import Image, ImageDraw, ImageFont
 
+from build_cache import BuildCache, hash_file
+from metrics import span
+from thumbnails import get_thumbnail_cache
+
+# Bump when the drawing code changes in a way that affects output
+SHARE_IMAGE_VERSION = 1
+LOGO_PATH = "./assets/images/mwsyftbox_white_on.png"
+
+
+def ensure_share_image(year, app_data_dir, output_path) -> bool:
+    """
+    Renders the share image only if its stats json or assets changed since
+    the last render. Returns True if the image was rendered.
+    """
+    json_path = app_data_dir / "cache" / f"youtube-wrapped-{year}.json"
+    inputs = {
+        "version": SHARE_IMAGE_VERSION,
+        "json": hash_file(json_path),
+        # Re-render once a placeholder thumbnail has been replaced by the real one
+        "thumbnail": hash_file(top_thumbnail_path(json_path, app_data_dir)),
+        "logo": hash_file(LOGO_PATH),
+        "platform": platform.system(),
+    }
+    return BuildCache(app_data_dir / "cache").build(
+        output_path,
+        inputs,
+        lambda: render_share_image(year, app_data_dir, output_path),
+    )
+
+
+def top_thumbnail_path(json_path, app_data_dir):
+    """The cached (or placeholder) thumbnail of the year's top video."""
+    try:
+        with open(json_path, encoding="utf-8") as f:
+            top_video_thumb = json.load(f)["top_videos_thumbs"][0]
+    except (OSError, ValueError, KeyError, IndexError):
+        top_video_thumb = None
+    return get_thumbnail_cache(app_data_dir / "cache").path_for(top_video_thumb)
+
+
+def render_share_image(year, app_data_dir, output_path):
+    with span("image_render"):
+        create_share_image(year, app_data_dir, output_path)
+
 
 def create_share_image(year, app_data_dir, output_path):
     with open(
@@ -27,8 +69,9 @@ def create_share_image(year, app_data_dir, output_path):
     top_day_date_year = data["top_day_date_year"]
     top_day_minutes = data["top_day_minutes"]
 
-    response = requests.get(top_video_thumb)
-    thumbnail = Image.open(BytesIO(response.content)).convert("RGB")
+    # Prefetched into the thumbnail cache, rendering never waits on the network
+    thumbnail_path = get_thumbnail_cache(app_data_dir / "cache").path_for(top_video_thumb)
+    thumbnail = Image.open(thumbnail_path).convert("RGB")
 
     # Step 2: Resize it to fit the 120x80 placeholder box
     thumbnail = thumbnail.resize((120, 80))
@@ -132,7 +175,7 @@ def create_share_image(year, app_data_dir, output_path):
             fill=(255, 255, 255),
         )
 
-    logo = Image.open("./assets/images/mwsyftbox_white_on.png").convert("RGBA")
+    logo = Image.open(LOGO_PATH).convert("RGBA")
 
     # Optional: Resize the logo if it's too big
     logo = logo.resize((343 // 2, 131 // 2))  # Adjust size as needed
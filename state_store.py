@@ -0,0 +1,95 @@
+import json
+import os
+import threading
+from pathlib import Path
+
+
+class PipelineStateStore:
+    """
+    Process-wide copy of cache/config.json.
+
+    Reads are served from memory. Every update happens under a lock and is
+    persisted with write-and-rename, so concurrent requests and background
+    tasks can't clobber each other's keys (e.g. lose the API key).
+    """
+
+    def __init__(self, config_path: Path):
+        self.config_path = Path(config_path)
+        self._lock = threading.RLock()
+        self._listeners = []
+        self._data = self._load()
+
+    def _load(self) -> dict:
+        if self.config_path.exists():
+            try:
+                with self.config_path.open("r", encoding="utf-8") as config_file:
+                    return json.load(config_file)
+            except Exception as e:
+                print(f"Error loading config: {e}")
+        return {}
+
+    def _persist(self):
+        self.config_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.config_path.with_suffix(".json.tmp")
+        with tmp_path.open("w", encoding="utf-8") as config_file:
+            json.dump(self._data, config_file)
+        os.replace(tmp_path, self.config_path)
+
+    def get(self, key: str, default=None):
+        with self._lock:
+            return self._data.get(key, default)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return dict(self._data)
+
+    def update(self, changes: dict):
+        """Applies `changes`, persists them and notifies listeners if anything changed."""
+        with self._lock:
+            changed = {
+                key: value for key, value in changes.items() if self._data.get(key) != value
+            }
+            if not changed:
+                return
+            self._data.update(changed)
+            self._persist()
+            snapshot = dict(self._data)
+            listeners = list(self._listeners)
+
+        for listener in listeners:
+            try:
+                listener(changed, snapshot)
+            except Exception as e:
+                print(f"Error in state listener: {e}")
+
+    def set(self, key: str, value):
+        self.update({key: value})
+
+    def subscribe(self, listener):
+        """
+        Registers listener(changed, snapshot) to be called after each update.
+        Returns a function that removes the listener again.
+        """
+        with self._lock:
+            self._listeners.append(listener)
+
+        def unsubscribe():
+            with self._lock:
+                if listener in self._listeners:
+                    self._listeners.remove(listener)
+
+        return unsubscribe
+
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def get_state_store(app_data_dir) -> PipelineStateStore:
+    """Returns the shared state store for an app data dir."""
+    config_path = Path(app_data_dir) / "cache" / "config.json"
+    key = str(config_path.resolve())
+    with _stores_lock:
+        if key not in _stores:
+            _stores[key] = PipelineStateStore(config_path)
+        return _stores[key]
@@ -0,0 +1,54 @@
+import hashlib
+import os
+from pathlib import Path
+
+import jinja2
+
+from metrics import span
+
+TEMPLATES_DIR = Path(__file__).parent / "assets"
+
+# Re-check template files for changes on every render only while developing
+DEV_MODE = os.environ.get("YOUTUBE_WRAPPED_DEV_MODE", "").lower() in ("1", "true", "yes")
+
+
+class HashingFileSystemLoader(jinja2.FileSystemLoader):
+    """Records a checksum of each template source as the environment loads it."""
+
+    def __init__(self, searchpath):
+        super().__init__(searchpath)
+        self.source_hashes = {}
+
+    def get_source(self, environment, template):
+        source, filename, uptodate = super().get_source(environment, template)
+        self.source_hashes[template] = hashlib.sha256(source.encode("utf-8")).hexdigest()
+        return source, filename, uptodate
+
+
+# One environment for every page, so each template is compiled once per
+# process instead of once per request
+template_env = jinja2.Environment(
+    loader=HashingFileSystemLoader(TEMPLATES_DIR),
+    auto_reload=DEV_MODE,
+)
+
+
+def enable_bytecode_cache(cache_dir):
+    """Keeps compiled templates on disk so restarts skip compilation too."""
+    bytecode_dir = Path(cache_dir) / "jinja-bytecode"
+    bytecode_dir.mkdir(parents=True, exist_ok=True)
+    template_env.bytecode_cache = jinja2.FileSystemBytecodeCache(str(bytecode_dir))
+
+
+def render_template(name: str, **context) -> str:
+    with span(f"template_render:{name}"):
+        return template_env.get_template(name).render(**context)
+
+
+def template_hash(name: str) -> str:
+    """
+    Checksum of the source `name` renders from. Outside dev mode that is the
+    file as it was when this process first loaded it, not as it is on disk.
+    """
+    template_env.get_template(name)
+    return template_env.loader.source_hashes[name]
@@ -0,0 +1,94 @@
+"""
+Times the wrapped queries on every installed query backend.
+
+    python tests/benchmark_query_backends.py --rows 1000000
+
+Builds a synthetic enriched history (or uses --csv) and reports how long
+each backend takes to produce the per-year partials, for every year and
+for a single year.
+"""
+
+import argparse
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import pandas as pd
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from aggregates import (  # noqa: E402
+    TEXT_COLUMNS,
+    compute_year_partials,
+    filter_wrapped_rows,
+    partials_from_tables,
+)
+from event_store import EventStore  # noqa: E402
+from query_backends import QUERY_BACKENDS, get_query_backend  # noqa: E402
+from sessions import events_from_rows  # noqa: E402
+from synthetic import synthetic_enriched  # noqa: E402
+
+
+def timed(fn) -> float:
+    start = time.perf_counter()
+    fn()
+    return time.perf_counter() - start
+
+
+def run_backend(name, csv_path, years=None):
+    backend = get_query_backend(name)
+    tables = backend.wrapped_tables(csv_path, years)
+    events = events_from_rows(tables.pop("events"))
+    return partials_from_tables(tables, events)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--year", type=int, default=2023)
+    parser.add_argument("--csv", type=Path, help="an existing enriched csv to use")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        csv_path = args.csv
+        if csv_path is None:
+            csv_path = Path(tmp_dir) / "watch-history-enriched.csv"
+            print(f"Writing {args.rows} synthetic rows")
+            synthetic_enriched(args.rows).to_csv(csv_path, index=False)
+
+        results = []
+        for name in QUERY_BACKENDS:
+            if get_query_backend(name).name != name:
+                print(f"Skipping {name}, it isn't installed")
+                continue
+            results.append(
+                (
+                    name,
+                    timed(lambda: run_backend(name, csv_path)),
+                    timed(lambda: run_backend(name, csv_path, [args.year])),
+                )
+            )
+
+        # The default rebuild: the event store is built once, then queried
+        store = EventStore.from_rows(
+            filter_wrapped_rows(pd.read_csv(csv_path, dtype=TEXT_COLUMNS))
+        )
+
+        def from_store():
+            frame = store.to_frame()
+            compute_year_partials(frame, events_from_rows(frame))
+
+        results.append(("event store (built)", timed(from_store), None))
+
+    baseline = results[0][1]
+    print(f"{'backend':<22}{'all years':>12}{'speed-up':>10}{f'{args.year} only':>12}")
+    for name, all_years, one_year in results:
+        one_year = f"{one_year:.2f}s" if one_year is not None else "-"
+        print(
+            f"{name:<22}{all_years:>11.2f}s{baseline / all_years:>9.1f}x{one_year:>12}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+import numpy as np
+import pandas as pd
+
+from manifest import file_signature
+
+# 2020-01-01 to 2025-01-01 UTC
+START_MS = 1_577_836_800_000
+END_MS = 1_735_689_600_000
+
+
+def synthetic_enriched(
+    rows: int, seed: int = 0, start_ms: int = START_MS, end_ms: int = END_MS
+) -> pd.DataFrame:
+    """
+    A fake enriched watch history between start_ms and end_ms, newest first
+    like the real file. It
+    includes the rows the wrapped stats drop (errors, videos over 4 hours)
+    and the awkward values: missing channels, categories and durations, and
+    numeric-looking titles.
+    """
+    rng = np.random.default_rng(seed)
+    channels = np.array([f"Channel {i}" for i in range(max(5, rows // 50))], dtype=object)
+    videos = np.array(
+        [f"Video {i}" for i in range(max(10, rows // 5))] + ["123", "1e5"], dtype=object
+    )
+
+    epoch_ms = np.sort(rng.integers(start_ms, end_ms, rows))[::-1]
+    watch_times = pd.to_datetime(epoch_ms, unit="ms", utc=True)
+    video_codes = rng.integers(0, len(videos), rows)
+    channel_codes = rng.integers(0, len(channels), rows)
+
+    durations = rng.integers(10, 3 * 3600, rows).astype(float)
+    durations[rng.random(rows) < 0.02] = 5 * 3600
+    durations[rng.random(rows) < 0.01] = np.nan
+    channel_names = channels[channel_codes]
+    channel_names[rng.random(rows) < 0.02] = None
+    categories = np.array(["Music", "Gaming", "Education", None], dtype=object)
+
+    return pd.DataFrame(
+        {
+            "video_name": videos[video_codes],
+            "video_link": [f"https://www.youtube.com/watch?v=vid{i}" for i in video_codes],
+            "channel_name": channel_names,
+            "channel_link": [
+                f"https://www.youtube.com/channel/UC{i}" for i in channel_codes
+            ],
+            "watch_time": watch_times.strftime("%Y-%m-%dT%H:%M:%S.000Z"),
+            "watch_epoch_ms": epoch_ms,
+            "video_id": [f"vid{i}" for i in video_codes],
+            "channel_id": [f"UC{i}" for i in channel_codes],
+            "local_date": watch_times.strftime("%Y-%m-%d"),
+            "year": watch_times.year,
+            "weekday": watch_times.dayofweek,
+            "hour": watch_times.hour,
+            "duration_seconds": durations,
+            "category_id": 10,
+            "category_name": categories[rng.integers(0, len(categories), rows)],
+            "error": np.where(rng.random(rows) < 0.03, "Video not found", None),
+        }
+    )
+
+
+def comparable(partials: dict) -> dict:
+    """Partials with their sketches as plain dicts, so they compare with ==."""
+    return {
+        year: {
+            key: value.to_dict() if key in ("channels", "videos") else value
+            for key, value in partial.items()
+        }
+        for year, partial in partials.items()
+    }
+
+
+def enrich_in_batches(data_dir, history: pd.DataFrame, batch_rows: int, batches: int, build, update):
+    """
+    Writes all but the newest batches * batch_rows rows of history as the
+    enriched file and calls build(). Then prepends the rest one batch at a
+    time like process_rows, calling update(new_rows, previous_signature)
+    after each write.
+    """
+    path = data_dir / "watch-history-enriched.csv"
+    newest = batch_rows * batches
+    history.iloc[newest:].to_csv(path, index=False)
+    build()
+    for start in range(newest - batch_rows, -1, -batch_rows):
+        new_rows = history.iloc[start : start + batch_rows]
+        previous_signature = file_signature(path)
+        pd.concat([new_rows, pd.read_csv(path)], ignore_index=True).to_csv(path, index=False)
+        update(new_rows, previous_signature)
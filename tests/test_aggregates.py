@@ -0,0 +1,79 @@
+import json
+
+import pytest
+
+import aggregates
+import query_backends
+from aggregates import (
+    compute_chunked_partials,
+    compute_year_partials,
+    load_partial,
+    plan_chunksize,
+    rebuild_wrapped_aggregates,
+)
+from event_store import get_event_store, iter_event_frames
+from synthetic import comparable, synthetic_enriched
+
+# Small enough that the synthetic history is split into SAMPLE_ROWS chunks
+TINY_BUDGET_MB = 0.05
+
+
+@pytest.fixture(scope="module")
+def data_dir(tmp_path_factory):
+    data_dir = tmp_path_factory.mktemp("data")
+    synthetic_enriched(5000).to_csv(data_dir / "watch-history-enriched.csv", index=False)
+    return data_dir
+
+
+def wrapped_outputs(cache_dir) -> dict:
+    outputs = {
+        path.name: json.loads(path.read_text())
+        for path in cache_dir.glob("youtube-wrapped-*.json")
+    }
+    index = json.loads((aggregates.get_aggregates_dir(cache_dir) / "index.json").read_text())
+    for key in [*index["years"], "all"]:
+        outputs[f"partial-{key}"] = comparable({key: load_partial(cache_dir, key)})
+    return outputs
+
+
+def rebuild(data_dir, cache_dir) -> dict:
+    cache_dir.mkdir()
+    rebuild_wrapped_aggregates(data_dir, cache_dir)
+    return wrapped_outputs(cache_dir)
+
+
+def test_tiny_budget_chunks_the_history(data_dir, tmp_path, monkeypatch):
+    monkeypatch.setattr(aggregates, "MEMORY_BUDGET_MB", TINY_BUDGET_MB)
+    assert plan_chunksize(data_dir / "watch-history-enriched.csv") == aggregates.SAMPLE_ROWS
+    frames = [len(frame) for frame in iter_event_frames(data_dir, tmp_path)]
+    assert len(frames) > 1
+    assert max(frames) <= aggregates.SAMPLE_ROWS
+
+
+def test_chunked_partials_match_in_memory(data_dir, tmp_path, monkeypatch):
+    frame = get_event_store(data_dir, tmp_path).to_frame()
+    expected = comparable(compute_year_partials(frame))
+
+    monkeypatch.setattr(aggregates, "MEMORY_BUDGET_MB", TINY_BUDGET_MB)
+    partials, events = compute_chunked_partials(iter_event_frames(data_dir, tmp_path))
+    assert comparable(partials) == expected
+    assert list(partials) == list(expected)
+    assert sorted(events) == sorted(expected)
+
+
+def test_tiny_budget_rebuild_matches_in_memory(data_dir, tmp_path, monkeypatch):
+    expected = rebuild(data_dir, tmp_path / "in-memory")
+    assert "youtube-wrapped-all.json" in expected
+
+    monkeypatch.setattr(aggregates, "MEMORY_BUDGET_MB", TINY_BUDGET_MB)
+    assert rebuild(data_dir, tmp_path / "chunked") == expected
+
+
+@pytest.mark.parametrize("name", ["duckdb", "polars"])
+def test_tiny_budget_backend_rebuild_matches_in_memory(name, data_dir, tmp_path, monkeypatch):
+    pytest.importorskip(name)
+    expected = rebuild(data_dir, tmp_path / "in-memory")
+
+    monkeypatch.setattr(query_backends, "QUERY_BACKEND", name)
+    monkeypatch.setattr(aggregates, "MEMORY_BUDGET_MB", TINY_BUDGET_MB)
+    assert rebuild(data_dir, tmp_path / "per-year") == expected
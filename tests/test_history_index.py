@@ -0,0 +1,108 @@
+import json
+
+import pytest
+
+import history_index
+from history_index import (
+    decode_cursor,
+    encode_cursor,
+    get_history_index,
+    rebuild_history_index,
+    update_history_index,
+)
+from synthetic import enrich_in_batches, synthetic_enriched
+
+MONTH = {"start_date": "2023-03-01", "end_date": "2023-03-31"}
+
+
+@pytest.fixture(scope="module")
+def index(tmp_path_factory):
+    data_dir = tmp_path_factory.mktemp("data")
+    synthetic_enriched(3000).to_csv(data_dir / "watch-history-enriched.csv", index=False)
+    return get_history_index(data_dir, tmp_path_factory.mktemp("cache"))
+
+
+def all_pages(index, filters, sort, order, limit) -> list:
+    items = []
+    cursor = None
+    while True:
+        page = index.history(filters, sort=sort, order=order, limit=limit, cursor=cursor)
+        items.extend(page["items"])
+        cursor = page["next_cursor"]
+        if cursor is None:
+            return items
+
+
+def test_cursor_round_trip():
+    cursor = encode_cursor("duration", "asc", 125, 42)
+    assert decode_cursor(cursor, "duration", "asc") == (125, 42)
+
+
+@pytest.mark.parametrize("sort, order", [("duration", "asc"), ("watched_at", "desc")])
+def test_cursor_rejected_for_another_sort(sort, order):
+    cursor = encode_cursor("watched_at", "asc", 1_700_000_000_000, 7)
+    with pytest.raises(ValueError):
+        decode_cursor(cursor, sort, order)
+
+
+@pytest.mark.parametrize("cursor", ["not a cursor", encode_cursor("watched_at", "asc", "x", 1)])
+def test_invalid_cursor_rejected(cursor):
+    with pytest.raises(ValueError):
+        decode_cursor(cursor, "watched_at", "asc")
+
+
+@pytest.mark.parametrize(
+    "sort, order", [("watched_at", "desc"), ("watched_at", "asc"), ("duration", "desc")]
+)
+def test_pages_follow_on(index, sort, order):
+    everything = index.history(MONTH, sort=sort, order=order, limit=500)
+    assert everything["next_cursor"] is None
+    assert 20 < len(everything["items"]) < 500
+    assert all_pages(index, MONTH, sort, order, limit=7) == everything["items"]
+
+
+def test_history_rejects_cursor_from_another_sort(index):
+    cursor = index.history(MONTH, sort="watched_at", order="desc", limit=5)["next_cursor"]
+    with pytest.raises(ValueError):
+        index.history(MONTH, sort="duration", order="desc", limit=5, cursor=cursor)
+    with pytest.raises(ValueError):
+        index.history(MONTH, sort="watched_at", order="asc", limit=5, cursor=cursor)
+
+
+def unordered(items: list) -> list:
+    return sorted(items, key=lambda item: json.dumps(item, sort_keys=True))
+
+
+def test_incremental_index_matches_rebuild(tmp_path, monkeypatch):
+    data_dir = tmp_path / "data"
+    data_dir.mkdir()
+    cache_dir = tmp_path / "cache"
+
+    def no_rebuild(*args):
+        raise AssertionError("the history index was rebuilt instead of updated")
+
+    def build():
+        get_history_index(data_dir, cache_dir)
+        monkeypatch.setattr(history_index, "rebuild_history_index", no_rebuild)
+
+    enrich_in_batches(
+        data_dir,
+        synthetic_enriched(3000),
+        batch_rows=300,
+        batches=3,
+        build=build,
+        update=lambda new_rows, signature: update_history_index(
+            data_dir, cache_dir, new_rows, signature
+        ),
+    )
+    incremental = get_history_index(data_dir, cache_dir)
+    monkeypatch.undo()
+
+    rebuilt = rebuild_history_index(data_dir, tmp_path / "rebuilt")
+    for filters in ({}, MONTH, {"channel": "Channel 3"}, {"category": "Music"}):
+        assert incremental.stats(filters, top=10) == rebuilt.stats(filters, top=10)
+        assert unordered(all_pages(incremental, filters, "watched_at", "desc", 500)) == (
+            unordered(all_pages(rebuilt, filters, "watched_at", "desc", 500))
+        )
+    for text in ("video 12", "channel 4"):
+        assert incremental.search(text, {}) == rebuilt.search(text, {})
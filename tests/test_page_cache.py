@@ -0,0 +1,71 @@
+from email.utils import formatdate
+
+import pytest
+from fastapi import FastAPI, Request
+from fastapi.testclient import TestClient
+
+from page_cache import PageCache, cached_html_response, make_etag
+
+
+@pytest.fixture
+def versioned_page():
+    """An app serving one cached page, rendered again only when its version changes."""
+    app = FastAPI()
+    cache = PageCache()
+    state = {"version": 1, "renders": 0}
+
+    @app.get("/")
+    async def home(request: Request):
+        etag = make_etag({"data": state["version"]})
+        page = cache.get("home", etag)
+        if page is None:
+            state["renders"] += 1
+            page = cache.put("home", etag, f"<p>version {state['version']}</p>")
+        return cached_html_response(request, page)
+
+    return TestClient(app), state
+
+
+def test_etag_is_stable_per_version():
+    assert make_etag({"a": 1, "b": [2]}) == make_etag({"b": [2], "a": 1})
+    assert make_etag({"a": 1}) != make_etag({"a": 2})
+
+
+def test_not_modified_on_if_none_match(versioned_page):
+    client, state = versioned_page
+    response = client.get("/")
+    assert response.status_code == 200
+    assert response.text == "<p>version 1</p>"
+    etag = response.headers["etag"]
+    assert response.headers["cache-control"] == "no-cache"
+
+    for if_none_match in (etag, f"W/{etag}", f'"other", {etag}', "*"):
+        response = client.get("/", headers={"If-None-Match": if_none_match})
+        assert response.status_code == 304
+        assert response.content == b""
+        assert response.headers["etag"] == etag
+    assert state["renders"] == 1
+
+    response = client.get("/", headers={"If-None-Match": '"other"'})
+    assert response.status_code == 200
+
+
+def test_changed_version_renders_again(versioned_page):
+    client, state = versioned_page
+    etag = client.get("/").headers["etag"]
+    state["version"] = 2
+    response = client.get("/", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.text == "<p>version 2</p>"
+    assert response.headers["etag"] != etag
+    assert state["renders"] == 2
+
+
+def test_not_modified_since(versioned_page):
+    client, _ = versioned_page
+    last_modified = client.get("/").headers["last-modified"]
+    response = client.get("/", headers={"If-Modified-Since": last_modified})
+    assert response.status_code == 304
+
+    response = client.get("/", headers={"If-Modified-Since": formatdate(0, usegmt=True)})
+    assert response.status_code == 200
@@ -0,0 +1,57 @@
+import pandas as pd
+import pytest
+
+from aggregates import (
+    TEXT_COLUMNS,
+    compute_year_partials,
+    filter_wrapped_rows,
+    partials_from_tables,
+)
+from event_store import EventStore
+from query_backends import get_query_backend
+from sessions import events_from_rows
+from synthetic import comparable, synthetic_enriched
+
+OPTIONAL_BACKENDS = ["duckdb", "polars"]
+
+
+@pytest.fixture(scope="module")
+def enriched_csv(tmp_path_factory):
+    path = tmp_path_factory.mktemp("data") / "watch-history-enriched.csv"
+    synthetic_enriched(5000).to_csv(path, index=False)
+    return path
+
+
+def backend_partials(name, csv_path, years=None) -> dict:
+    backend = get_query_backend(name)
+    assert backend.name == name
+    tables = backend.wrapped_tables(csv_path, years)
+    events = events_from_rows(tables.pop("events"))
+    return comparable(partials_from_tables(tables, events))
+
+
+@pytest.mark.parametrize("name", OPTIONAL_BACKENDS)
+def test_backend_matches_pandas(name, enriched_csv):
+    pytest.importorskip(name)
+    expected = backend_partials("pandas", enriched_csv)
+    assert len(expected) == 5
+    assert backend_partials(name, enriched_csv) == expected
+
+
+@pytest.mark.parametrize("name", OPTIONAL_BACKENDS)
+def test_backend_matches_pandas_for_one_year(name, enriched_csv):
+    pytest.importorskip(name)
+    expected = backend_partials("pandas", enriched_csv, years=[2023])
+    assert list(expected) == [2023]
+    assert backend_partials(name, enriched_csv, years=[2023]) == expected
+
+
+def test_event_store_matches_pandas(enriched_csv):
+    df = filter_wrapped_rows(pd.read_csv(enriched_csv, dtype=TEXT_COLUMNS))
+    frame = EventStore.from_rows(df).to_frame()
+    partials = comparable(compute_year_partials(frame, events_from_rows(frame)))
+    assert partials == backend_partials("pandas", enriched_csv)
+
+
+def test_unknown_backend_falls_back_to_pandas():
+    assert get_query_backend("spark").name == "pandas"
@@ -0,0 +1,124 @@
+import json
+
+import numpy as np
+import pandas as pd
+
+import aggregates
+from aggregates import load_events, rebuild_wrapped_aggregates, update_wrapped_aggregates
+from sessions import compute_session_stats, events_from_rows, longest_streak, merge_events
+from synthetic import enrich_in_batches, synthetic_enriched
+
+MINUTE_MS = 60 * 1000
+DAY_MS = 24 * 60 * MINUTE_MS
+# 2023-12-31 00:00 UTC
+NEW_YEARS_EVE_MS = 1_703_980_800_000
+
+
+def events(rows) -> dict:
+    """Events from (minute, seconds, channel) tuples."""
+    minutes, seconds, channels = zip(*rows)
+    return events_from_rows(
+        pd.DataFrame(
+            {
+                "year": 2023,
+                "watch_epoch_ms": [NEW_YEARS_EVE_MS + minute * MINUTE_MS for minute in minutes],
+                "duration_seconds": seconds,
+                "channel_name": channels,
+            }
+        )
+    )[2023]
+
+
+def test_sessions_split_on_gaps():
+    stats = compute_session_stats(
+        events(
+            [
+                (0, 600, "A"),
+                (10, 600, "A"),
+                (20, 600, "A"),
+                (30, 600, "B"),
+                # 40 minutes after the last video ended
+                (80, 300, "B"),
+                (85, 300, None),
+            ]
+        ),
+        "UTC",
+    )
+    assert stats == {
+        "sessions": 2,
+        "longest_session": {"date": "2023-12-31", "minutes": 40, "videos": 4},
+        "biggest_binge": {"channel": "A", "videos": 3, "minutes": 30, "date": "2023-12-31"},
+    }
+
+
+def test_sessions_across_merged_batches():
+    rows = [(minute * 5, 240, "A" if minute < 6 else "B") for minute in range(12)]
+    merged = merge_events([events(rows[7:]), events(rows[:7])])
+    assert compute_session_stats(merged, "UTC") == compute_session_stats(events(rows), "UTC")
+    assert compute_session_stats(merged, "UTC")["sessions"] == 1
+
+
+def test_longest_streak():
+    dates = ["2024-01-03", "2024-01-01", "2024-01-02", "2024-01-02", "2024-01-05"]
+    assert longest_streak(dates) == {"days": 3, "start": "2024-01-01", "end": "2024-01-03"}
+    assert longest_streak([]) is None
+
+
+def wrapped_json(cache_dir) -> dict:
+    return {
+        path.name: json.loads(path.read_text())
+        for path in sorted(cache_dir.glob("youtube-wrapped-*.json"))
+    }
+
+
+def decoded_events(cache_dir, year) -> dict:
+    year_events = load_events(cache_dir, year)
+    channels = np.where(
+        year_events["channel"] >= 0,
+        year_events["channel_names"][np.maximum(year_events["channel"], 0)],
+        "",
+    )
+    return {
+        "epoch_ms": year_events["epoch_ms"].tolist(),
+        "seconds": year_events["seconds"].tolist(),
+        "channel": channels.tolist(),
+    }
+
+
+def test_incremental_sessions_match_rebuild(tmp_path, monkeypatch):
+    data_dir = tmp_path / "data"
+    data_dir.mkdir()
+    cache_dir = tmp_path / "cache"
+    cache_dir.mkdir()
+
+    def no_rebuild(*args):
+        raise AssertionError("the aggregates were rebuilt instead of updated")
+
+    def build():
+        rebuild_wrapped_aggregates(data_dir, cache_dir)
+        monkeypatch.setattr(aggregates, "rebuild_wrapped_aggregates", no_rebuild)
+
+    # About ten minutes apart around new year, so sessions span batches and years
+    history = synthetic_enriched(
+        3000, start_ms=NEW_YEARS_EVE_MS - 10 * DAY_MS, end_ms=NEW_YEARS_EVE_MS + 11 * DAY_MS
+    )
+    enrich_in_batches(
+        data_dir,
+        history,
+        batch_rows=250,
+        batches=8,
+        build=build,
+        update=lambda new_rows, signature: update_wrapped_aggregates(
+            data_dir, cache_dir, new_rows, signature
+        ),
+    )
+    monkeypatch.undo()
+
+    rebuilt_dir = tmp_path / "rebuilt"
+    rebuilt_dir.mkdir()
+    stats = rebuild_wrapped_aggregates(data_dir, rebuilt_dir)
+    assert set(stats) == {2023, 2024, "all"}
+    assert stats[2024]["longest_session"]["videos"] > 1
+    assert wrapped_json(cache_dir) == wrapped_json(rebuilt_dir)
+    for year in (2023, 2024):
+        assert decoded_events(cache_dir, year) == decoded_events(rebuilt_dir, year)
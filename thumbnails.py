@@ -0,0 +1,198 @@
+import json
+import os
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import requests
+
+THUMBNAILS_DIR = "thumbnails"
+THUMBNAIL_INDEX_FILE = "index.json"
+PLACEHOLDER_PATH = Path(__file__).parent / "assets" / "images" / "thumbnail-placeholder.png"
+
+# Total size of cached thumbnails before the least recently used are evicted
+MAX_CACHE_MB = float(os.environ.get("YOUTUBE_WRAPPED_THUMBNAIL_CACHE_MB", 50))
+
+# Cached thumbnails older than this are revalidated on the next prefetch
+MAX_AGE_SECONDS = float(os.environ.get("YOUTUBE_WRAPPED_THUMBNAIL_MAX_AGE_HOURS", 168)) * 3600
+
+FETCH_TIMEOUT_SECONDS = float(os.environ.get("YOUTUBE_WRAPPED_THUMBNAIL_TIMEOUT_SECONDS", 5))
+PREFETCH_WORKERS = 4
+
+_caches_lock = threading.Lock()
+_caches = {}
+
+
+def thumbnail_video_id(url) -> str | None:
+    """The video id of an i.ytimg.com thumbnail url."""
+    match = re.search(r"/vi/([A-Za-z0-9_-]+)/", url or "")
+    return match.group(1) if match else None
+
+
+class ThumbnailCache:
+    """
+    Video thumbnails on disk, keyed by video id.
+
+    Reads never touch the network: a missing thumbnail is served as the
+    bundled placeholder. prefetch() fills and revalidates the cache, using
+    conditional requests so unchanged thumbnails aren't downloaded again.
+    """
+
+    def __init__(self, cache_dir):
+        self.directory = Path(cache_dir) / THUMBNAILS_DIR
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.index_path = self.directory / THUMBNAIL_INDEX_FILE
+        self._lock = threading.Lock()
+        self._entries = self._load()
+
+    def _load(self) -> dict:
+        if self.index_path.exists():
+            try:
+                with self.index_path.open("r", encoding="utf-8") as f:
+                    return json.load(f)
+            except Exception as e:
+                print(f"Error loading thumbnail index: {e}")
+        return {}
+
+    def _save(self):
+        tmp_path = self.index_path.with_suffix(".json.tmp")
+        with tmp_path.open("w", encoding="utf-8") as f:
+            json.dump(self._entries, f)
+        os.replace(tmp_path, self.index_path)
+
+    def _path(self, video_id: str) -> Path:
+        return self.directory / f"{video_id}.jpg"
+
+    def path_for(self, url) -> Path:
+        """
+        The cached thumbnail for a url, or the placeholder if it isn't cached.
+        Its last use is only persisted with the next fetch, so reads don't write.
+        """
+        video_id = thumbnail_video_id(url)
+        with self._lock:
+            entry = self._entries.get(video_id) if video_id else None
+            if entry is None or not self._path(video_id).exists():
+                return PLACEHOLDER_PATH
+            entry["last_used"] = time.time()
+        return self._path(video_id)
+
+    def _needs_fetch(self, video_id: str) -> bool:
+        entry = self._entries.get(video_id)
+        return (
+            entry is None
+            or not self._path(video_id).exists()
+            or time.time() - entry["fetched_at"] > MAX_AGE_SECONDS
+        )
+
+    def fetch(self, url) -> bool:
+        """
+        Downloads or revalidates one thumbnail. Returns True if it is cached
+        afterwards. Network errors keep whatever was cached before.
+        """
+        video_id = thumbnail_video_id(url)
+        if video_id is None:
+            return False
+        with self._lock:
+            entry = dict(self._entries.get(video_id) or {})
+        headers = {}
+        if self._path(video_id).exists():
+            if entry.get("etag"):
+                headers["If-None-Match"] = entry["etag"]
+            if entry.get("last_modified"):
+                headers["If-Modified-Since"] = entry["last_modified"]
+
+        try:
+            response = requests.get(url, headers=headers, timeout=FETCH_TIMEOUT_SECONDS)
+        except requests.RequestException as e:
+            print(f"Error fetching thumbnail {url}: {e}")
+            return bool(entry) and self._path(video_id).exists()
+
+        now = time.time()
+        if response.status_code == 304:
+            entry["fetched_at"] = now
+        elif response.status_code == 200 and response.content:
+            tmp_path = self._path(video_id).with_suffix(".jpg.tmp")
+            with tmp_path.open("wb") as f:
+                f.write(response.content)
+            os.replace(tmp_path, self._path(video_id))
+            entry = {
+                "etag": response.headers.get("ETag"),
+                "last_modified": response.headers.get("Last-Modified"),
+                "fetched_at": now,
+                "size": len(response.content),
+            }
+        else:
+            print(f"Error fetching thumbnail {url}: HTTP {response.status_code}")
+            return bool(entry) and self._path(video_id).exists()
+
+        entry["last_used"] = now
+        with self._lock:
+            self._entries[video_id] = entry
+            self._evict()
+            self._save()
+        return True
+
+    def _evict(self):
+        """Drops least recently used thumbnails until the cache fits its budget."""
+        budget = MAX_CACHE_MB * 1024 * 1024
+        total = sum(entry["size"] for entry in self._entries.values())
+        for video_id in sorted(self._entries, key=lambda key: self._entries[key]["last_used"]):
+            if total <= budget:
+                break
+            total -= self._entries.pop(video_id)["size"]
+            self._path(video_id).unlink(missing_ok=True)
+
+    def prefetch(self, urls) -> int:
+        """
+        Fetches the thumbnails that are missing or due for revalidation, a
+        few at a time. Returns how many are cached afterwards.
+        """
+        urls = list(dict.fromkeys(urls))
+        with self._lock:
+            due = [
+                url
+                for url in urls
+                if thumbnail_video_id(url) and self._needs_fetch(thumbnail_video_id(url))
+            ]
+        if due:
+            with ThreadPoolExecutor(max_workers=PREFETCH_WORKERS) as pool:
+                list(pool.map(self.fetch, due))
+        with self._lock:
+            return sum(
+                1
+                for url in urls
+                if thumbnail_video_id(url) in self._entries
+                and self._path(thumbnail_video_id(url)).exists()
+            )
+
+
+def get_thumbnail_cache(cache_dir) -> ThumbnailCache:
+    """Returns the process-wide thumbnail cache for a cache dir."""
+    key = str(Path(cache_dir).resolve())
+    with _caches_lock:
+        if key not in _caches:
+            _caches[key] = ThumbnailCache(cache_dir)
+        return _caches[key]
+
+
+def top_video_thumbnails(cache_dir, years=None) -> list:
+    """Thumbnail urls of the top videos in the generated wrapped json of years (all if None)."""
+    if years is None:
+        paths = sorted(Path(cache_dir).glob("youtube-wrapped-*.json"))
+    else:
+        paths = [Path(cache_dir) / f"youtube-wrapped-{year}.json" for year in years]
+    urls = []
+    for path in paths:
+        try:
+            with path.open("r", encoding="utf-8") as f:
+                urls.extend(json.load(f).get("top_videos_thumbs", []))
+        except Exception as e:
+            print(f"Error reading {path.name}: {e}")
+    return urls
+
+
+def prefetch_top_thumbnails(cache_dir, years=None) -> int:
+    """Warms the cache with the top video thumbnails of years (every year if None)."""
+    return get_thumbnail_cache(cache_dir).prefetch(top_video_thumbnails(cache_dir, years))
@@ -0,0 +1,48 @@
+import warnings
+
+import pandas as pd
+import tzlocal
+
+EPOCH = pd.Timestamp(0, tz="UTC")
+
+
+def parse_watch_times(values: pd.Series) -> pd.Series:
+    """
+    Parses watch time strings into a tz-aware UTC column in one vectorized
+    call. Strings with mixed UTC offsets are all converted to UTC, and
+    anything unparseable becomes NaT.
+    """
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", category=FutureWarning)
+        warnings.simplefilter("ignore", category=UserWarning)
+        return pd.to_datetime(values, errors="coerce", utc=True, format="ISO8601")
+
+
+def to_epoch_ms(watch_times_utc: pd.Series) -> pd.Series:
+    """Converts a tz-aware column to nullable int64 milliseconds since the epoch."""
+    return ((watch_times_utc - EPOCH) // pd.Timedelta(milliseconds=1)).astype("Int64")
+
+
+def from_epoch_ms(epoch_ms: pd.Series) -> pd.Series:
+    return pd.to_datetime(epoch_ms.astype("Float64"), unit="ms", utc=True)
+
+
+def normalize_watch_times(df: pd.DataFrame, local_timezone=None) -> pd.Series:
+    """
+    Returns the watch times of `df` converted to the local timezone.
+
+    Uses the pre-normalized watch_epoch_ms column written at ingest when it is
+    there and only parses watch_time strings for rows without it.
+    """
+    if local_timezone is None:
+        local_timezone = tzlocal.get_localzone()
+
+    if "watch_epoch_ms" in df.columns:
+        watch_times = from_epoch_ms(pd.to_numeric(df["watch_epoch_ms"], errors="coerce"))
+        missing = watch_times.isna()
+        if missing.any() and "watch_time" in df.columns:
+            watch_times[missing] = parse_watch_times(df.loc[missing, "watch_time"])
+    else:
+        watch_times = parse_watch_times(df["watch_time"])
+
+    return watch_times.dt.tz_convert(local_timezone)
@@ -0,0 +1,210 @@
+import base64
+import os
+import zlib
+
+import numpy as np
+
+# How many distinct keys a sketch tracks exactly before it starts evicting
+DEFAULT_CAPACITY = int(os.environ.get("YOUTUBE_WRAPPED_TOPK_CAPACITY", 20000))
+
+# How many items the wrapped lists show
+DEFAULT_TOP_K = int(os.environ.get("YOUTUBE_WRAPPED_TOP_K", 5))
+
+COUNT_MIN_WIDTH = 4096
+COUNT_MIN_DEPTH = 4
+
+
+class CountMinSketch:
+    """
+    Fixed size table of counters, used to tighten the over-estimates of a
+    saturated TopKSketch. Never under-counts a key.
+    """
+
+    def __init__(self, width: int = COUNT_MIN_WIDTH, depth: int = COUNT_MIN_DEPTH, table=None):
+        self.width = width
+        self.depth = depth
+        if table is None:
+            table = np.zeros((depth, width), dtype=np.float64)
+        self.table = table
+
+    def _columns(self, key) -> list:
+        # crc32 with a per-row start value is stable across processes,
+        # unlike hash(), so persisted tables stay valid
+        encoded = str(key).encode("utf-8")
+        return [zlib.crc32(encoded, row + 1) % self.width for row in range(self.depth)]
+
+    def _columns_many(self, keys) -> np.ndarray:
+        """(depth, len(keys)) column indexes, one row per hash."""
+        columns = np.array([self._columns(key) for key in keys], dtype=np.int64)
+        return columns.reshape(-1, self.depth).T
+
+    def add_counts(self, counts: dict):
+        columns = self._columns_many(counts)
+        weights = np.fromiter(counts.values(), dtype=np.float64, count=len(counts))
+        for row in range(self.depth):
+            np.add.at(self.table[row], columns[row], weights)
+
+    def estimate(self, key) -> float:
+        return float(self.table[np.arange(self.depth), self._columns(key)].min())
+
+    def estimate_many(self, keys) -> np.ndarray:
+        columns = self._columns_many(keys)
+        return self.table[np.arange(self.depth)[:, None], columns].min(axis=0)
+
+    def merge(self, other: "CountMinSketch") -> "CountMinSketch":
+        return CountMinSketch(self.width, self.depth, self.table + other.table)
+
+    def to_dict(self) -> dict:
+        return {
+            "width": self.width,
+            "depth": self.depth,
+            "table": base64.b64encode(self.table.tobytes()).decode("ascii"),
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "CountMinSketch":
+        table = np.frombuffer(base64.b64decode(data["table"]), dtype=np.float64)
+        table = table.reshape(data["depth"], data["width"]).copy()
+        return cls(data["width"], data["depth"], table)
+
+
+class TopKSketch:
+    """
+    Space-Saving heavy hitters with a first-seen link per key.
+
+    While at most `capacity` distinct keys have been seen the counts are
+    exact. Past that the smallest counters are evicted, `floor` bounds the
+    count of any untracked key, and a Count-Min sketch seeded with the exact
+    counts at that point caps each estimate.
+
+    Sketches are built from the exact counts of one enrichment batch (or
+    chunk) and merged, never fed one observation at a time.
+    """
+
+    def __init__(self, capacity: int | None = None):
+        self.capacity = capacity or DEFAULT_CAPACITY
+        self.counts = {}
+        self.errors = {}
+        self.links = {}
+        self.floor = 0
+        self.total = 0
+        self.count_min = None
+
+    @property
+    def exact(self) -> bool:
+        return self.floor == 0
+
+    @classmethod
+    def from_counts(cls, counts: dict, links: dict | None = None, capacity=None):
+        """Builds a sketch from already aggregated counts, in their order."""
+        sketch = cls(capacity)
+        sketch.counts = dict(counts)
+        sketch.links = {key: link for key, link in (links or {}).items() if key in counts}
+        sketch.total = sum(counts.values())
+        sketch._truncate()
+        return sketch
+
+    def _ensure_count_min(self):
+        # Only called while the counts are still exact
+        if self.count_min is None:
+            self.count_min = CountMinSketch()
+            self.count_min.add_counts(self.counts)
+
+    def _truncate(self):
+        if len(self.counts) <= self.capacity:
+            return
+        self._ensure_count_min()
+        ordered = sorted(self.counts, key=self.counts.get, reverse=True)
+        dropped = ordered[self.capacity :]
+        self.floor = max(self.floor, max(self.counts[key] for key in dropped))
+        for key in dropped:
+            del self.counts[key]
+            self.errors.pop(key, None)
+            self.links.pop(key, None)
+
+    def merge(self, other: "TopKSketch") -> "TopKSketch":
+        """
+        Returns the combined sketch. Keys of self come first, so it keeps the
+        first-seen order and links of self when both saw a key.
+        """
+        merged = TopKSketch(max(self.capacity, other.capacity))
+        for key in [*self.counts, *(key for key in other.counts if key not in self.counts)]:
+            merged.counts[key] = self.counts.get(key, self.floor) + other.counts.get(
+                key, other.floor
+            )
+            error = self.errors.get(key, self.floor if key not in self.counts else 0)
+            error += other.errors.get(key, other.floor if key not in other.counts else 0)
+            if error:
+                merged.errors[key] = error
+        merged.links = dict(self.links)
+        for key, link in other.links.items():
+            merged.links.setdefault(key, link)
+        merged.floor = self.floor + other.floor
+        merged.total = self.total + other.total
+
+        if self.count_min is not None or other.count_min is not None:
+            # An exact sketch without a table is fully described by its counts
+            count_mins = []
+            for sketch in (self, other):
+                if sketch.count_min is None:
+                    count_min = CountMinSketch()
+                    count_min.add_counts(sketch.counts)
+                    count_mins.append(count_min)
+                else:
+                    count_mins.append(sketch.count_min)
+            merged.count_min = count_mins[0].merge(count_mins[1])
+        merged._truncate()
+        return merged
+
+    def estimate(self, key) -> float:
+        count = self.counts.get(key, self.floor)
+        if self.count_min is not None:
+            count = min(count, self.count_min.estimate(key))
+        return count
+
+    def top(self, n: int | None = None, tie_break=None) -> list:
+        """
+        Returns up to n (key, estimate, max_error) tuples, largest first.
+        Ties are ordered by tie_break(key) when given, otherwise they keep
+        their first-seen order. max_error is 0 while the sketch is exact.
+        """
+        n = n or DEFAULT_TOP_K
+        estimates = dict(self.counts)
+        if self.count_min is not None and estimates:
+            capped = np.minimum(
+                np.fromiter(estimates.values(), dtype=np.float64, count=len(estimates)),
+                self.count_min.estimate_many(estimates),
+            )
+            estimates = dict(zip(estimates, capped.tolist()))
+        if tie_break is None:
+            ordered = sorted(estimates.items(), key=lambda kv: -kv[1])
+        else:
+            ordered = sorted(estimates.items(), key=lambda kv: (-kv[1], tie_break(kv[0])))
+        items = []
+        for key, estimate in ordered[:n]:
+            lower_bound = self.counts[key] - self.errors.get(key, 0)
+            items.append((key, estimate, estimate - lower_bound))
+        return items
+
+    def to_dict(self) -> dict:
+        return {
+            "capacity": self.capacity,
+            "counts": self.counts,
+            "errors": self.errors,
+            "links": self.links,
+            "floor": self.floor,
+            "total": self.total,
+            "count_min": self.count_min.to_dict() if self.count_min is not None else None,
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "TopKSketch":
+        sketch = cls(data["capacity"])
+        sketch.counts = data["counts"]
+        sketch.errors = data["errors"]
+        sketch.links = data["links"]
+        sketch.floor = data["floor"]
+        sketch.total = data["total"]
+        if data["count_min"] is not None:
+            sketch.count_min = CountMinSketch.from_dict(data["count_min"])
+        return sketch
@@ -1,9 +1,50 @@
 import json
-import os
+import threading
 from pathlib import Path
 
 import pandas as pd
 
+from manifest import (
+    EMPTY_ENRICHED_SUMMARY,
+    file_signature,
+    get_manifest_path,
+    summarize_enriched_file,
+)
+from state_store import get_state_store
+
+# Stats snapshots keyed by file path, invalidated on size / mtime change
+_stats_cache = {}
+_stats_lock = threading.Lock()
+
+
+def compute_source_stats(watch_history_csv_path) -> dict:
+    df = pd.read_csv(watch_history_csv_path, usecols=lambda c: c == "watch_time")
+    return {"total_rows": len(df)}
+
+
+def load_json(path) -> dict:
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def get_cached_stats(path, compute_fn) -> dict | None:
+    """
+    Returns compute_fn(path), recomputing only when the file's size or mtime
+    changed since the last call. Returns None if the file does not exist.
+    """
+    key = str(path)
+    signature = file_signature(path)
+    if signature is None:
+        return None
+    with _stats_lock:
+        cached = _stats_cache.get(key)
+        if cached and cached[0] == signature:
+            return cached[1]
+    stats = compute_fn(path)
+    with _stats_lock:
+        _stats_cache[key] = (signature, stats)
+    return stats
+
 
 class YoutubeDataPipelineState:
     def __init__(self, app_data_dir: Path):
@@ -18,30 +59,8 @@ class YoutubeDataPipelineState:
             ),
             "youtube_wrapped": Path(app_data_dir / "data/youtube-wrapped.html"),
         }
-        self.config_path = Path(app_data_dir / "cache" / "config.json")
-        self.config_data = self.load_config()
-
-    def load_config(self) -> dict:
-        """Loads the configuration from the config.json file."""
-        if self.config_path.exists():
-            with self.config_path.open("r", encoding="utf-8") as config_file:
-                return json.load(config_file)
-        return {}
-
-    def save_config(self):
-        """Saves the current configuration to the config.json file."""
-        with self.config_path.open("w", encoding="utf-8") as config_file:
-            json.dump(self.config_data, config_file)
-
-    def set_processing(self, processing: bool):
-        """Sets the processing state and updates the config."""
-        self.config_data["processing"] = processing
-        self.save_config()
-
-    def set_keep_running(self, keep_running: bool):
-        """Sets the keep_running state and updates the config."""
-        self.config_data["keep_running"] = keep_running
-        self.save_config()
+        self.manifest_path = get_manifest_path(app_data_dir / "data")
+        self.store = get_state_store(app_data_dir)
 
     def source_data_exists(self) -> bool:
         return self.paths["watch_history"].exists()
@@ -60,11 +79,13 @@ class YoutubeDataPipelineState:
         return self.paths["youtube_wrapped"].exists()
 
     def setup_api_key(self) -> bool:
-        if self.config_path.exists():
-            with self.config_path.open("r", encoding="utf-8") as config_file:
-                config_data = json.load(config_file)
-                return "youtube-api-key" in config_data
-        return False
+        return self.store.get("youtube-api-key") is not None
+
+    def get_api_key(self) -> str | None:
+        return self.store.get("youtube-api-key")
+
+    def set_api_key(self, api_key: str):
+        self.store.set("youtube-api-key", api_key)
 
     def get_watch_history_path(self) -> str:
         """Returns the absolute path to the watch-history.html file."""
@@ -84,71 +105,82 @@ class YoutubeDataPipelineState:
 
     def is_processing(self) -> bool:
         """Returns True if processing is currently running, False otherwise."""
-        return self.config_data.get("processing", False)
+        return self.store.get("processing", False)
 
     def set_processing(self, processing: bool):
         """Sets the processing state."""
-        self.config_data["processing"] = processing
-        self.save_config()
+        self.store.set("processing", processing)
 
     def is_keep_running(self) -> bool:
         """Returns True if keep_running is currently set, False otherwise."""
-        return self.config_data.get("keep_running", False)
+        return self.store.get("keep_running", False)
 
     def set_keep_running(self, keep_running: bool):
         """Sets the keep_running state."""
-        self.config_data["keep_running"] = keep_running
-        self.save_config()
+        self.store.set("keep_running", keep_running)
+
+    def get_data_version(self) -> dict:
+        """
+        Cheap fingerprint of the pipeline files and state, for caching
+        anything derived from them.
+        """
+        version = {name: file_signature(path) for name, path in self.paths.items()}
+        version["manifest"] = file_signature(self.manifest_path)
+        version["state"] = self.store.snapshot()
+        return version
+
+    def get_manifest(self) -> dict:
+        """Returns the sidecar manifest maintained by ingest and enrichment."""
+        return get_cached_stats(self.manifest_path, load_json) or {}
+
+    def get_enriched_stats(self) -> dict:
+        """
+        Returns the counters for the enriched file. They come from the manifest
+        when it matches the file on disk, otherwise from a one-off scan.
+        """
+        signature = file_signature(self.paths["watch_history_enriched"])
+        if signature is None:
+            stats = dict(EMPTY_ENRICHED_SUMMARY)
+        else:
+            manifest = self.get_manifest()
+            if manifest.get("enriched_signature") == list(signature):
+                stats = manifest["enriched"]
+            else:
+                stats = get_cached_stats(
+                    self.paths["watch_history_enriched"], summarize_enriched_file
+                )
+        return {
+            **stats,
+            "years": sorted(int(year) for year in stats.get("year_counts", {})),
+        }
 
     def get_enriched_rows(self) -> int:
         """Returns the number of processed rows with a valid duration."""
-        enriched_data_path = self.get_enriched_data_path()
-        if os.path.exists(enriched_data_path):
-            df = pd.read_csv(enriched_data_path)
-            return df["duration_seconds"].notna().sum()
-        return 0
+        return self.get_enriched_stats()["enriched_rows"]
 
     def get_processed_rows(self) -> int:
-        """Returns the number of processed rows with a valid duration."""
-        enriched_data_path = self.get_enriched_data_path()
-        if os.path.exists(enriched_data_path):
-            df = pd.read_csv(enriched_data_path)
-            return len(df)
-        return 0
+        """Returns the number of processed rows."""
+        return self.get_enriched_stats()["processed_rows"]
 
     def get_years(self) -> list:
         """Returns a sorted list of unique years from the 'watch_time_dt' column."""
         try:
-            enriched_data_path = self.get_enriched_data_path()
-            if os.path.exists(enriched_data_path):
-                df = pd.read_csv(enriched_data_path)
-                # Ensure 'watch_time_dt' is parsed as datetime
-                df["watch_time_dt"] = pd.to_datetime(
-                    df["watch_time_dt"], errors="coerce", utc=True
-                )
-                years = df["watch_time_dt"].dropna().dt.year.unique()
-                years = years.tolist()
-                return sorted(years)
+            return list(self.get_enriched_stats()["years"])
         except Exception as e:
             print(f"Error getting years: {e}")
-            pass
         return []
 
     def get_missing_rows(self) -> int:
         """Returns the number of rows with errors indicating 'not found'."""
-        enriched_data_path = self.get_enriched_data_path()
-        if os.path.exists(enriched_data_path):
-            df = pd.read_csv(enriched_data_path)
-            filtered_df = df[
-                df["error"].astype(str).str.contains("not found", case=False, na=False)
-            ]
-            return len(filtered_df)
-        return 0
+        return self.get_enriched_stats()["missing_rows"]
 
     def get_total_rows(self) -> int:
         """Returns the total number of rows."""
-        watch_history_csv_path = self.get_watch_history_csv_path()
-        if os.path.exists(watch_history_csv_path):
-            df = pd.read_csv(watch_history_csv_path)
-            return len(df)
-        return 0
+        signature = file_signature(self.paths["watch_history_csv"])
+        if signature is None:
+            return 0
+        manifest = self.get_manifest()
+        if manifest.get("source_signature") == list(signature):
+            return manifest["total_rows"]
+        stats = get_cached_stats(self.paths["watch_history_csv"], compute_source_stats)
+        return stats["total_rows"]